@@ -111,6 +111,38 @@ STATICFILES_DIRS = [BASE_DIR / "static"]
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Artefactos de importación parseados (indexados por hash de contenido del Excel).
+IMPORT_CACHE_DIR = Path(os.getenv("IMPORT_CACHE_DIR", str(BASE_DIR / ".import_cache")))
+# Días sin uso tras los que el worker de importaciones (o limpiar_cache_importaciones) borra un artefacto.
+IMPORT_CACHE_MAX_AGE_DAYS = float(os.getenv("IMPORT_CACHE_MAX_AGE_DAYS", "7"))
+# Segundos entre latidos de un trabajo de importación en curso (ver procesar_importaciones --stale-minutes).
+IMPORT_JOB_HEARTBEAT_SECONDS = float(os.getenv("IMPORT_JOB_HEARTBEAT_SECONDS", "30"))
+
+# Cache compartido entre procesos para consultas Microsip (por defecto en disco; en producción
+# conviene un backend con `add` atómico como Redis/Memcached/DatabaseCache).
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "microsip": {
+        "BACKEND": os.getenv("MICROSIP_CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        "LOCATION": os.getenv("MICROSIP_CACHE_LOCATION", str(BASE_DIR / ".microsip_cache")),
+    },
+    # Resumen del queue (api/queue/summary/): se invalida en cada refresco de la proyección del queue. Va en
+    # un cache compartido entre procesos para que la invalidación llegue a todos (un locmem solo se
+    # enteraría en el proceso que hizo el cambio), separado del de Microsip para que limpiar uno no vacíe el otro.
+    "queue": {
+        "BACKEND": os.getenv("QUEUE_SUMMARY_CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        "LOCATION": os.getenv("QUEUE_SUMMARY_CACHE_LOCATION", str(BASE_DIR / ".queue_cache")),
+    },
+}
+QUEUE_SUMMARY_CACHE_ALIAS = os.getenv("QUEUE_SUMMARY_CACHE_ALIAS", "queue")
+QUEUE_SUMMARY_CACHE_TTL = int(os.getenv("QUEUE_SUMMARY_CACHE_TTL", "15"))
+MICROSIP_CACHE_TTL = int(os.getenv("MICROSIP_CACHE_TTL", "300"))
+MICROSIP_CACHE_STALE_SECONDS = int(os.getenv("MICROSIP_CACHE_STALE_SECONDS", "3600"))
+# Origen de datos Microsip: "firebird" (producción) o "sqlite" (sustituto local para pruebas de carga,
+# ver manage.py generar_microsip_sintetico).
+MICROSIP_SOURCE = os.getenv("MICROSIP_SOURCE", "firebird")
+MICROSIP_SQLITE_PATH = os.getenv("MICROSIP_SQLITE_PATH", str(BASE_DIR / "microsip_sintetico.sqlite"))
+
 _BANXICO_FILE = BASE_DIR.parent / ".secrets" / "banxico.env"
 _banxico_token_file = ""
 if _BANXICO_FILE.exists():
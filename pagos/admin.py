@@ -9,12 +9,15 @@ from .models import (
     DebtSnapshot,
     Deduccion,
     DocumentoCompra,
+    ImportJob,
     ImportRowLog,
     ImportRun,
     InvoiceValidationResult,
+    MicrosipSaldoCliente,
     PagoCompra,
     PersonaFactura,
     Productor,
+    QueueEntry,
     TipoCambio,
     WorkflowEvent,
 )
@@ -123,6 +126,7 @@ class DebtSnapshotAdmin(admin.ModelAdmin):
     list_display = ("id", "compra", "fuente", "total_usd", "total_mxn", "created_at")
     list_filter = ("fuente", "created_at")
     search_fields = ("compra__numero_compra", "compra__productor__nombre")
+    raw_id_fields = ("compra", "payload")
 
 
 @admin.register(Deduccion)
@@ -148,13 +152,35 @@ class InvoiceValidationResultAdmin(admin.ModelAdmin):
 
 @admin.register(ImportRun)
 class ImportRunAdmin(admin.ModelAdmin):
-    list_display = ("id", "source_name", "dry_run", "created_count", "duplicate_count", "division_count", "error_count", "created_at")
+    list_display = ("id", "source_name", "dry_run", "created_count", "duplicate_count", "division_count", "error_count", "unchanged_count", "created_at")
     list_filter = ("dry_run", "created_at")
     search_fields = ("source_name",)
 
 
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "tipo", "status", "nombre_original", "rows_parsed", "created_count", "conflict_count", "error_count", "worker_id", "created_at")
+    list_filter = ("tipo", "status", "created_at")
+    search_fields = ("nombre_original", "error_message")
+
+
 @admin.register(ImportRowLog)
 class ImportRowLogAdmin(admin.ModelAdmin):
     list_display = ("id", "run", "row_number", "status", "compra_numero", "productor_nombre")
     list_filter = ("status", "created_at")
     search_fields = ("message", "productor_nombre")
+
+
+@admin.register(MicrosipSaldoCliente)
+class MicrosipSaldoClienteAdmin(admin.ModelAdmin):
+    list_display = ("cliente_id", "nombre", "rfc", "moneda_id", "saldo_pendiente", "remision_pendiente", "total", "updated_at")
+    list_filter = ("moneda_id",)
+    search_fields = ("nombre", "rfc", "cliente_base")
+
+
+@admin.register(QueueEntry)
+class QueueEntryAdmin(admin.ModelAdmin):
+    list_display = ("compra", "queue_state", "workflow_state", "priority", "fecha_liq", "flujo_step", "computed_for", "updated_at")
+    list_filter = ("queue_state", "workflow_state")
+    search_fields = ("compra__numero_compra",)
+    raw_id_fields = ("compra",)
@@ -1,20 +1,22 @@
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
 
-from .models import Compra, WorkflowStateChoices
+from .models import Compra, ImportJob
+from .services import cached_queue_summary, import_job_status, microsip_pool_stats
 
 
 @login_required
 def api_queue_summary(request):
-    base = Compra.objects.filter(cancelada=False)
-    data = {
-        "WAITING_INVOICE": base.filter(workflow_state=WorkflowStateChoices.WAITING_INVOICE).count(),
-        "INVOICE_BLOCKED": base.filter(workflow_state=WorkflowStateChoices.INVOICE_BLOCKED).count(),
-        "WAITING_BANK_CONFIRMATION": base.filter(workflow_state=WorkflowStateChoices.WAITING_BANK_CONFIRMATION).count(),
-        "READY_TO_PAY": base.filter(workflow_state=WorkflowStateChoices.READY_TO_PAY).count(),
-        "PAID": base.filter(workflow_state=WorkflowStateChoices.PAID).count(),
-    }
-    return JsonResponse({"ok": True, "summary": data})
+    # Compras no canceladas por workflow_state (bases con divisiones incluidas) en un solo aggregate, con cache corto.
+    # Los tableros que reenvían la ETag reciben 304 sin cuerpo mientras el resumen no cambie.
+    summary, etag = cached_queue_summary()
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse({"ok": True, "summary": summary})
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 @login_required
@@ -38,3 +40,17 @@ def api_compra_detail(request, compra_id: int):
             },
         }
     )
+
+
+@login_required
+def api_import_job_status(request, job_id: int):
+    job = ImportJob.objects.filter(pk=job_id).first()
+    if not job:
+        return JsonResponse({"ok": False, "error": "not_found"}, status=404)
+    return JsonResponse({"ok": True, "job": import_job_status(job)})
+
+
+@login_required
+def api_microsip_pool_stats(request):
+    # Métricas del pool de conexiones Microsip de este proceso (checkouts, espera, conexiones abiertas).
+    return JsonResponse({"ok": True, "pool": microsip_pool_stats()})
@@ -908,8 +908,26 @@ class CompraDivisionEstadoForm(BootstrapFormMixin, forms.ModelForm):
         labels = {"division_revisada": "Division revisada/completa"}
 
 
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+
+class MultipleFileField(forms.FileField):
+    """Uno o varios archivos; `cleaned_data` siempre es una lista."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("widget", MultipleFileInput())
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        single_file_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            return [single_file_clean(d, initial) for d in data]
+        return [single_file_clean(data, initial)]
+
+
 class ImportComprasExcelForm(BootstrapFormMixin, forms.Form):
-    archivo = forms.FileField(label="Archivo Excel de algodon.net")
+    archivo = MultipleFileField(label="Archivo(s) Excel de algodon.net")
     conflict_policy = forms.ChoiceField(
         label="Si hay conflicto de compra existente",
         choices=[
@@ -923,7 +941,7 @@ class ImportComprasExcelForm(BootstrapFormMixin, forms.Form):
 
 
 class ImportAnticiposExcelForm(BootstrapFormMixin, forms.Form):
-    archivo = forms.FileField(label="Archivo Excel de anticipos")
+    archivo = MultipleFileField(label="Archivo(s) Excel de anticipos")
 
 
 class CompraDivisionCreateForm(BootstrapFormMixin, forms.Form):
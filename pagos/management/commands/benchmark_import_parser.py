@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+
+from pagos.models import SiNoChoices, WorkflowStateChoices
+from pagos.services.imports import _name_signature, _norm_col, _parse_compras_rows, _to_date, _to_decimal
+
+HEADERS = [
+    "COMPRA",
+    "PRODUCTOR",
+    "FECHA LIQ",
+    "FECHA DE PAGO",
+    "REGIMEN FISCAL",
+    "FACTURA",
+    "UUID FACTURA",
+    "PACAS",
+    "ANTICIPO",
+    "PAGO",
+    "RETENCION (DEUDAS) USD",
+    "RETENCION (DEUDAS) MXN",
+    "SALDO PENDIENTE",
+    "CUENTA DE PAGO",
+    "METODO DE PAGO",
+    "INTERESES",
+    "",
+    "TOTAL DLLS LIBRAS",
+]
+
+
+def synthetic_rows(n: int, seed: int = 7) -> list[tuple]:
+    """Filas estilo reporte Crystal: fechas como texto dd/mm/yyyy, importes con comas y el total
+    de libras una celda a la izquierda de su encabezado en parte de las filas."""
+    rnd = random.Random(seed)
+    start = date(2025, 9, 1)
+    rows = []
+    for i in range(n):
+        f = start + timedelta(days=rnd.randrange(200))
+        total = f"{rnd.uniform(1000, 90000):,.2f}"
+        crystal = i % 3 == 0
+        rows.append(
+            (
+                str(1000 + i // 2),
+                f"PRODUCTOR {rnd.randrange(400)}",
+                f.strftime("%d/%m/%Y"),
+                (f + timedelta(days=30)).strftime("%d/%m/%Y"),
+                "RESICO",
+                f"F-{i}",
+                "",
+                rnd.randrange(1, 200),
+                0,
+                "",
+                f"{rnd.uniform(0, 500):.2f}",
+                None,
+                "",
+                "",
+                "TRANSFERENCIA",
+                "NO",
+                total if crystal else None,
+                None if crystal else total,
+            )
+        )
+    return rows
+
+
+_BASE_ALIASES = {
+    "FECHA LIQ": ["FECHA LIQ", "FECHA"],
+    "COMPRA EN LIBRAS": [
+        "TOTAL DLLS LIBRAS",
+        "TOTAL DLS LIBRAS",
+        "TOTAL DOLLARS LIBRAS",
+        "COMPRA EN LIBRAS",
+        "TOTAL EN DLS",
+        "TOTAL DLLS",
+        "TOTAL DLS",
+    ],
+    "PACAS": ["PACAS", "CANT"],
+    "RETENCION (DEUDAS) USD": ["RETENCION (DEUDAS) USD", "RETENCION", "RETENCIÓN"],
+}
+
+
+def baseline_parse(headers: list[str], body, first_row: int):
+    """Camino anterior a _ComprasPlan, como referencia: `val()` por celda que normaliza los alias
+    en cada búsqueda y convierte fila por fila."""
+    idx = {h: i for i, h in enumerate(headers)}
+
+    def val(r, key, default=None):
+        for k in _BASE_ALIASES.get(key, [key]):
+            i = idx.get(_norm_col(k))
+            if i is None or i >= len(r):
+                continue
+            v = r[i]
+            if key == "COMPRA EN LIBRAS" and (v is None or (isinstance(v, str) and not v.strip())):
+                if i - 1 >= 0:
+                    left = r[i - 1]
+                    if left is not None and (not isinstance(left, str) or left.strip()):
+                        return left
+            if v is None:
+                continue
+            if isinstance(v, str) and not v.strip():
+                continue
+            return v
+        return default
+
+    for offset, row in enumerate(body, start=first_row):
+        numero = int(_to_decimal(val(row, "COMPRA", 0)))
+        if numero <= 0:
+            continue
+        productor_nombre = str(val(row, "PRODUCTOR", "") or "").strip()
+        if not productor_nombre:
+            continue
+        fecha_liq = _to_date(val(row, "FECHA LIQ", date.today()))
+        rec = {
+            "numero_compra": numero,
+            "productor_nombre": productor_nombre,
+            "fecha_liq": fecha_liq,
+            "fecha_de_pago": _to_date(val(row, "FECHA DE PAGO", fecha_liq)),
+            "regimen_fiscal": str(val(row, "REGIMEN FISCAL", "") or "").strip(),
+            "factura": str(val(row, "FACTURA", "") or "").strip(),
+            "uuid_factura": str(val(row, "UUID FACTURA", "") or "").strip(),
+            "pacas": _to_decimal(val(row, "PACAS", 0)),
+            "compra_en_libras": _to_decimal(val(row, "COMPRA EN LIBRAS", 0)),
+            "anticipo": _to_decimal(val(row, "ANTICIPO", 0)),
+            "pago": _to_decimal(val(row, "PAGO", 0)),
+            "retencion_deudas_usd": _to_decimal(val(row, "RETENCION (DEUDAS) USD", 0)),
+            "retencion_deudas_mxn": _to_decimal(val(row, "RETENCION (DEUDAS) MXN", 0)),
+            "retencion_resico": _to_decimal(val(row, "RETENCION RESICO 1.25%", 0)),
+            "saldo_pendiente": _to_decimal(val(row, "SALDO PENDIENTE", 0)),
+            "cuenta_de_pago": str(val(row, "CUENTA DE PAGO", "") or "").strip(),
+            "metodo_de_pago": str(val(row, "METODO DE PAGO", "") or "").strip(),
+            "cuenta_productor": str(val(row, "CUENTA PRODUCTOR", "") or "").strip(),
+            "workflow_state": WorkflowStateChoices.IMPORTED,
+            "intereses": SiNoChoices.SI
+            if str(val(row, "INTERESES", "NO") or "NO").strip().upper() in {"SI", "S", "YES", "Y"}
+            else SiNoChoices.NO,
+        }
+        yield offset, (numero, _name_signature(productor_nombre), fecha_liq), rec
+
+
+def _best_of(repeat: int, fn) -> tuple[float, list]:
+    best, out = None, []
+    for _ in range(max(repeat, 1)):
+        t0 = time.perf_counter()
+        out = list(fn())
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark del mapeo/conversión de columnas de COMPRAS (sin E/S de Excel) contra el camino "
+        "anterior de val() por fila."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50000, help="Filas sintéticas")
+        parser.add_argument("--repeat", type=int, default=3, help="Repeticiones (se reporta la mejor)")
+
+    def handle(self, *args, **options):
+        n = max(options["rows"], 1)
+        rows = synthetic_rows(n)
+        headers = [_norm_col(h) for h in HEADERS]
+        repeat = options["repeat"]
+        base, base_out = _best_of(repeat, lambda: baseline_parse(headers, iter(rows), 3))
+        best, out = _best_of(repeat, lambda: _parse_compras_rows(headers, iter(rows), 3))
+        self.stdout.write(f"base (val por fila): mejor={base:.3f}s por_fila={base / n * 1e6:.1f}us")
+        self.stdout.write(f"plan por columnas:   mejor={best:.3f}s por_fila={best / n * 1e6:.1f}us")
+        msg = f"filas={n} registros={len(out)} mejora={base / best:.1f}x"
+        if out != base_out:
+            self.stdout.write(self.style.ERROR(f"{msg} (los registros NO coinciden con el camino base)"))
+            return
+        self.stdout.write(self.style.SUCCESS(f"{msg} (registros idénticos)"))
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pagos.services import microsip_debt
+from pagos.services.microsip_cache import invalidate_shared_cache, shared_cached
+from pagos.services.microsip_source import SQLiteSource, generate_synthetic_book, use_microsip_source
+
+
+class Command(BaseCommand):
+    help = "Benchmark del camino Microsip (resumen, agregado/índice, búsqueda, consulta por cliente) sobre el sustituto SQLite."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sqlite", help="Libro SQLite existente (ver generar_microsip_sintetico)")
+        parser.add_argument("--documentos", type=int, default=100_000, help="Cargos a generar si no se da --sqlite")
+        parser.add_argument("--busquedas", type=int, default=500, help="Búsquedas de candidatos a medir")
+        parser.add_argument("--clientes-muestra", type=int, default=50, help="Consultas por cliente a medir")
+
+    def _timed(self, label, fn, n=1):
+        t0 = time.perf_counter()
+        out = None
+        for _ in range(n):
+            out = fn()
+        elapsed = time.perf_counter() - t0
+        per = f" ({elapsed / n * 1000:.2f}ms c/u)" if n > 1 else ""
+        self.stdout.write(f"  {label}: {elapsed * 1000:.1f}ms{per}")
+        return out
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = options["sqlite"]
+            if path:
+                if not Path(path).is_file():
+                    raise CommandError(f"No existe: {path}")
+            else:
+                path = Path(tmp) / "microsip.sqlite"
+                info = self._timed(
+                    f"generar libro ({options['documentos']} cargos)",
+                    lambda: generate_synthetic_book(path, documentos=options["documentos"]),
+                )
+                self.stdout.write(f"  -> {info}")
+            self._run(SQLiteSource(path), options)
+
+    def _run(self, source, options):
+        summary_sql = microsip_debt.SUMMARY_SQL_FILTERED.replace("__CLIENT_FILTER__", "1=1")
+        with use_microsip_source(source):
+            rows = self._timed("consulta resumen completa", lambda: microsip_debt._fetch(summary_sql))
+            # Nombre propio en el cache: no reemplaza el resumen real que sirven los workers.
+            self._timed(
+                "refresco cache compartido (consulta + publicación)",
+                lambda: shared_cached("benchmark-summary", lambda: microsip_debt._fetch(summary_sql), force=True),
+            )
+            invalidate_shared_cache("benchmark-summary")
+            index = self._timed("agregado + índice de clientes", lambda: microsip_debt._ClientIndex(rows))
+            self.stdout.write(f"  -> filas={len(rows)} clientes={len(index.clients)} tokens={len(index.tokens)}")
+
+            rnd = random.Random(3)
+            names = [rnd.choice(index.clients)["cliente"] for _ in range(max(options["busquedas"], 1))] if index.clients else [""]
+            queries = iter(names * 2)
+            self._timed(
+                "búsqueda de candidatos",
+                lambda: index.search(microsip_debt._safe_like_token(next(queries)), limit=12),
+                n=len(names),
+            )
+            ids = [int(r["CLIENTE_ID"]) for r in rows]
+            sample = [rnd.choice(ids) for _ in range(max(options["clientes_muestra"], 1))] if ids else [0]
+            picks = iter(sample)
+            self._timed("consulta por cliente", lambda: microsip_debt._fetch_client_rows([next(picks)]), n=len(sample))
+            self.stdout.write(self.style.SUCCESS(f"pool: {microsip_debt.get_microsip_pool().stats()}"))
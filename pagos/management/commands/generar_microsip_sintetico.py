@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pagos.services.microsip_source import generate_synthetic_book
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera un libro de cuentas por cobrar sintético en SQLite con el esquema de Microsip "
+        "(usar con MICROSIP_SOURCE=sqlite y MICROSIP_SQLITE_PATH)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("salida", help="Ruta del archivo .sqlite (se reemplaza)")
+        parser.add_argument("--documentos", type=int, default=10_000, help="Cargos de venta (10k a 1M)")
+        parser.add_argument("--clientes", type=int, default=None, help="Clientes base (por defecto documentos/20)")
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **options):
+        if options["documentos"] < 1:
+            raise CommandError("--documentos debe ser mayor a 0")
+        t0 = time.perf_counter()
+        info = generate_synthetic_book(
+            options["salida"], documentos=options["documentos"], clientes=options["clientes"], seed=options["seed"]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{options['salida']}: clientes={info['clientes']} doctos_cc={info['documentos_cc']} "
+                f"cargos={info['cargos']} remisiones={info['remisiones']} tiempo={time.perf_counter() - t0:.1f}s"
+            )
+        )
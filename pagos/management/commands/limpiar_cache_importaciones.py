@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pagos.services import evict_import_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra del cache de importación (IMPORT_CACHE_DIR) los artefactos parseados sin uso en N días "
+        "y los temporales huérfanos. Solo verificación por defecto."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--apply", action="store_true", help="Borrar los archivos")
+        parser.add_argument(
+            "--dias",
+            type=float,
+            default=None,
+            help="Días sin uso (por defecto IMPORT_CACHE_MAX_AGE_DAYS)",
+        )
+
+    def handle(self, *args, **options):
+        dias = options["dias"] if options["dias"] is not None else getattr(settings, "IMPORT_CACHE_MAX_AGE_DAYS", 7)
+        removed = evict_import_cache(dias, dry_run=not options["apply"])
+        mode = "APLICADO" if options["apply"] else "VERIFICACIÓN (usa --apply para borrar)"
+        self.stdout.write(self.style.SUCCESS(f"{mode}: archivos sin uso en {dias:g} días={len(removed)}"))
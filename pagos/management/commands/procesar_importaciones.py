@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from pagos.models import ImportJobStatusChoices
+from pagos.services import claim_next_import_job, evict_import_cache, fail_stale_import_jobs, import_worker_id, run_import_job
+
+
+class Command(BaseCommand):
+    help = "Worker de importaciones en segundo plano: procesa ImportJob pendientes (sin broker externo)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Procesar la cola pendiente y salir")
+        parser.add_argument("--sleep", type=float, default=2.0, help="Segundos de espera cuando la cola está vacía")
+        parser.add_argument(
+            "--stale-minutes",
+            type=int,
+            default=5,
+            help=(
+                "Marcar como fallidos los trabajos RUNNING sin latido en N minutos (worker interrumpido). "
+                "Un worker vivo late cada IMPORT_JOB_HEARTBEAT_SECONDS aunque no reporte avance."
+            ),
+        )
+
+    def _fail_stale(self, minutes: int, worker_id: str):
+        taken = fail_stale_import_jobs(minutes, worker_id=worker_id)
+        if taken:
+            self.stderr.write(self.style.WARNING(f"Trabajos interrumpidos marcados como fallidos: {len(taken)}"))
+
+    def _evict_cache(self):
+        removed = evict_import_cache()
+        if removed:
+            self.stdout.write(f"Cache de importación: artefactos sin uso borrados={len(removed)}")
+
+    def handle(self, *args, **options):
+        worker_id = import_worker_id()
+        stale_minutes = max(options["stale_minutes"], 1)
+        self._fail_stale(stale_minutes, worker_id)
+        last_check = time.monotonic()
+        self._evict_cache()
+        self.stdout.write(f"Worker de importaciones iniciado ({worker_id}).")
+        try:
+            while True:
+                job = claim_next_import_job(worker_id)
+                if job is None:
+                    if options["once"]:
+                        break
+                    # Sin cola: revisa de vez en cuando trabajos de otros workers que dejaron de latir.
+                    if time.monotonic() - last_check >= 60:
+                        self._fail_stale(stale_minutes, worker_id)
+                        last_check = time.monotonic()
+                    time.sleep(max(options["sleep"], 0.1))
+                    continue
+                self.stdout.write(f"Procesando {job}...")
+                job = run_import_job(job)
+                style = self.style.SUCCESS if job.status == ImportJobStatusChoices.DONE else self.style.ERROR
+                self.stdout.write(
+                    style(
+                        f"{job}: filas={job.rows_parsed} creadas={job.created_count} "
+                        f"conflictos={job.conflict_count} errores={job.error_count}"
+                    )
+                )
+                self._evict_cache()
+        except KeyboardInterrupt:
+            self.stdout.write("Worker detenido.")
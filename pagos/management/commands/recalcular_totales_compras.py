@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from pagos.services import recalcular_totales_compras
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifica (y con --apply reconstruye) los totales materializados de Compra: pagado, anticipos "
+        "aplicados, monto dividido, deducciones y saldo por pagar. Solo verificación por defecto."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--apply", action="store_true", help="Guardar los valores recalculados")
+        parser.add_argument("--detalle", action="store_true", help="Listar cada compra con diferencia")
+
+    def handle(self, *args, **options):
+        result = recalcular_totales_compras(dry_run=not options["apply"])
+        if options["detalle"]:
+            for d in result.diferencias:
+                cambios = ", ".join(f"{k} {v[0]} -> {v[1]}" for k, v in d.items() if k not in ("compra_id", "numero_compra"))
+                self.stdout.write(f"  compra {d['numero_compra']} (id={d['compra_id']}): {cambios}")
+        mode = "APLICADO" if options["apply"] else "VERIFICACIÓN (usa --apply para corregir)"
+        style = self.style.SUCCESS if options["apply"] or not result.corregidas else self.style.WARNING
+        self.stdout.write(style(f"{mode}: revisadas={result.revisadas} con_diferencia={result.corregidas}"))
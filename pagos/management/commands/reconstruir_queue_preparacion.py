@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from pagos.services import rebuild_queue_entries, refresh_stale_queue_entries, stale_queue_entries
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula desde cero la proyección del queue de preparación de pagos (QueueEntry) y la compara "
+        "con la guardada: faltantes, sobrantes y filas distintas. Con --apply la reemplaza y la marca como construida "
+        "(hasta entonces el queue se calcula al vuelo). Solo verificación por defecto. "
+        "Con --reenvejecer solo recalcula las filas de días anteriores (antigüedad); programar diario con --apply."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--apply", action="store_true", help="Guardar la proyección recalculada")
+        parser.add_argument("--detalle", action="store_true", help="Listar cada compra con diferencia")
+        parser.add_argument(
+            "--reenvejecer",
+            action="store_true",
+            help="Solo recalcular las filas calculadas en un día anterior (ejecución diaria)",
+        )
+
+    def handle(self, *args, **options):
+        if options["reenvejecer"]:
+            if options["apply"]:
+                n = refresh_stale_queue_entries()
+                self.stdout.write(self.style.SUCCESS(f"APLICADO: filas re-envejecidas={n}"))
+            else:
+                n = stale_queue_entries().count()
+                style = self.style.WARNING if n else self.style.SUCCESS
+                self.stdout.write(style(f"VERIFICACIÓN (usa --apply para corregir): filas de días anteriores={n}"))
+            return
+
+        result = rebuild_queue_entries(dry_run=not options["apply"])
+        if options["detalle"]:
+            for d in result.diferencias:
+                if d.get("faltante"):
+                    self.stdout.write(f"  compra id={d['compra_id']}: falta en la proyección")
+                elif d.get("sobrante"):
+                    self.stdout.write(f"  compra id={d['compra_id']}: sobra en la proyección")
+                else:
+                    cambios = ", ".join(f"{k} {v[0]} -> {v[1]}" for k, v in d.items() if k != "compra_id")
+                    self.stdout.write(f"  compra id={d['compra_id']}: {cambios}")
+        mode = "APLICADO" if options["apply"] else "VERIFICACIÓN (usa --apply para corregir)"
+        diferencias = result.faltantes + result.sobrantes + result.distintas
+        style = self.style.SUCCESS if options["apply"] or not diferencias else self.style.WARNING
+        self.stdout.write(
+            style(
+                f"{mode}: revisadas={result.revisadas} faltantes={result.faltantes} "
+                f"sobrantes={result.sobrantes} distintas={result.distintas}"
+            )
+        )
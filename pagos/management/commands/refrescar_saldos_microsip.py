@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from pagos.services import refresh_microsip_balances
+
+
+class Command(BaseCommand):
+    help = "Actualiza los saldos Microsip locales por cliente (incremental por marca de agua; --completo reconstruye)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--completo", action="store_true", help="Reconstruir desde cero (reconcilia cancelaciones)")
+        parser.add_argument("--loop", action="store_true", help="Repetir cada --intervalo segundos")
+        parser.add_argument("--intervalo", type=float, default=60.0, help="Segundos entre corridas con --loop")
+
+    def _run(self, full: bool):
+        t0 = time.perf_counter()
+        r = refresh_microsip_balances(full=full)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{r.mode}: importes_nuevos={r.importes_nuevos} cargos_abiertos={r.cargos_abiertos} "
+                f"clientes_actualizados={r.clientes_actualizados} catalogo={r.catalogo_cambios} marca={r.watermark} "
+                f"tiempo={time.perf_counter() - t0:.2f}s"
+            )
+        )
+
+    def handle(self, *args, **options):
+        self._run(options["completo"])
+        if not options["loop"]:
+            return
+        try:
+            while True:
+                time.sleep(max(options["intervalo"], 1.0))
+                try:
+                    self._run(False)
+                except Exception as e:
+                    # Microsip no disponible: se reintenta en la siguiente vuelta sin detener el ciclo.
+                    self.stderr.write(self.style.ERROR(f"Error al refrescar saldos: {e}"))
+        except KeyboardInterrupt:
+            self.stdout.write("Refresco detenido.")
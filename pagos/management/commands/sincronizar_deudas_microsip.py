@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from pagos.services import sync_microsip_debt_for_open_compras
+
+
+class Command(BaseCommand):
+    help = "Sincroniza deudas Microsip de todas las compras abiertas (no pagadas, no canceladas). Dry-run por defecto."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--apply", action="store_true", help="Guardar snapshots y deudas")
+        parser.add_argument(
+            "--usar-cache",
+            action="store_true",
+            help="Usar el espejo local de saldos (o el resumen Microsip en cache) en lugar de consultarlo al momento",
+        )
+        parser.add_argument("--detalle", action="store_true", help="Listar cada compra con cambio")
+
+    def handle(self, *args, **options):
+        result = sync_microsip_debt_for_open_compras(dry_run=not options["apply"], force=not options["usar_cache"])
+        if options["detalle"]:
+            for c in result.changes:
+                self.stdout.write(
+                    f"  compra {c['numero_compra']} (id={c['compra_id']}) {c['productor']}: "
+                    f"USD {c['usd_antes']:,.2f} -> {c['usd']:,.2f} | MXN {c['mxn_antes']:,.2f} -> {c['mxn']:,.2f}"
+                )
+        mode = "APLICADO" if options["apply"] else "DRY-RUN (usa --apply para guardar)"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{mode}: sincronizadas={result.synced} con_cambio={result.changed} sin_mapeo={result.unmapped} "
+                f"delta_usd={result.delta_usd:,.2f} delta_mxn={result.delta_mxn:,.2f}"
+            )
+        )
@@ -0,0 +1,47 @@
+# Generated by Django 6.0.2 on 2026-10-17 13:11
+
+import django.db.models.deletion
+import pagos.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pagos', '0033_alter_compra_porcentaje_division'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tipo', models.CharField(choices=[('COMPRAS', 'Compras'), ('ANTICIPOS', 'Anticipos')], max_length=20)),
+                ('status', models.CharField(choices=[('PENDING', 'En cola'), ('RUNNING', 'Procesando'), ('DONE', 'Terminado'), ('FAILED', 'Falló')], db_index=True, default='PENDING', max_length=20)),
+                ('archivo', models.FileField(upload_to=pagos.models.import_job_upload_to)),
+                ('nombre_original', models.CharField(blank=True, max_length=255)),
+                ('conflict_policy', models.CharField(default='ask', max_length=20)),
+                ('conflict_resolutions', models.JSONField(blank=True, default=dict)),
+                ('rows_total', models.IntegerField(default=0)),
+                ('rows_parsed', models.IntegerField(default=0)),
+                ('created_count', models.IntegerField(default=0)),
+                ('updated_count', models.IntegerField(default=0)),
+                ('duplicate_count', models.IntegerField(default=0)),
+                ('division_count', models.IntegerField(default=0)),
+                ('conflict_count', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('error_message', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('creado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to=settings.AUTH_USER_MODEL)),
+                ('run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='pagos.importrun')),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-17 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pagos', '0034_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compra',
+            name='import_fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='unchanged_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importrun',
+            name='unchanged_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-17 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pagos', '0035_import_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='archivos_extra',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='importrowlog',
+            name='archivo',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
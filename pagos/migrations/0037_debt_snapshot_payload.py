@@ -0,0 +1,60 @@
+# Generated by Django 6.0.2 on 2026-10-17 16:05
+
+import hashlib
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def _digest(rows):
+    # Mismo JSON canónico que DebtSnapshotPayload.digest.
+    canonical = json.dumps(rows, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def move_rows_to_payloads(apps, schema_editor):
+    # Saca `rows` de detalle_json a payloads compartidos por contenido.
+    DebtSnapshot = apps.get_model("pagos", "DebtSnapshot")
+    DebtSnapshotPayload = apps.get_model("pagos", "DebtSnapshotPayload")
+    by_sha = {}
+    for snap in DebtSnapshot.objects.filter(payload__isnull=True).iterator():
+        detalle = dict(snap.detalle_json or {})
+        if "rows" not in detalle:
+            continue
+        rows = detalle.pop("rows") or []
+        sha = _digest(rows)
+        payload = by_sha.get(sha)
+        if payload is None:
+            payload, _ = DebtSnapshotPayload.objects.get_or_create(sha256=sha, defaults={"rows_json": rows})
+            by_sha[sha] = payload
+        DebtSnapshot.objects.filter(pk=snap.pk).update(payload=payload, detalle_json=detalle)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pagos', '0036_import_multiples_archivos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DebtSnapshotPayload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('rows_json', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='debtsnapshot',
+            name='payload',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='snapshots', to='pagos.debtsnapshotpayload'),
+        ),
+        migrations.AddIndex(
+            model_name='debtsnapshot',
+            index=models.Index(fields=['compra', 'fuente', '-created_at', '-id'], name='debtsnap_ultimo_idx'),
+        ),
+        migrations.RunPython(move_rows_to_payloads, migrations.RunPython.noop),
+    ]
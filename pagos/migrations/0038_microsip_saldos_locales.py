@@ -0,0 +1,45 @@
+# Generated by Django 6.0.2 on 2026-10-17 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pagos', '0037_debt_snapshot_payload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MicrosipCargoAbierto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('docto_cc_id', models.BigIntegerField(unique=True)),
+                ('cliente_id', models.BigIntegerField(db_index=True)),
+                ('cargo_neto', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('abono_neto', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MicrosipSaldoCliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cliente_id', models.BigIntegerField(unique=True)),
+                ('nombre', models.CharField(blank=True, max_length=200)),
+                ('moneda_id', models.IntegerField(default=0)),
+                ('saldo_pendiente', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('remision_pendiente', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('total', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MicrosipWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tabla', models.CharField(max_length=60, unique=True)),
+                ('ultimo_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
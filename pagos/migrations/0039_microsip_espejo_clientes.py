@@ -0,0 +1,44 @@
+# Generated by Django 6.0.2 on 2026-10-17 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pagos', '0038_microsip_saldos_locales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MicrosipClienteRfc',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cliente_id', models.BigIntegerField(db_index=True)),
+                ('rfc', models.CharField(db_index=True, max_length=30)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='microsipsaldocliente',
+            name='cliente_base',
+            field=models.CharField(blank=True, db_index=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='microsipsaldocliente',
+            name='nombre_norm',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='microsipsaldocliente',
+            name='rfc',
+            field=models.CharField(blank=True, max_length=30),
+        ),
+        migrations.AddIndex(
+            model_name='microsipsaldocliente',
+            index=models.Index(condition=models.Q(('total__gt', 0)), fields=['-total'], name='msaldo_deuda_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='microsipclienterfc',
+            constraint=models.UniqueConstraint(fields=('cliente_id', 'rfc'), name='uniq_microsip_cliente_rfc'),
+        ),
+    ]
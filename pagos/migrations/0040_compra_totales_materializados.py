@@ -0,0 +1,108 @@
+# Generated by Django 6.0.2 on 2026-10-17 17:30
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+_Q = Decimal("0.0001")
+
+
+def _q(value):
+    return Decimal(str(value or 0)).quantize(_Q, rounding=ROUND_HALF_UP)
+
+
+def backfill_totales(apps, schema_editor):
+    # Misma regla que Compra.recalcular_totales (los modelos históricos no traen sus métodos).
+    Compra = apps.get_model("pagos", "Compra")
+    AplicacionAnticipo = apps.get_model("pagos", "AplicacionAnticipo")
+    pagos_por_compra, deducciones_por_compra = {}, {}
+    for p in apps.get_model("pagos", "PagoCompra").objects.values("compra_id", "monto", "moneda").iterator():
+        pagos_por_compra.setdefault(p["compra_id"], []).append(p)
+    for d in apps.get_model("pagos", "Deduccion").objects.values("compra_id", "monto", "moneda").iterator():
+        deducciones_por_compra.setdefault(d["compra_id"], []).append(d)
+    aplicado = dict(AplicacionAnticipo.objects.values("compra_id").annotate(t=Sum("monto_aplicado")).values_list("compra_id", "t"))
+    pct = dict(
+        Compra.objects.filter(parent_compra__isnull=False)
+        .values("parent_compra_id")
+        .annotate(t=Sum("porcentaje_division"))
+        .values_list("parent_compra_id", "t")
+    )
+
+    batch = []
+    for c in Compra.objects.all().iterator():
+        tc = Decimal(str(c.tipo_cambio_valor or 0))
+        pagos = pagos_por_compra.get(c.id)
+        if pagos:
+            pagado = Decimal("0")
+            for p in pagos:
+                if p["moneda"] == "PESOS":
+                    pagado += _q(p["monto"] / tc) if tc > 0 else Decimal("0")
+                else:
+                    pagado += p["monto"]
+        elif c.estatus_de_pago in ("PAGADO", "PARCIAL"):
+            pagado = c.pago or Decimal("0")
+        else:
+            pagado = Decimal("0")
+        deducido = Decimal("0")
+        for d in deducciones_por_compra.get(c.id, ()):
+            if d["moneda"] == "DOLARES":
+                deducido += d["monto"]
+            elif d["moneda"] == "PESOS" and tc > 0:
+                deducido += d["monto"] / tc
+        base = c.compra_en_libras or Decimal("0")
+        es_division = c.parent_compra_id is not None
+        dividido = Decimal("0") if es_division else base * Decimal(str(pct.get(c.id) or 0)) / Decimal("100")
+
+        c.total_pagado_vigente = _q(pagado)
+        c.total_aplicado_anticipos = _q(aplicado.get(c.id))
+        c.total_deducciones_usd = _q(deducido)
+        c.total_monto_dividido = _q(dividido)
+        objetivo = base if es_division else max(base - c.total_monto_dividido, Decimal("0"))
+        c.saldo_por_pagar = _q(
+            objetivo - c.total_pagado_vigente - c.total_aplicado_anticipos - (c.total_deuda_en_dls or 0) - (c.retencion_resico or 0)
+        )
+        batch.append(c)
+        if len(batch) >= 500:
+            Compra.objects.bulk_update(batch, _CAMPOS)
+            batch = []
+    Compra.objects.bulk_update(batch, _CAMPOS)
+
+
+_CAMPOS = ["total_pagado_vigente", "total_aplicado_anticipos", "total_deducciones_usd", "total_monto_dividido", "saldo_por_pagar"]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pagos', '0039_microsip_espejo_clientes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compra',
+            name='saldo_por_pagar',
+            field=models.DecimalField(db_index=True, decimal_places=4, default=0, max_digits=16),
+        ),
+        migrations.AddField(
+            model_name='compra',
+            name='total_aplicado_anticipos',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=16),
+        ),
+        migrations.AddField(
+            model_name='compra',
+            name='total_deducciones_usd',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=16),
+        ),
+        migrations.AddField(
+            model_name='compra',
+            name='total_monto_dividido',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=16),
+        ),
+        migrations.AddField(
+            model_name='compra',
+            name='total_pagado_vigente',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=16),
+        ),
+        migrations.RunPython(backfill_totales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0.2 on 2026-10-17 18:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pagos', '0040_compra_totales_materializados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueEntry',
+            fields=[
+                ('compra', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='queue_entry', serialize=False, to='pagos.compra')),
+                ('queue_state', models.CharField(max_length=40)),
+                ('workflow_state', models.CharField(max_length=40)),
+                ('priority', models.IntegerField(default=0)),
+                ('fecha_liq', models.DateField()),
+                ('blockers', models.JSONField(blank=True, default=list)),
+                ('blocked_reason', models.TextField(blank=True)),
+                ('flujo_step', models.CharField(blank=True, max_length=40)),
+                ('computed_for', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-priority', '-fecha_liq', '-compra'], name='qentry_prio_idx'), models.Index(fields=['queue_state', '-priority', '-fecha_liq', '-compra'], name='qentry_estado_prio_idx')],
+            },
+        ),
+    ]
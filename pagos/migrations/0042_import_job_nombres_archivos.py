@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-17 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pagos', '0041_queue_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='nombres_archivos',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.2 on 2026-10-17 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pagos', '0042_import_job_nombres_archivos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueProjectionState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('construida_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-17 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pagos', '0043_queue_projection_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='worker_id',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -1,8 +1,12 @@
 from decimal import Decimal, ROUND_HALF_UP
+import hashlib
+import json
+import uuid
 from django.db import IntegrityError
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Sum
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -16,6 +20,24 @@ class TimestampedModel(models.Model):
         abstract = True
 
 
+def _refrescar_queue(filtro):
+    # Import diferido: services.readiness_queue importa este módulo.
+    from pagos.services.readiness_queue import refresh_queue_entries
+
+    refresh_queue_entries(filtro)
+
+
+def _afecta_queue(kwargs, campos) -> bool:
+    # Guardado completo o con algún campo que entra al cálculo del queue.
+    update_fields = kwargs.get("update_fields")
+    return update_fields is None or not campos.isdisjoint(update_fields)
+
+
+def _compras_por_pagar(**filtro):
+    # Cuentas bancarias y excepciones sólo afectan la validación de beneficiario (READY_TO_PAY).
+    return models.Q(cancelada=False, workflow_state=WorkflowStateChoices.READY_TO_PAY, **filtro)
+
+
 class SiNoChoices(models.TextChoices):
     SI = "SI", _("Si")
     NO = "NO", _("No")
@@ -76,6 +98,18 @@ class WorkflowStateChoices(models.TextChoices):
     ARCHIVED = "ARCHIVED", _("Archived")
 
 
+class ImportJobTipoChoices(models.TextChoices):
+    COMPRAS = "COMPRAS", _("Compras")
+    ANTICIPOS = "ANTICIPOS", _("Anticipos")
+
+
+class ImportJobStatusChoices(models.TextChoices):
+    PENDING = "PENDING", _("En cola")
+    RUNNING = "RUNNING", _("Procesando")
+    DONE = "DONE", _("Terminado")
+    FAILED = "FAILED", _("Falló")
+
+
 class Productor(TimestampedModel):
     codigo = models.CharField(max_length=40, unique=True)
     nombre = models.CharField(max_length=200)
@@ -105,6 +139,20 @@ class Productor(TimestampedModel):
         next_num = (last.id + 1) if last else 1
         return f"PRD-{next_num:05d}"
 
+    @staticmethod
+    def _next_codigos(count: int) -> list[str]:
+        # Codigos consecutivos para altas en lote (bulk_create no pasa por save()).
+        last = Productor.objects.order_by("-id").first()
+        next_num = (last.id + 1) if last else 1
+        taken = set(Productor.objects.filter(codigo__startswith="PRD-").values_list("codigo", flat=True))
+        out = []
+        while len(out) < count:
+            codigo = f"PRD-{next_num:05d}"
+            if codigo not in taken:
+                out.append(codigo)
+            next_num += 1
+        return out
+
     def save(self, *args, **kwargs):
         if not self.codigo:
             for _ in range(5):
@@ -114,7 +162,17 @@ class Productor(TimestampedModel):
                 except IntegrityError:
                     self.codigo = ""
             raise RuntimeError("No se pudo generar codigo automatico para productor.")
-        return super().save(*args, **kwargs)
+        # El RFC del productor es el único dato suyo que entra al queue (bloqueo "Falta RFC productor").
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            rfc_cambio = "rfc" in update_fields
+        else:
+            rfc_cambio = not self._state.adding and not Productor.objects.filter(pk=self.pk, rfc=self.rfc).exists()
+        with transaction.atomic():
+            result = super().save(*args, **kwargs)
+            if rfc_cambio:
+                _refrescar_queue(models.Q(productor_id=self.pk, cancelada=False))
+        return result
 
 
 class ProductorCuentaBancaria(TimestampedModel):
@@ -130,10 +188,21 @@ class ProductorCuentaBancaria(TimestampedModel):
     class Meta:
         ordering = ["-predeterminada", "banco", "cuenta"]
 
+    _QUEUE_INPUTS = frozenset({"productor", "productor_id", "cuenta", "titular"})
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        if self.predeterminada:
-            ProductorCuentaBancaria.objects.filter(productor=self.productor).exclude(pk=self.pk).update(predeterminada=False)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.predeterminada:
+                ProductorCuentaBancaria.objects.filter(productor=self.productor).exclude(pk=self.pk).update(predeterminada=False)
+            if _afecta_queue(kwargs, self._QUEUE_INPUTS):
+                _refrescar_queue(_compras_por_pagar(productor_id=self.productor_id))
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            _refrescar_queue(_compras_por_pagar(productor_id=self.productor_id))
+        return result
 
     def __str__(self):
         bank = f"{self.banco} " if self.banco else ""
@@ -153,10 +222,21 @@ class FacturadorCuentaBancaria(TimestampedModel):
     class Meta:
         ordering = ["-predeterminada", "banco", "cuenta"]
 
+    _QUEUE_INPUTS = frozenset({"facturador", "facturador_id", "cuenta", "titular"})
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        if self.predeterminada:
-            FacturadorCuentaBancaria.objects.filter(facturador=self.facturador).exclude(pk=self.pk).update(predeterminada=False)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.predeterminada:
+                FacturadorCuentaBancaria.objects.filter(facturador=self.facturador).exclude(pk=self.pk).update(predeterminada=False)
+            if _afecta_queue(kwargs, self._QUEUE_INPUTS):
+                _refrescar_queue(_compras_por_pagar(facturador_id=self.facturador_id))
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            _refrescar_queue(_compras_por_pagar(facturador_id=self.facturador_id))
+        return result
 
     def __str__(self):
         bank = f"{self.banco} " if self.banco else ""
@@ -178,6 +258,21 @@ class BeneficiaryValidationException(TimestampedModel):
     def __str__(self):
         return f"{self.productor.nombre} · {self.account_holder}"
 
+    _QUEUE_INPUTS = frozenset({"productor", "productor_id", "emisor_rfc", "account_holder", "active"})
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().save(*args, **kwargs)
+            if _afecta_queue(kwargs, self._QUEUE_INPUTS):
+                _refrescar_queue(_compras_por_pagar(productor_id=self.productor_id))
+        return result
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            _refrescar_queue(_compras_por_pagar(productor_id=self.productor_id))
+        return result
+
 
 class Contador(TimestampedModel):
     nombre = models.CharField(max_length=200)
@@ -413,6 +508,33 @@ class Compra(TimestampedModel):
         default=WorkflowStateChoices.IMPORTED,
         db_index=True,
     )
+    # Huella de la fila de Excel que originó/actualizó la compra (importación delta).
+    import_fingerprint = models.CharField(max_length=64, blank=True, db_index=True)
+    # Totales materializados (ver recalcular_totales): se leen sin consultas y se filtran/ordenan en SQL.
+    total_pagado_vigente = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    total_aplicado_anticipos = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    total_monto_dividido = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    total_deducciones_usd = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    saldo_por_pagar = models.DecimalField(max_digits=16, decimal_places=4, default=0, db_index=True)
+
+    TOTALES_FIELDS = (
+        "total_pagado_vigente",
+        "total_aplicado_anticipos",
+        "total_monto_dividido",
+        "total_deducciones_usd",
+        "saldo_por_pagar",
+    )
+    # Cambios propios que obligan a releer pagos/anticipos/deducciones/divisiones (montos en pesos usan el TC).
+    _TOTALES_INPUTS = frozenset({"compra_en_libras", "tipo_cambio", "tipo_cambio_valor", "pago", "estatus_de_pago", "parent_compra", "porcentaje_division"})
+    # Cambios propios que sólo mueven el saldo (se recalcula sin consultas en calcular_campos_derivados).
+    _SALDO_INPUTS = frozenset({"retencion_deudas_usd", "retencion_deudas_mxn", "total_deuda_en_dls", "retencion_resico"})
+    # Campos que entran al queue: estado, prioridad (fecha_liq, saldo), bloqueos, beneficiario y paso del flujo.
+    _QUEUE_INPUTS = frozenset({
+        "workflow_state", "solicitud_factura_enviada", "bank_account_confirmed", "cancelada", "fecha_liq",
+        "saldo_por_pagar", "parent_compra", "parent_compra_id", "productor", "productor_id", "cuenta_productor",
+        "facturador", "facturador_id", "factura", "numero_compra", "pacas", "compra_en_libras", "anticipos_revisados",
+        "deudas_revisadas", "uuid_factura", "pago", "estatus_de_pago", "fecha_de_pago",
+    })
 
     class Meta:
         ordering = ["-fecha_liq", "-id"]
@@ -424,28 +546,64 @@ class Compra(TimestampedModel):
     def base_pago(self):
         return self.total_pagado_vigente
 
-    @property
-    def total_aplicado_anticipos(self):
-        if not self.pk:
-            return Decimal("0")
-        value = self.aplicaciones_anticipo.aggregate(total=Sum("monto_aplicado"))["total"]
-        return value or Decimal("0")
-
     @property
     def monto_objetivo_operativo(self):
         base = self.compra_en_libras or Decimal("0")
         if self.es_division:
             return base
         # En compra base: si hay divisiones parciales, el objetivo operativo es el remanente.
-        remanente = base - self.total_monto_dividido
+        remanente = base - (self.total_monto_dividido or Decimal("0"))
         return remanente if remanente > 0 else Decimal("0")
 
-    @property
-    def saldo_por_pagar(self):
-        objetivo = self.monto_objetivo_operativo
+    def _calcular_saldo_por_pagar(self):
         deuda = self.total_deuda_en_dls or Decimal("0")
         resico = self.retencion_resico or Decimal("0")
-        return objetivo - self.total_pagado_vigente - self.total_aplicado_anticipos - deuda - resico
+        self.saldo_por_pagar = (
+            self.monto_objetivo_operativo
+            - (self.total_pagado_vigente or Decimal("0"))
+            - (self.total_aplicado_anticipos or Decimal("0"))
+            - deuda
+            - resico
+        ).quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
+
+    def _calcular_totales(self, pagos, aplicado, deducciones, porcentaje_dividido):
+        q = Decimal("0.0001")
+        tc = Decimal(str(self.tipo_cambio_valor or "0"))
+        # Prioridad al nuevo esquema de pagos independientes.
+        if pagos:
+            pagado = sum((p.monto_en_dolares for p in pagos), Decimal("0"))
+        # Compatibilidad legacy: solo considerar pago manual si estatus no es pendiente.
+        elif self.estatus_de_pago in (EstadoPagoChoices.PAGADO, EstadoPagoChoices.PARCIAL):
+            pagado = self.pago or Decimal("0")
+        else:
+            pagado = Decimal("0")
+        deducido = Decimal("0")
+        for d in deducciones:
+            if d.moneda == MonedaChoices.DOLARES:
+                deducido += d.monto
+            elif d.moneda == MonedaChoices.PESOS and tc > 0:
+                deducido += d.monto / tc
+        base = self.compra_en_libras or Decimal("0")
+        dividido = Decimal("0") if self.es_division else (base * Decimal(str(porcentaje_dividido or 0))) / Decimal("100")
+
+        self.total_pagado_vigente = Decimal(pagado).quantize(q, rounding=ROUND_HALF_UP)
+        self.total_aplicado_anticipos = Decimal(str(aplicado or 0)).quantize(q, rounding=ROUND_HALF_UP)
+        self.total_deducciones_usd = deducido.quantize(q, rounding=ROUND_HALF_UP)
+        self.total_monto_dividido = dividido.quantize(q, rounding=ROUND_HALF_UP)
+        self._calcular_saldo_por_pagar()
+
+    def recalcular_totales(self):
+        """Recalcula los totales materializados desde pagos, anticipos, deducciones y divisiones."""
+        if not self.pk:
+            self._calcular_totales([], 0, [], 0)
+            return
+        aplicado = self.aplicaciones_anticipo.aggregate(total=Sum("monto_aplicado"))["total"]
+        pct = 0 if self.es_division else self.divisiones.aggregate(total=Sum("porcentaje_division"))["total"]
+        self._calcular_totales(list(self.pagos_registrados.all()), aplicado, list(self.deducciones.all()), pct)
+
+    def actualizar_totales(self):
+        self.recalcular_totales()
+        self.save(update_fields=[*self.TOTALES_FIELDS, "updated_at"])
 
     @property
     def total_pagado_registrado(self):
@@ -454,16 +612,6 @@ class Compra(TimestampedModel):
             total += pago.monto_en_dolares
         return total
 
-    @property
-    def total_pagado_vigente(self):
-        # Prioridad al nuevo esquema de pagos independientes.
-        if self.pagos_registrados.exists():
-            return self.total_pagado_registrado
-        # Compatibilidad legacy: solo considerar pago manual si estatus no es pendiente.
-        if self.estatus_de_pago in (EstadoPagoChoices.PAGADO, EstadoPagoChoices.PARCIAL):
-            return self.pago or Decimal("0")
-        return Decimal("0")
-
     def actualizar_estatus_pago_desde_registros(self):
         if not self.pagos_registrados.exists():
             self.estatus_de_pago = EstadoPagoChoices.PENDIENTE
@@ -479,7 +627,8 @@ class Compra(TimestampedModel):
         else:
             self.estatus_de_pago = EstadoPagoChoices.PAGADO
 
-    def save(self, *args, **kwargs):
+    def calcular_campos_derivados(self, tc_por_fecha: dict | None = None):
+        # tc_por_fecha: mapa fecha -> TipoCambio precargado (altas en lote sin consulta por fila).
         if self.productor_id and not self.regimen_fiscal:
             self.regimen_fiscal = self.productor.regimen_fiscal
         if self.tipo_cambio_id:
@@ -488,7 +637,10 @@ class Compra(TimestampedModel):
             # Solo autocompletar desde TC diario cuando no hay TC pactado/manual capturado.
             tc_val_actual = Decimal(str(self.tipo_cambio_valor or "0"))
             if tc_val_actual <= 0:
-                tc = TipoCambio.objects.filter(fecha=self.fecha_liq).first()
+                if tc_por_fecha is not None:
+                    tc = tc_por_fecha.get(self.fecha_liq)
+                else:
+                    tc = TipoCambio.objects.filter(fecha=self.fecha_liq).first()
                 if tc:
                     self.tipo_cambio = tc
                     self.tipo_cambio_valor = tc.tc
@@ -507,7 +659,39 @@ class Compra(TimestampedModel):
                 self.total_en_pesos = self.pago * tc_val
             elif self.moneda == MonedaChoices.PESOS:
                 self.total_en_pesos = self.pago
-        return super().save(*args, **kwargs)
+        self._calcular_saldo_por_pagar()
+
+    def save(self, *args, **kwargs):
+        self.calcular_campos_derivados()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or self._TOTALES_INPUTS.intersection(update_fields):
+            self.recalcular_totales()
+            if update_fields is not None:
+                kwargs["update_fields"] = list(dict.fromkeys([*update_fields, *self.TOTALES_FIELDS]))
+        elif self._SALDO_INPUTS.intersection(update_fields):
+            kwargs["update_fields"] = list(dict.fromkeys([*update_fields, "saldo_por_pagar"]))
+        with transaction.atomic():
+            result = super().save(*args, **kwargs)
+            if self.parent_compra_id and (
+                update_fields is None or {"compra_en_libras", "porcentaje_division", "parent_compra"}.intersection(update_fields)
+            ):
+                # Una división mueve el monto dividido (y el saldo) de su compra base.
+                self.parent_compra.actualizar_totales()
+            if _afecta_queue(kwargs, self._QUEUE_INPUTS):
+                # La base también: con divisiones deja de estar en el queue.
+                _refrescar_queue(models.Q(pk=self.pk) | models.Q(pk=self.parent_compra_id))
+        return result
+
+    def delete(self, *args, **kwargs):
+        from pagos.services.readiness_queue import invalidate_queue_summary
+
+        parent = self.parent_compra if self.parent_compra_id else None
+        result = super().delete(*args, **kwargs)
+        if parent is not None:
+            parent.actualizar_totales()
+        # La fila de QueueEntry se borra en cascada; el resumen cuenta compras no canceladas.
+        invalidate_queue_summary()
+        return result
 
     def clean(self):
         super().clean()
@@ -587,13 +771,6 @@ class Compra(TimestampedModel):
         pct = (remaining_monto * Decimal("100")) / base
         return pct.quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
 
-    @property
-    def total_monto_dividido(self):
-        if self.es_division:
-            return Decimal("0")
-        base = self.compra_en_libras or Decimal("0")
-        return (base * self.total_porcentaje_dividido) / Decimal("100")
-
     @property
     def monto_disponible_division(self):
         base = self.compra_en_libras or Decimal("0")
@@ -616,10 +793,17 @@ class Compra(TimestampedModel):
     def base_pipeline_bloqueado_por_divisiones(self):
         if self.es_division:
             return False
+        # Listados (queue) lo anotan con Exists para no consultar por fila.
+        anotado = getattr(self, "q_tiene_divisiones", None)
+        if anotado is not None:
+            return anotado
         return self.divisiones.exists()
 
     @property
     def has_compra_original_pdf_for_flow(self):
+        anotado = getattr(self, "q_pdf_compra", None)
+        if anotado is not None:
+            return anotado
         own = self.documentos.filter(etapa="compra_original", archivo__iendswith=".pdf").exists()
         if own:
             return True
@@ -713,6 +897,11 @@ class Compra(TimestampedModel):
             actor=actor,
             reason=reason,
         )
+        if new_state in (WorkflowStateChoices.IMPORTED, WorkflowStateChoices.DEBT_CALCULATED):
+            # Paso "deudas": se dejan listos los candidatos Microsip para la pantalla de mapeo.
+            from pagos.services.microsip_candidates import schedule_microsip_candidates_prefetch
+
+            schedule_microsip_candidates_prefetch([self.productor_id])
 
 
 class AplicacionAnticipo(TimestampedModel):
@@ -757,14 +946,18 @@ class AplicacionAnticipo(TimestampedModel):
 
     def save(self, *args, **kwargs):
         self.full_clean()
-        result = super().save(*args, **kwargs)
-        self.anticipo.save(update_fields=["pendiente_aplicar", "updated_at"])
+        with transaction.atomic():
+            result = super().save(*args, **kwargs)
+            self.anticipo.save(update_fields=["pendiente_aplicar", "updated_at"])
+            self.compra.actualizar_totales()
         return result
 
     def delete(self, *args, **kwargs):
-        anticipo = self.anticipo
-        result = super().delete(*args, **kwargs)
-        anticipo.save(update_fields=["pendiente_aplicar", "updated_at"])
+        anticipo, compra = self.anticipo, self.compra
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            anticipo.save(update_fields=["pendiente_aplicar", "updated_at"])
+            compra.actualizar_totales()
         return result
 
 
@@ -788,6 +981,23 @@ class DocumentoCompra(TimestampedModel):
     def __str__(self):
         return f"Documento compra {self.compra_id} ({self.etapa})"
 
+    _QUEUE_INPUTS = frozenset({"compra", "compra_id", "etapa", "archivo"})
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().save(*args, **kwargs)
+            if _afecta_queue(kwargs, self._QUEUE_INPUTS):
+                # El PDF de compra original de una base también cuenta para sus divisiones.
+                _refrescar_queue(models.Q(pk=self.compra_id) | models.Q(parent_compra_id=self.compra_id))
+        return result
+
+    def delete(self, *args, **kwargs):
+        compra_id = self.compra_id
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            _refrescar_queue(models.Q(pk=compra_id) | models.Q(parent_compra_id=compra_id))
+        return result
+
 
 class PagoCompra(TimestampedModel):
     compra = models.ForeignKey(
@@ -823,28 +1033,59 @@ class PagoCompra(TimestampedModel):
         return self.monto
 
     def save(self, *args, **kwargs):
-        result = super().save(*args, **kwargs)
-        self.compra.actualizar_estatus_pago_desde_registros()
-        self.compra.save(update_fields=["pago", "estatus_de_pago", "updated_at"])
+        # Compra.save con "pago" en update_fields recalcula también los totales materializados.
+        with transaction.atomic():
+            result = super().save(*args, **kwargs)
+            self.compra.actualizar_estatus_pago_desde_registros()
+            self.compra.save(update_fields=["pago", "estatus_de_pago", "updated_at"])
         return result
 
     def delete(self, *args, **kwargs):
         compra = self.compra
-        result = super().delete(*args, **kwargs)
-        compra.actualizar_estatus_pago_desde_registros()
-        compra.save(update_fields=["pago", "estatus_de_pago", "updated_at"])
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            compra.actualizar_estatus_pago_desde_registros()
+            compra.save(update_fields=["pago", "estatus_de_pago", "updated_at"])
         return result
 
 
+class DebtSnapshotPayload(models.Model):
+    # Filas de detalle de un snapshot, guardadas una sola vez por contenido (sha256 del JSON canónico).
+    sha256 = models.CharField(max_length=64, unique=True)
+    rows_json = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def digest(rows) -> str:
+        canonical = json.dumps(rows, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def __str__(self):
+        return self.sha256[:12]
+
+
 class DebtSnapshot(TimestampedModel):
     compra = models.ForeignKey(Compra, on_delete=models.CASCADE, related_name="debt_snapshots")
     fuente = models.CharField(max_length=60, default="microsip")
     total_usd = models.DecimalField(max_digits=16, decimal_places=4, default=0)
     total_mxn = models.DecimalField(max_digits=16, decimal_places=4, default=0)
     detalle_json = models.JSONField(default=dict, blank=True)
+    payload = models.ForeignKey(
+        DebtSnapshotPayload, on_delete=models.PROTECT, null=True, blank=True, related_name="snapshots"
+    )
 
     class Meta:
         ordering = ["-created_at", "-id"]
+        indexes = [
+            # Último snapshot por compra y fuente sin ordenar toda la relación.
+            models.Index(fields=["compra", "fuente", "-created_at", "-id"], name="debtsnap_ultimo_idx"),
+        ]
+
+    @property
+    def rows(self) -> list:
+        if self.payload_id:
+            return self.payload.rows_json
+        return (self.detalle_json or {}).get("rows", [])
 
 
 class Deduccion(TimestampedModel):
@@ -858,6 +1099,19 @@ class Deduccion(TimestampedModel):
     class Meta:
         ordering = ["-created_at", "-id"]
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().save(*args, **kwargs)
+            self.compra.actualizar_totales()
+        return result
+
+    def delete(self, *args, **kwargs):
+        compra = self.compra
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            compra.actualizar_totales()
+        return result
+
 
 class XmlValidationConfig(TimestampedModel):
     class IvaPolicyChoices(models.TextChoices):
@@ -942,6 +1196,49 @@ class InvoiceValidationResult(TimestampedModel):
     class Meta:
         ordering = ["-created_at", "-id"]
 
+    # La última validación da el motivo de bloqueo y el emisor para el semáforo de beneficiario.
+    _QUEUE_INPUTS = frozenset({"compra", "compra_id", "blocked_reason", "rfc_emisor", "raw_result"})
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().save(*args, **kwargs)
+            if _afecta_queue(kwargs, self._QUEUE_INPUTS):
+                _refrescar_queue(models.Q(pk=self.compra_id))
+        return result
+
+
+class QueueEntry(models.Model):
+    # Proyección del queue de preparación de pagos, una fila por compra visible (no cancelada y sin divisiones).
+    # Se actualiza en la misma transacción que cada evento que mueve sus entradas (ver services.readiness_queue).
+    compra = models.OneToOneField(Compra, on_delete=models.CASCADE, primary_key=True, related_name="queue_entry")
+    queue_state = models.CharField(max_length=40)
+    workflow_state = models.CharField(max_length=40)
+    priority = models.IntegerField(default=0)  # centésimas de punto
+    fecha_liq = models.DateField()
+    blockers = models.JSONField(default=list, blank=True)
+    blocked_reason = models.TextField(blank=True)
+    flujo_step = models.CharField(max_length=40, blank=True)
+    computed_for = models.DateField()  # la antigüedad cuenta días: al cambiar de día la fila se recalcula
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-priority", "-fecha_liq", "-compra"], name="qentry_prio_idx"),
+            models.Index(fields=["queue_state", "-priority", "-fecha_liq", "-compra"], name="qentry_estado_prio_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.compra_id} {self.queue_state} ({self.priority})"
+
+
+class QueueProjectionState(models.Model):
+    # Fila única: la proyección QueueEntry se construyó completa (reconstruir_queue_preparacion --apply).
+    # Antes de eso los hooks ya escriben filas sueltas, así que "tabla vacía" no indica que esté lista.
+    construida_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"QueueEntry construida {self.construida_at:%Y-%m-%d %H:%M}"
+
 
 class ImportRun(TimestampedModel):
     source_name = models.CharField(max_length=255)
@@ -950,6 +1247,7 @@ class ImportRun(TimestampedModel):
     duplicate_count = models.IntegerField(default=0)
     division_count = models.IntegerField(default=0)
     error_count = models.IntegerField(default=0)
+    unchanged_count = models.IntegerField(default=0)
 
     class Meta:
         ordering = ["-created_at", "-id"]
@@ -957,6 +1255,7 @@ class ImportRun(TimestampedModel):
 
 class ImportRowLog(TimestampedModel):
     run = models.ForeignKey(ImportRun, on_delete=models.CASCADE, related_name="rows")
+    archivo = models.CharField(max_length=255, blank=True)
     row_number = models.IntegerField()
     status = models.CharField(max_length=20, default="ok")
     message = models.TextField(blank=True)
@@ -965,3 +1264,106 @@ class ImportRowLog(TimestampedModel):
 
     class Meta:
         ordering = ["row_number", "id"]
+
+
+def import_job_upload_to(instance, filename):
+    # Carpeta propia por trabajo: dos cargas con el mismo nombre no se pisan.
+    return f"import_jobs/{timezone.now():%Y/%m}/{uuid.uuid4().hex}/{filename}"
+
+
+class ImportJob(TimestampedModel):
+    tipo = models.CharField(max_length=20, choices=ImportJobTipoChoices.choices)
+    status = models.CharField(
+        max_length=20, choices=ImportJobStatusChoices.choices, default=ImportJobStatusChoices.PENDING, db_index=True
+    )
+    archivo = models.FileField(upload_to=import_job_upload_to)
+    nombre_original = models.CharField(max_length=255, blank=True)
+    # Importación de varios archivos: nombres en storage de los archivos adicionales a `archivo`.
+    archivos_extra = models.JSONField(default=list, blank=True)
+    # Nombres de carga de [archivo, *archivos_extra] en ese orden: el storage los sanea
+    # ("Semana 2 (2).xlsx" -> "Semana_2_2.xlsx") y las resoluciones de conflicto usan el nombre de carga.
+    nombres_archivos = models.JSONField(default=list, blank=True)
+    conflict_policy = models.CharField(max_length=20, default="ask")
+    conflict_resolutions = models.JSONField(default=dict, blank=True)
+    creado_por = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name="import_jobs"
+    )
+    run = models.ForeignKey(ImportRun, on_delete=models.SET_NULL, null=True, blank=True, related_name="jobs")
+    rows_total = models.IntegerField(default=0)
+    rows_parsed = models.IntegerField(default=0)
+    created_count = models.IntegerField(default=0)
+    updated_count = models.IntegerField(default=0)
+    duplicate_count = models.IntegerField(default=0)
+    division_count = models.IntegerField(default=0)
+    conflict_count = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    unchanged_count = models.IntegerField(default=0)
+    error_message = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Concesión del trabajo RUNNING: worker que lo tomó ("host:pid") y su último latido. Otro worker solo
+    # lo da por interrumpido cuando el latido vence, no por falta de avance.
+    worker_id = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at", "-id"]
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk} ({self.status})"
+
+
+class MicrosipWatermark(models.Model):
+    # Marca de agua por tabla Microsip para la actualización incremental de saldos.
+    tabla = models.CharField(max_length=60, unique=True)
+    ultimo_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.tabla}={self.ultimo_id}"
+
+
+class MicrosipCargoAbierto(models.Model):
+    # Cargo de venta Microsip con saldo (cargo - abonos > 0); los liquidados se eliminan.
+    docto_cc_id = models.BigIntegerField(unique=True)
+    cliente_id = models.BigIntegerField(db_index=True)
+    cargo_neto = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    abono_neto = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+
+
+class MicrosipSaldoCliente(models.Model):
+    # Espejo local por cliente Microsip (cada CLIENTE_ID tiene una sola moneda): catálogo + saldo.
+    # Las variantes "1 "/"2 " de un mismo cliente comparten `cliente_base`.
+    cliente_id = models.BigIntegerField(unique=True)
+    nombre = models.CharField(max_length=200, blank=True)
+    nombre_norm = models.CharField(max_length=200, blank=True)
+    cliente_base = models.CharField(max_length=200, blank=True, db_index=True)
+    rfc = models.CharField(max_length=30, blank=True)
+    moneda_id = models.IntegerField(default=0)
+    saldo_pendiente = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    remision_pendiente = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    total = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Búsquedas de candidatos: sólo clientes con deuda, ordenados por monto.
+            models.Index(fields=["-total"], condition=models.Q(total__gt=0), name="msaldo_deuda_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.cliente_id} {self.nombre}"
+
+
+class MicrosipClienteRfc(models.Model):
+    # RFCs de las direcciones del cliente Microsip (DIRS_CLIENTES), para búsqueda exacta por RFC.
+    cliente_id = models.BigIntegerField(db_index=True)
+    rfc = models.CharField(max_length=30, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cliente_id", "rfc"], name="uniq_microsip_cliente_rfc"),
+        ]
+
+    def __str__(self):
+        return f"{self.cliente_id} {self.rfc}"
@@ -1,19 +1,51 @@
+from .beneficiary import beneficiary_validation, bulk_beneficiary_validation
+from .compra_totales import recalcular_totales_compras
 from .debt import add_manual_deduction, calculate_payable, payable_breakdown, register_debt_snapshot
 from .imports import (
+    ImportStats,
     detect_compras_conflicts,
+    detect_compras_files_conflicts,
+    evict_import_cache,
     import_anticipos_excel,
+    import_anticipos_files,
     import_compras_excel,
+    import_compras_files,
     preview_anticipos_excel,
     preview_compras_excel,
 )
+from .import_jobs import (
+    claim_next_import_job,
+    delete_import_job_files,
+    enqueue_import_job,
+    fail_stale_import_jobs,
+    import_job_status,
+    import_worker_id,
+    run_import_job,
+)
 from .gmail import gmail_ready, gmail_inbox_ready, send_gmail, fetch_gmail_attachments_for_compra, mark_gmail_message_processed
 from .invoice_templates import build_invoice_request_email, build_invoice_request_message, render_invoice_email_html
 from .invoice_validation import create_invoice_validation_for_compra, parse_and_validate_cfdi_xml
 from .microsip_debt import (
     find_microsip_candidates_for_productor,
+    invalidate_microsip_cache,
     list_all_microsip_debt_clients,
     list_microsip_clients_by_rfc,
     sync_microsip_debt_for_compra,
+    sync_microsip_debt_for_open_compras,
+)
+from .microsip_balances import refresh_microsip_balances
+from .microsip_candidates import microsip_candidates_for_productor, schedule_microsip_candidates_prefetch
+from .microsip_pool import get_microsip_pool, microsip_pool_stats
+from .readiness_queue import (
+    cached_queue_summary,
+    invalidate_queue_summary,
+    queue_summary,
+    readiness_queue_page,
+    readiness_queue_queryset,
+    rebuild_queue_entries,
+    refresh_queue_entries,
+    refresh_stale_queue_entries,
+    stale_queue_entries,
 )
 from .workflow import transition_compra
 from .payment_receipt import extract_pdf_text, parse_payment_receipt_text
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import re
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Q
+
+from pagos.models import BeneficiaryValidationException, FacturadorCuentaBancaria, ProductorCuentaBancaria
+
+LEGAL_TOKENS = {
+    "SA", "CV", "DE", "RL", "S", "A", "P", "I", "SC", "SPR", "SAPI", "SAB", "COOP", "AC", "THE", "DEL", "LA", "LOS", "LAS", "Y", "E",
+}
+
+
+def _norm_name(value: str) -> str:
+    txt = (value or "").upper().strip()
+    txt = txt.replace("Á", "A").replace("É", "E").replace("Í", "I").replace("Ó", "O").replace("Ú", "U")
+    txt = re.sub(r"[^A-Z0-9 ]+", " ", txt)
+    tokens = [t for t in txt.split() if t and t not in LEGAL_TOKENS and len(t) > 1]
+    return " ".join(tokens)
+
+
+def _token_similarity(a: str, b: str) -> Decimal:
+    sa = set((a or "").split())
+    sb = set((b or "").split())
+    if not sa or not sb:
+        return Decimal("0")
+    inter = len(sa & sb)
+    union = len(sa | sb)
+    return Decimal(str(inter / union)) if union else Decimal("0")
+
+
+def _emisor(latest, compra) -> tuple[str, str]:
+    raw = (getattr(latest, "raw_result", {}) or {}) if latest else {}
+    emisor_nombre = (raw.get("nombre_emisor") or compra.factura or "").strip()
+    emisor_rfc = (raw.get("rfc_emisor") or getattr(latest, "rfc_emisor", "") or "").strip().upper()
+    return emisor_nombre, emisor_rfc
+
+
+def _match(emisor_nombre: str, emisor_rfc: str, account_holder: str, has_exception) -> dict:
+    emisor_norm = _norm_name(emisor_nombre)
+    holder_norm = _norm_name(account_holder)
+
+    yellow_threshold = Decimal(str(getattr(settings, "BENEFICIARY_MATCH_YELLOW_THRESHOLD", "0.45")))
+
+    if not emisor_norm or not holder_norm:
+        return {"status": "yellow", "reason": "Falta nombre de emisor o titular de cuenta", "emisor": emisor_nombre, "holder": account_holder, "score": Decimal("0")}
+
+    if emisor_norm == holder_norm:
+        return {"status": "green", "reason": "Titular coincide con emisor", "emisor": emisor_nombre, "holder": account_holder, "score": Decimal("1")}
+
+    score = _token_similarity(emisor_norm, holder_norm)
+
+    if has_exception():
+        return {"status": "yellow", "reason": "Excepción autorizada encontrada (requiere justificación)", "emisor": emisor_nombre, "holder": account_holder, "score": score}
+    if score >= Decimal("0.80"):
+        return {"status": "green", "reason": "Coincidencia alta de nombre", "emisor": emisor_nombre, "holder": account_holder, "score": score}
+    if score >= yellow_threshold:
+        return {"status": "yellow", "reason": "Coincidencia parcial de nombre (requiere justificación)", "emisor": emisor_nombre, "holder": account_holder, "score": score}
+    return {"status": "red", "reason": "Titular de cuenta no coincide con emisor XML", "emisor": emisor_nombre, "holder": account_holder, "score": score}
+
+
+def beneficiary_validation(compra) -> dict:
+    """Semáforo titular de cuenta vs emisor del XML para una compra."""
+    latest = compra.invoice_validations.first()
+    emisor_nombre, emisor_rfc = _emisor(latest, compra)
+    account_holder = ""
+    if (compra.cuenta_productor or "").strip():
+        acc = None
+        if compra.facturador_id:
+            acc = FacturadorCuentaBancaria.objects.filter(facturador=compra.facturador, cuenta=compra.cuenta_productor).first()
+        if not acc:
+            acc = ProductorCuentaBancaria.objects.filter(productor=compra.productor, cuenta=compra.cuenta_productor).first()
+        if acc:
+            account_holder = (acc.titular or "").strip()
+
+    def has_exception():
+        return BeneficiaryValidationException.objects.filter(
+            active=True,
+            productor=compra.productor,
+            account_holder__iexact=account_holder,
+        ).filter(Q(emisor_rfc="") | Q(emisor_rfc=emisor_rfc)).exists()
+
+    return _match(emisor_nombre, emisor_rfc, account_holder, has_exception)
+
+
+def bulk_beneficiary_validation(compras, latest_by_compra: dict) -> dict:
+    """Igual que `beneficiary_validation` para varias compras en consultas fijas (cuentas y excepciones).
+
+    `latest_by_compra` trae la última InvoiceValidationResult por compra_id (o None)."""
+    compras = list(compras)
+    if not compras:
+        return {}
+    cuentas = {(c.cuenta_productor or "").strip() for c in compras} - {""}
+    por_facturador, por_productor = {}, {}
+    if cuentas:
+        # Orden del modelo: el primero por (dueño, cuenta) es el que regresaría .first().
+        for acc in FacturadorCuentaBancaria.objects.filter(
+            facturador_id__in={c.facturador_id for c in compras if c.facturador_id}, cuenta__in=cuentas
+        ):
+            por_facturador.setdefault((acc.facturador_id, acc.cuenta), acc)
+        for acc in ProductorCuentaBancaria.objects.filter(productor_id__in={c.productor_id for c in compras}, cuenta__in=cuentas):
+            por_productor.setdefault((acc.productor_id, acc.cuenta), acc)
+    excepciones = {}
+    for exc in BeneficiaryValidationException.objects.filter(active=True, productor_id__in={c.productor_id for c in compras}):
+        excepciones.setdefault(exc.productor_id, []).append(exc)
+
+    result = {}
+    for compra in compras:
+        emisor_nombre, emisor_rfc = _emisor(latest_by_compra.get(compra.id), compra)
+        account_holder = ""
+        if (compra.cuenta_productor or "").strip():
+            acc = por_facturador.get((compra.facturador_id, compra.cuenta_productor)) if compra.facturador_id else None
+            acc = acc or por_productor.get((compra.productor_id, compra.cuenta_productor))
+            if acc:
+                account_holder = (acc.titular or "").strip()
+        holder_upper = account_holder.upper()
+        result[compra.id] = _match(
+            emisor_nombre,
+            emisor_rfc,
+            account_holder,
+            lambda pid=compra.productor_id, rfc=emisor_rfc, holder=holder_upper: any(
+                e.account_holder.upper() == holder and e.emisor_rfc in ("", rfc) for e in excepciones.get(pid, ())
+            ),
+        )
+    return result
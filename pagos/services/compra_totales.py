@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from pagos.models import AplicacionAnticipo, Compra
+
+from .readiness_queue import refresh_queue_entries
+
+_DEC = DecimalField(max_digits=20, decimal_places=4)
+
+
+@dataclass
+class TotalesResult:
+    revisadas: int = 0
+    corregidas: int = 0
+    diferencias: list[dict] = field(default_factory=list)
+
+
+def _con_agregados(qs):
+    # Subconsultas correlacionadas: dos Sum sobre relaciones distintas en el mismo JOIN se multiplicarían.
+    aplicado = (
+        AplicacionAnticipo.objects.filter(compra=OuterRef("pk")).values("compra").annotate(t=Sum("monto_aplicado")).values("t")
+    )
+    dividido = (
+        Compra.objects.filter(parent_compra=OuterRef("pk")).values("parent_compra").annotate(t=Sum("porcentaje_division")).values("t")
+    )
+    return qs.annotate(
+        _aplicado=Coalesce(Subquery(aplicado), Value(Decimal("0")), output_field=_DEC),
+        _pct_dividido=Coalesce(Subquery(dividido), Value(Decimal("0")), output_field=_DEC),
+    ).prefetch_related("pagos_registrados", "deducciones")
+
+
+def recalcular_totales_compras(compra_ids=None, *, dry_run: bool = False, chunk_size: int = 500) -> TotalesResult:
+    """Recalcula los totales materializados de Compra (todas, o sólo `compra_ids`) por bloques.
+
+    Cada bloque cuesta tres consultas (compras con agregados, pagos, deducciones). Con `dry_run=True`
+    sólo reporta las compras cuyo valor guardado no coincide con el recalculado.
+    """
+    qs = Compra.objects.order_by("id")
+    if compra_ids is not None:
+        qs = qs.filter(pk__in=list(compra_ids))
+    ids = list(qs.values_list("id", flat=True))
+
+    result = TotalesResult()
+    for i in range(0, len(ids), chunk_size):
+        cambiadas = []
+        for compra in _con_agregados(Compra.objects.filter(pk__in=ids[i : i + chunk_size])):
+            antes = {f: getattr(compra, f) for f in Compra.TOTALES_FIELDS}
+            compra._calcular_totales(
+                list(compra.pagos_registrados.all()),
+                compra._aplicado,
+                list(compra.deducciones.all()),
+                compra._pct_dividido,
+            )
+            result.revisadas += 1
+            despues = {f: getattr(compra, f) for f in Compra.TOTALES_FIELDS}
+            if despues != antes:
+                result.corregidas += 1
+                cambiadas.append(compra)
+                result.diferencias.append(
+                    {"compra_id": compra.id, "numero_compra": compra.numero_compra,
+                     **{f: (antes[f], despues[f]) for f in Compra.TOTALES_FIELDS if antes[f] != despues[f]}}
+                )
+        if cambiadas and not dry_run:
+            with transaction.atomic():
+                Compra.objects.bulk_update(cambiadas, list(Compra.TOTALES_FIELDS))
+                # bulk_update no pasa por Compra.save: el saldo mueve la prioridad del queue.
+                refresh_queue_entries(Q(pk__in=[c.pk for c in cambiadas]))
+    return result
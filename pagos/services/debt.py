@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from decimal import Decimal
 
-from pagos.models import Compra, DebtSnapshot, Deduccion, MonedaChoices
+from pagos.models import Compra, DebtSnapshot, DebtSnapshotPayload, Deduccion
 
 
 def payable_breakdown(compra: Compra) -> dict:
@@ -19,12 +19,8 @@ def payable_breakdown(compra: Compra) -> dict:
 
     resico = compra.retencion_resico or Decimal("0")
 
-    manual_usd = Decimal("0")
-    for d in compra.deducciones.all():
-        if d.moneda == MonedaChoices.DOLARES:
-            manual_usd += d.monto
-        elif d.moneda == MonedaChoices.PESOS and tc and tc > 0:
-            manual_usd += (d.monto / tc)
+    # Materializado por los hooks de Deduccion (ver Compra.recalcular_totales).
+    manual_usd = compra.total_deducciones_usd or Decimal("0")
 
     saldo = purchase_total - anticipos - debt_usd - debt_mxn_in_usd - resico - manual_usd
     return {
@@ -43,13 +39,31 @@ def calculate_payable(compra: Compra) -> Decimal:
     return payable_breakdown(compra)["saldo_a_pagar"]
 
 
+def debt_payloads_for(rows_list: list[list]) -> list[DebtSnapshotPayload]:
+    """Payload por cada lista de filas, creando sólo los contenidos que aún no existen (dos consultas)."""
+    digests = [DebtSnapshotPayload.digest(rows) for rows in rows_list]
+    existing = {p.sha256: p for p in DebtSnapshotPayload.objects.filter(sha256__in=set(digests))}
+    missing = {}
+    for sha, rows in zip(digests, rows_list):
+        if sha not in existing and sha not in missing:
+            missing[sha] = DebtSnapshotPayload(sha256=sha, rows_json=rows)
+    if missing:
+        # ignore_conflicts: otro proceso pudo crear el mismo contenido entre la lectura y la escritura.
+        DebtSnapshotPayload.objects.bulk_create(missing.values(), ignore_conflicts=True, batch_size=500)
+        existing.update({p.sha256: p for p in DebtSnapshotPayload.objects.filter(sha256__in=list(missing))})
+    return [existing[sha] for sha in digests]
+
+
 def register_debt_snapshot(compra: Compra, total_usd: Decimal, total_mxn: Decimal, detalle: dict | None = None):
+    detalle = dict(detalle or {})
+    rows = detalle.pop("rows", None)
     return DebtSnapshot.objects.create(
         compra=compra,
         fuente="microsip",
         total_usd=total_usd,
         total_mxn=total_mxn,
-        detalle_json=detalle or {},
+        detalle_json=detalle,
+        payload=debt_payloads_for([rows])[0] if rows is not None else None,
     )
 
 
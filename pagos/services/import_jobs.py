@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from pagos.models import ImportJob, ImportJobStatusChoices, ImportJobTipoChoices, import_job_upload_to
+
+from .imports import ImportStats, import_anticipos_excel, import_anticipos_files, import_compras_excel, import_compras_files
+
+
+def enqueue_import_job(
+    tipo: str,
+    uploaded_file,
+    *,
+    extra_files=(),
+    user=None,
+    conflict_policy: str = "ask",
+    conflict_resolutions: dict | None = None,
+) -> ImportJob:
+    """Guarda el archivo en la carpeta propia del trabajo y lo deja en cola para el worker."""
+    job = ImportJob(
+        tipo=tipo,
+        nombre_original=getattr(uploaded_file, "name", "")[:255],
+        conflict_policy=conflict_policy,
+        conflict_resolutions=conflict_resolutions or {},
+        creado_por=user if getattr(user, "is_authenticated", False) else None,
+    )
+    job.archivo.save(uploaded_file.name, uploaded_file, save=False)
+    for f in extra_files:
+        job.archivos_extra.append(default_storage.save(import_job_upload_to(job, f.name), f))
+    if job.archivos_extra:
+        job.nombres_archivos = [Path(f.name).name for f in (uploaded_file, *extra_files)]
+        job.nombre_original = ", ".join(job.nombres_archivos)[:255]
+    job.save()
+    return job
+
+
+def import_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"[:100]
+
+
+def claim_next_import_job(worker_id: str | None = None) -> ImportJob | None:
+    # Toma el trabajo pendiente más antiguo con un UPDATE condicional: si otro worker lo tomó
+    # primero, el UPDATE no afecta filas y se intenta con el siguiente.
+    worker_id = worker_id or import_worker_id()
+    for job_id in ImportJob.objects.filter(status=ImportJobStatusChoices.PENDING).order_by("created_at", "id").values_list("id", flat=True)[:10]:
+        now = timezone.now()
+        claimed = ImportJob.objects.filter(pk=job_id, status=ImportJobStatusChoices.PENDING).update(
+            status=ImportJobStatusChoices.RUNNING,
+            worker_id=worker_id,
+            heartbeat_at=now,
+            started_at=now,
+            updated_at=now,
+        )
+        if claimed:
+            return ImportJob.objects.get(pk=job_id)
+    return None
+
+
+def _stats_fields(stats: ImportStats) -> dict:
+    return {
+        "created_count": stats.created,
+        "updated_count": stats.updated,
+        "duplicate_count": stats.duplicates,
+        "division_count": stats.divisions_created,
+        "conflict_count": stats.conflict_count,
+        "error_count": stats.error_count,
+        "unchanged_count": stats.unchanged,
+        "run_id": stats.run_id,
+    }
+
+
+def delete_import_job_files(job: ImportJob) -> None:
+    """Borra los archivos cargados de un trabajo terminado (y su carpeta, si queda vacía).
+
+    La bitácora por fila y los conteos quedan en ImportRun/ImportJob; el archivo ya no se necesita.
+    """
+    names = [n for n in [job.archivo.name, *job.archivos_extra] if n]
+    for name in names:
+        default_storage.delete(name)
+    if names:
+        try:
+            os.rmdir(default_storage.path(str(Path(names[0]).parent)))
+        except (NotImplementedError, OSError):
+            # Storage sin rutas locales o carpeta con otros archivos.
+            pass
+
+
+def _heartbeat_seconds() -> float:
+    return float(getattr(settings, "IMPORT_JOB_HEARTBEAT_SECONDS", 30))
+
+
+def _own(job: ImportJob):
+    # Filas del trabajo mientras siga concedido a este worker (otro pudo darlo por interrumpido).
+    return ImportJob.objects.filter(pk=job.pk, worker_id=job.worker_id)
+
+
+@contextmanager
+def _heartbeat(job: ImportJob):
+    """Latido periódico del trabajo en un hilo aparte: el parseo en paralelo o un bloque grande pueden
+    tardar más que el intervalo sin reportar avance."""
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(_heartbeat_seconds()):
+                _own(job).filter(status=ImportJobStatusChoices.RUNNING).update(heartbeat_at=timezone.now())
+        except Exception:
+            # Sin latido el trabajo puede darse por interrumpido; el resultado final lo dice el worker.
+            pass
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f"importacion-{job.pk}-latido", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def fail_stale_import_jobs(minutes: float, *, worker_id: str | None = None) -> list[ImportJob]:
+    """Marca como fallidos los trabajos RUNNING cuyo latido venció hace más de `minutes` minutos.
+
+    Cada trabajo se toma con un UPDATE condicional sobre el latido leído: si su worker late entre la
+    lectura y el UPDATE, no se toca. Solo se borran los archivos de los trabajos tomados aquí.
+    """
+    worker_id = worker_id or import_worker_id()
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    # Trabajos previos a la concesión (sin latido): se usa la última actualización.
+    vencidos = ImportJob.objects.filter(status=ImportJobStatusChoices.RUNNING).filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, updated_at__lt=cutoff)
+    )
+    taken = []
+    for job in vencidos:
+        now = timezone.now()
+        n = ImportJob.objects.filter(
+            pk=job.pk,
+            status=ImportJobStatusChoices.RUNNING,
+            worker_id=job.worker_id,
+            heartbeat_at=job.heartbeat_at,
+            updated_at=job.updated_at,
+        ).update(
+            status=ImportJobStatusChoices.FAILED,
+            worker_id=worker_id,
+            error_message="Worker interrumpido: trabajo sin latido. Vuelve a cargar el archivo.",
+            finished_at=now,
+            updated_at=now,
+        )
+        if n:
+            delete_import_job_files(job)
+            taken.append(job)
+    return taken
+
+
+def run_import_job(job: ImportJob) -> ImportJob:
+    """Ejecuta un trabajo ya reclamado, publicando avance (y latido) en la fila del trabajo por bloque."""
+
+    def progress(stats: ImportStats, rows_done: int, rows_total: int):
+        now = timezone.now()
+        _own(job).update(
+            rows_parsed=rows_done,
+            rows_total=rows_total,
+            heartbeat_at=now,
+            updated_at=now,
+            **_stats_fields(stats),
+        )
+
+    path = job.archivo.path
+    extra = [default_storage.path(name) for name in job.archivos_extra]
+    # Las escrituras finales van sobre `_own(job)`: si otro worker dio el trabajo por interrumpido, su
+    # estado FAILED se conserva.
+    with _heartbeat(job):
+        try:
+            if extra and job.tipo == ImportJobTipoChoices.ANTICIPOS:
+                stats = import_anticipos_files([path, *extra], labels=job.nombres_archivos or None, progress=progress)
+            elif extra:
+                stats = import_compras_files(
+                    [path, *extra],
+                    labels=job.nombres_archivos or None,
+                    conflict_policy=job.conflict_policy,
+                    conflict_resolutions=job.conflict_resolutions,
+                    progress=progress,
+                )
+            elif job.tipo == ImportJobTipoChoices.ANTICIPOS:
+                stats = import_anticipos_excel(path, progress=progress)
+            else:
+                stats = import_compras_excel(
+                    path,
+                    conflict_policy=job.conflict_policy,
+                    conflict_resolutions=job.conflict_resolutions,
+                    progress=progress,
+                )
+        except Exception as e:
+            _own(job).update(
+                status=ImportJobStatusChoices.FAILED,
+                error_message=f"{e}\n\n{traceback.format_exc()}"[:4000],
+                finished_at=timezone.now(),
+                updated_at=timezone.now(),
+            )
+        else:
+            _own(job).update(
+                status=ImportJobStatusChoices.DONE,
+                rows_parsed=F("rows_total"),
+                finished_at=timezone.now(),
+                updated_at=timezone.now(),
+                **_stats_fields(stats),
+            )
+    delete_import_job_files(job)
+    job.refresh_from_db()
+    return job
+
+
+def import_job_status(job: ImportJob) -> dict:
+    return {
+        "id": job.id,
+        "tipo": job.tipo,
+        "status": job.status,
+        "archivo": job.nombre_original,
+        "rows_total": job.rows_total,
+        "rows_parsed": job.rows_parsed,
+        "created": job.created_count,
+        "updated": job.updated_count,
+        "duplicates": job.duplicate_count,
+        "divisions": job.division_count,
+        "conflicts": job.conflict_count,
+        "errors": job.error_count,
+        "unchanged": job.unchanged_count,
+        "error_message": job.error_message.split("\n", 1)[0] if job.error_message else "",
+        "run_id": job.run_id,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "done": job.status in (ImportJobStatusChoices.DONE, ImportJobStatusChoices.FAILED),
+    }
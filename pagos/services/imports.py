@@ -1,14 +1,27 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
 from datetime import date, datetime, timedelta
 from decimal import Decimal
+from itertools import chain, islice, repeat
+from operator import itemgetter
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterator
+import hashlib
+import os
+import pickle
+import tempfile
+import time
 import unicodedata
 import re
 
 import xlrd
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
 from openpyxl import load_workbook
 
 from pagos.models import (
@@ -20,9 +33,14 @@ from pagos.models import (
     PersonaFactura,
     Productor,
     SiNoChoices,
+    TipoCambio,
     WorkflowStateChoices,
 )
 
+from .compra_totales import recalcular_totales_compras
+from .microsip_candidates import schedule_microsip_candidates_prefetch
+from .readiness_queue import refresh_queue_entries
+
 
 def _norm_col(value: str) -> str:
     return " ".join((value or "").strip().upper().replace("_", " ").replace("\n", " ").split())
@@ -41,6 +59,10 @@ def _name_signature(value: str) -> str:
     return "|".join(tokens)
 
 
+_ZERO = Decimal("0")
+_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y")
+
+
 def _to_decimal(v: Any) -> Decimal:
     if v is None or v == "":
         return Decimal("0")
@@ -53,6 +75,10 @@ def _to_decimal(v: Any) -> Decimal:
 
 
 def _to_date(v: Any) -> date:
+    return _to_date_or_none(v) or date.today()
+
+
+def _to_date_or_none(v: Any) -> date | None:
     if isinstance(v, datetime):
         return v.date()
     if isinstance(v, date):
@@ -64,13 +90,21 @@ def _to_date(v: Any) -> date:
             return base + timedelta(days=int(v))
         except Exception:
             pass
-    s = str(v).strip()
-    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y"):
+    return _parse_date_text(str(v).strip())
+
+
+def _parse_date_text(s: str) -> date | None:
+    # Precedencia fija por valor: una fecha ambigua (03/04/2026) se lee igual sin importar las demás filas.
+    for fmt in _DATE_FORMATS:
         try:
             return datetime.strptime(s, fmt).date()
         except ValueError:
             continue
-    return date.today()
+    return None
+
+
+# progress(stats, filas_procesadas, filas_totales): avance para trabajos en segundo plano.
+ProgressCallback = Callable[["ImportStats", int, int], None]
 
 
 @dataclass
@@ -81,21 +115,59 @@ class ImportStats:
     divisions_created: int = 0
     error_count: int = 0
     conflict_count: int = 0
+    unchanged: int = 0
+    # Reporte por fila (solo dry-run; en corridas reales la bitácora queda en ImportRowLog).
+    rows: list[dict] = field(default_factory=list)
+    run_id: int | None = None
+
+    def add(self, other: "ImportStats"):
+        for f in fields(self):
+            if f.name == "run_id":
+                continue
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+
+@contextmanager
+def _sin_escrituras(dry_run: bool):
+    # Red de seguridad del dry-run: cualquier escritura que se cuele se revierte al salir.
+    if not dry_run:
+        yield
+        return
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
 
+_HEADER_SCAN_ROWS = 40
 
-def _read_rows(path: str | Path):
+
+def _iter_rows(path: str | Path) -> Iterator[tuple]:
+    # Lectura en streaming: openpyxl en modo read_only / xlrd on_demand, sin materializar la hoja.
     try:
-        wb = load_workbook(filename=path, data_only=True)
-        ws = wb["COMPRAS"] if "COMPRAS" in wb.sheetnames else wb.active
-        return [tuple(r) for r in ws.iter_rows(values_only=True)]
+        wb = load_workbook(filename=path, read_only=True, data_only=True)
     except Exception:
-        book = xlrd.open_workbook(path)
+        wb = None
+
+    if wb is not None:
+        try:
+            ws = wb["COMPRAS"] if "COMPRAS" in wb.sheetnames else wb.active
+            for r in ws.iter_rows(values_only=True):
+                yield tuple(r)
+        finally:
+            wb.close()
+        return
+
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
         sh = book.sheet_by_name("COMPRAS") if "COMPRAS" in book.sheet_names() else book.sheet_by_index(0)
-        return [tuple(sh.row_values(i)) for i in range(sh.nrows)]
+        for i in range(sh.nrows):
+            yield tuple(sh.row_values(i))
+    finally:
+        book.release_resources()
 
 
 def _find_header_row(rows: list[tuple]) -> int:
-    for i, row in enumerate(rows[:40]):
+    for i, row in enumerate(rows[:_HEADER_SCAN_ROWS]):
         cols = {_norm_col(str(c)) for c in row if str(c).strip()}
         if "COMPRA" in cols and "PRODUCTOR" in cols:
             return i
@@ -103,7 +175,7 @@ def _find_header_row(rows: list[tuple]) -> int:
 
 
 def _find_header_row_anticipos(rows: list[tuple]) -> int:
-    for i, row in enumerate(rows[:40]):
+    for i, row in enumerate(rows[:_HEADER_SCAN_ROWS]):
         cols = {_norm_col(str(c)) for c in row if str(c).strip()}
         has_productor = "PRODUCTOR" in cols
         has_anticipo_hint = any(c in cols for c in {"ANTICIPO", "MONTO", "MONTO ANTICIPO", "NO ANTICIPO", "NUMERO ANTICIPO"})
@@ -112,105 +184,389 @@ def _find_header_row_anticipos(rows: list[tuple]) -> int:
     return 0
 
 
-def _build_parsed_records(path: str | Path):
-    rows = _read_rows(path)
-    if not rows:
-        return [], {}
+def _split_header(rows: Iterator[tuple], find_header):
+    """Busca el encabezado en las primeras filas y devuelve (fila_inicial, headers, resto_del_stream)."""
+    head = list(islice(rows, _HEADER_SCAN_ROWS))
+    if not head:
+        return None
+    h = find_header(head)
+    headers = [_norm_col(str(c or "")) for c in head[h]]
+    return h + 2, headers, chain(head[h + 1 :], rows)
+
+
+_PARSE_BLOCK = 1000
+
+_COMPRAS_ALIASES = {
+    "FECHA LIQ": ["FECHA LIQ", "FECHA"],
+    # Prioridad: usar columna de total real de compra en dólares/libras cuando exista.
+    "COMPRA EN LIBRAS": [
+        "TOTAL DLLS LIBRAS",
+        "TOTAL DLS LIBRAS",
+        "TOTAL DOLLARS LIBRAS",
+        "COMPRA EN LIBRAS",
+        "TOTAL EN DLS",
+        "TOTAL DLLS",
+        "TOTAL DLS",
+    ],
+    "PACAS": ["PACAS", "CANT"],
+    "RETENCION (DEUDAS) USD": ["RETENCION (DEUDAS) USD", "RETENCION", "RETENCIÓN"],
+}
+
+# campo del registro -> columna lógica del Excel
+_COMPRAS_DECIMALS = {
+    "pacas": "PACAS",
+    "compra_en_libras": "COMPRA EN LIBRAS",
+    "anticipo": "ANTICIPO",
+    "pago": "PAGO",
+    "retencion_deudas_usd": "RETENCION (DEUDAS) USD",
+    "retencion_deudas_mxn": "RETENCION (DEUDAS) MXN",
+    "retencion_resico": "RETENCION RESICO 1.25%",
+    "saldo_pendiente": "SALDO PENDIENTE",
+}
+_COMPRAS_TEXTS = {
+    "regimen_fiscal": "REGIMEN FISCAL",
+    "factura": "FACTURA",
+    "uuid_factura": "UUID FACTURA",
+    "cuenta_de_pago": "CUENTA DE PAGO",
+    "metodo_de_pago": "METODO DE PAGO",
+    "cuenta_productor": "CUENTA PRODUCTOR",
+}
+
+
+_COMPRAS_FIELDS = (
+    "numero_compra",
+    "productor_nombre",
+    "fecha_liq",
+    "fecha_de_pago",
+    "regimen_fiscal",
+    "factura",
+    "uuid_factura",
+    "pacas",
+    "compra_en_libras",
+    "anticipo",
+    "pago",
+    "retencion_deudas_usd",
+    "retencion_deudas_mxn",
+    "retencion_resico",
+    "saldo_pendiente",
+    "cuenta_de_pago",
+    "metodo_de_pago",
+    "cuenta_productor",
+    "workflow_state",
+    "intereses",
+)
 
-    h = _find_header_row(rows)
-    headers = [_norm_col(str(c or "")) for c in rows[h]]
-    idx = {h: i for i, h in enumerate(headers)}
 
-    aliases = {
-        "FECHA LIQ": ["FECHA LIQ", "FECHA"],
-        # Prioridad: usar columna de total real de compra en dólares/libras cuando exista.
-        "COMPRA EN LIBRAS": [
-            "TOTAL DLLS LIBRAS",
-            "TOTAL DLS LIBRAS",
-            "TOTAL DOLLARS LIBRAS",
-            "COMPRA EN LIBRAS",
-            "TOTAL EN DLS",
-            "TOTAL DLLS",
-            "TOTAL DLS",
-        ],
-        "PACAS": ["PACAS", "CANT"],
-        "RETENCION (DEUDAS) USD": ["RETENCION (DEUDAS) USD", "RETENCION", "RETENCIÓN"],
-    }
+def _is_blank(v) -> bool:
+    return v is None or (isinstance(v, str) and not v.strip())
 
-    def val(r, key, default=None):
-        keys = aliases.get(key, [key])
-        for k in keys:
-            i = idx.get(_norm_col(k))
-            if i is None or i >= len(r):
-                continue
-            v = r[i]
 
-            # Caso común en reportes Crystal: encabezado en la última columna,
-            # pero el valor queda una celda a la izquierda por combinación de celdas.
-            if key == "COMPRA EN LIBRAS" and (v is None or (isinstance(v, str) and not v.strip())):
-                if i - 1 >= 0:
-                    left = r[i - 1]
-                    if left is not None and (not isinstance(left, str) or left.strip()):
-                        return left
+def _compile_column(idx: dict[str, int], names: list[str], *, left_fallback: bool = False) -> Callable[[list], list]:
+    """Resuelve una columna lógica a índices fijos una sola vez por archivo.
+
+    Devuelve `column(rows)` con el valor de cada fila. Con un solo índice se devuelve la celda
+    tal cual (los convertidores tratan vacíos como el default); con alias o fallback Crystal se
+    devuelve el primer valor no vacío, o None si no hay.
+    """
+    cols = [i for i in (idx.get(_norm_col(k)) for k in names) if i is not None]
+    if not cols:
+        return lambda rows: [None] * len(rows)
+    if len(cols) == 1 and not left_fallback:
+        (c,) = cols
+        get = itemgetter(c)
+
+        def column(rows):
+            # Filas cortas (xlrd recorta celdas vacías al final) solo en el camino lento.
+            if rows and min(map(len, rows)) > c:
+                return list(map(get, rows))
+            return [r[c] if c < len(r) else None for r in rows]
+
+        return column
 
-            # Para aliases, ignora celdas vacías y sigue buscando fallback.
-            if v is None:
+    def pick(r):
+        n = len(r)
+        for i in cols:
+            if i >= n:
                 continue
-            if isinstance(v, str) and not v.strip():
+            v = r[i]
+            if _is_blank(v):
+                # Caso común en reportes Crystal: encabezado en la última columna,
+                # pero el valor queda una celda a la izquierda por combinación de celdas.
+                if left_fallback and i >= 1 and not _is_blank(r[i - 1]):
+                    return r[i - 1]
+                # Para aliases, ignora celdas vacías y sigue buscando fallback.
                 continue
             return v
-        return default
+        return None
 
-    groups: dict[tuple, int] = {}
-    parsed: list[tuple[int, tuple, dict]] = []
+    return lambda rows: [pick(r) for r in rows]
 
-    for offset, row in enumerate(rows[h + 1 :], start=h + 2):
-        numero = int(_to_decimal(val(row, "COMPRA", 0)))
-        if numero <= 0:
-            continue
-        productor_nombre = str(val(row, "PRODUCTOR", "") or "").strip()
-        if not productor_nombre:
-            continue
 
-        fecha_liq = _to_date(val(row, "FECHA LIQ", date.today()))
-        compra_total = _to_decimal(val(row, "COMPRA EN LIBRAS", 0))
-
-        rec = {
-            "numero_compra": numero,
-            "productor_nombre": productor_nombre,
-            "fecha_liq": fecha_liq,
-            "fecha_de_pago": _to_date(val(row, "FECHA DE PAGO", fecha_liq)),
-            "regimen_fiscal": str(val(row, "REGIMEN FISCAL", "") or "").strip(),
-            "factura": str(val(row, "FACTURA", "") or "").strip(),
-            "uuid_factura": str(val(row, "UUID FACTURA", "") or "").strip(),
-            "pacas": _to_decimal(val(row, "PACAS", 0)),
-            "compra_en_libras": compra_total,
-            "anticipo": _to_decimal(val(row, "ANTICIPO", 0)),
-            "pago": _to_decimal(val(row, "PAGO", 0)),
-            "retencion_deudas_usd": _to_decimal(val(row, "RETENCION (DEUDAS) USD", 0)),
-            "retencion_deudas_mxn": _to_decimal(val(row, "RETENCION (DEUDAS) MXN", 0)),
-            "retencion_resico": _to_decimal(val(row, "RETENCION RESICO 1.25%", 0)),
-            "saldo_pendiente": _to_decimal(val(row, "SALDO PENDIENTE", 0)),
-            "cuenta_de_pago": str(val(row, "CUENTA DE PAGO", "") or "").strip(),
-            "metodo_de_pago": str(val(row, "METODO DE PAGO", "") or "").strip(),
-            "cuenta_productor": str(val(row, "CUENTA PRODUCTOR", "") or "").strip(),
-            "workflow_state": WorkflowStateChoices.IMPORTED,
-            "intereses": SiNoChoices.SI
-            if str(val(row, "INTERESES", "NO") or "NO").strip().upper() in {"SI", "S", "YES", "Y"}
-            else SiNoChoices.NO,
+def _decimal_column(values: list) -> list[Decimal]:
+    # Vacíos (None, "", espacios) -> 0, igual que _to_decimal; cada texto distinto se parsea una vez.
+    out = []
+    cache: dict[str, Decimal] = {}
+    for v in values:
+        if v is None:
+            out.append(_ZERO)
+        elif v.__class__ is str:
+            d = cache.get(v)
+            if d is None:
+                d = cache[v] = _to_decimal(v)
+            out.append(d)
+        elif v.__class__ is Decimal:
+            out.append(v)
+        elif v.__class__ is int:
+            out.append(Decimal(v))
+        else:
+            out.append(_to_decimal(v))
+    return out
+
+
+def _text_column(values: list, default: str = "") -> list[str]:
+    return [str(v or default).strip() for v in values]
+
+
+_BLANK = object()
+
+
+class _DateColumn:
+    """Convierte una columna de fechas; cada texto distinto se parsea una sola vez, con la misma
+    precedencia de formatos que `_to_date`. Celdas vacías toman el default de su fila; una fecha
+    ilegible queda None (como en `_to_date`, la fecha del día se aplica al consumir el registro)."""
+
+    def __init__(self):
+        self.cache: dict[str, Any] = {}
+
+    def convert(self, values: list, defaults) -> list[date | None]:
+        out = []
+        cache = self.cache
+        for v, default in zip(values, defaults):
+            if v.__class__ is str:
+                d = cache.get(v, _BLANK)
+                if d is _BLANK:
+                    s = v.strip()
+                    d = cache[v] = _parse_date_text(s) if s else _BLANK
+                out.append(default if d is _BLANK else d)
+            elif v is None:
+                out.append(default)
+            else:
+                out.append(_to_date_or_none(v))
+        return out
+
+
+class _ComprasPlan:
+    """Plan de columnas/conversiones para COMPRAS, compilado una vez por archivo.
+
+    Las filas se convierten por bloques y por columna: primero número/productor para descartar
+    filas vacías o de totales, luego el resto solo sobre las filas conservadas.
+    """
+
+    def __init__(self, headers: list[str]):
+        idx = {h: i for i, h in enumerate(headers)}
+
+        def compile(key):
+            return _compile_column(idx, _COMPRAS_ALIASES.get(key, [key]), left_fallback=key == "COMPRA EN LIBRAS")
+
+        self.numero = compile("COMPRA")
+        self.productor = compile("PRODUCTOR")
+        self.fecha_liq = compile("FECHA LIQ")
+        self.fecha_de_pago = compile("FECHA DE PAGO")
+        self.intereses = compile("INTERESES")
+        self.decimals = {f: compile(col) for f, col in _COMPRAS_DECIMALS.items()}
+        self.texts = {f: compile(col) for f, col in _COMPRAS_TEXTS.items()}
+        self.fecha_liq_col = _DateColumn()
+        self.fecha_pago_col = _DateColumn()
+        self.signatures: dict[str, str] = {}
+
+    def records(self, rows: list[tuple], first_row: int) -> Iterator[tuple[int, tuple, dict]]:
+        numeros = [int(d) for d in _decimal_column(self.numero(rows))]
+        productores = _text_column(self.productor(rows))
+        keep = [i for i in range(len(rows)) if numeros[i] > 0 and productores[i]]
+        if not keep:
+            return
+        if len(keep) < len(rows):
+            rows = [rows[i] for i in keep]
+            numeros = [numeros[i] for i in keep]
+            productores = [productores[i] for i in keep]
+
+        # Sin fecha legible queda None: la fecha del día se aplica al consumir (ver _iter_cached_parsed_records).
+        fechas_liq = self.fecha_liq_col.convert(self.fecha_liq(rows), repeat(None))
+        columns = {
+            "numero_compra": numeros,
+            "productor_nombre": productores,
+            "fecha_liq": fechas_liq,
+            "fecha_de_pago": self.fecha_pago_col.convert(self.fecha_de_pago(rows), fechas_liq),
+            "workflow_state": repeat(WorkflowStateChoices.IMPORTED),
+            "intereses": [
+                SiNoChoices.SI if s.upper() in {"SI", "S", "YES", "Y"} else SiNoChoices.NO
+                for s in _text_column(self.intereses(rows), "NO")
+            ],
         }
+        for f, column in self.decimals.items():
+            columns[f] = _decimal_column(column(rows))
+        for f, column in self.texts.items():
+            columns[f] = _text_column(column(rows))
+
+        signatures = self.signatures
+        for sig_name in set(productores) - signatures.keys():
+            signatures[sig_name] = _name_signature(sig_name)
+
+        # Armado de registros: un zip sobre columnas ya convertidas, en el orden de _COMPRAS_FIELDS.
+        for i, numero, nombre, fecha_liq, values in zip(
+            keep, numeros, productores, fechas_liq, zip(*(columns[f] for f in _COMPRAS_FIELDS))
+        ):
+            yield first_row + i, (numero, signatures[nombre], fecha_liq), dict(zip(_COMPRAS_FIELDS, values))
 
-        key = (numero, _name_signature(productor_nombre), fecha_liq)
-        groups[key] = groups.get(key, 0) + 1
-        parsed.append((offset, key, rec))
 
-    return parsed, groups
+def _parse_compras_rows(headers: list[str], body, first_row: int) -> Iterator[tuple[int, tuple, dict]]:
+    plan = _ComprasPlan(headers)
+    offset = first_row
+    while True:
+        block = list(islice(body, _PARSE_BLOCK))
+        if not block:
+            return
+        yield from plan.records(block, offset)
+        offset += len(block)
+
+
+def _iter_parsed_records(path: str | Path) -> Iterator[tuple[int, tuple, dict]]:
+    split = _split_header(_iter_rows(path), _find_header_row)
+    if split is None:
+        return
+    first_row, headers, body = split
+    yield from _parse_compras_rows(headers, body, first_row)
+
+
+# Subir cuando cambie el formato de los registros parseados para invalidar artefactos previos.
+_PARSED_CACHE_VERSION = 3
+
+
+def _file_digest(path: str | Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _import_cache_dir() -> Path:
+    return Path(getattr(settings, "IMPORT_CACHE_DIR", Path(settings.BASE_DIR) / ".import_cache"))
+
+
+def _parsed_cache_path(path: str | Path) -> Path:
+    return _import_cache_dir() / f"compras-{_file_digest(path)}-v{_PARSED_CACHE_VERSION}.pkl"
+
+
+def _anticipos_cache_path(path: str | Path) -> Path:
+    # Filas crudas de la hoja (sin convertir): el costo de ANTICIPOS es la lectura del Excel.
+    return _import_cache_dir() / f"anticipos-{_file_digest(path)}-v{_PARSED_CACHE_VERSION}.pkl"
+
+
+def evict_import_cache(max_age_days: float | None = None, *, dry_run: bool = False) -> list[Path]:
+    """Borra artefactos parseados (y temporales huérfanos) sin uso en `max_age_days` días.
+
+    La fecha de modificación es la del último uso: cada lectura del artefacto la actualiza.
+    """
+    if max_age_days is None:
+        max_age_days = getattr(settings, "IMPORT_CACHE_MAX_AGE_DAYS", 7)
+    cutoff = time.time() - max_age_days * 86400
+    removed = []
+    cache_dir = _import_cache_dir()
+    patterns = [f"{kind}-*.{ext}" for kind in ("compras", "anticipos") for ext in ("pkl", "tmp")]
+    for p in chain.from_iterable(cache_dir.glob(pattern) for pattern in patterns):
+        try:
+            if p.stat().st_mtime >= cutoff:
+                continue
+            if not dry_run:
+                p.unlink()
+        except FileNotFoundError:
+            # Otro proceso lo borró o lo reemplazó primero.
+            continue
+        removed.append(p)
+    return removed
+
+
+def _read_parsed_cache(cache_path: Path) -> Iterator[tuple[int, tuple, dict]]:
+    with open(cache_path, "rb") as fh:
+        while True:
+            try:
+                yield pickle.load(fh)
+            except EOFError:
+                return
+
+
+def _iter_cached_parsed_records(path: str | Path) -> Iterator[tuple[int, tuple, dict]]:
+    """Registros parseados del archivo, reutilizando el artefacto en disco indexado por hash de contenido.
+
+    La primera lectura parsea en streaming y escribe el artefacto; preview, conflictos e
+    importación (y re-subidas del mismo archivo) leen el artefacto sin volver a parsear.
+    El artefacto guarda como None las fechas que faltan (FECHA LIQ vacía o ilegible) y aquí se completan
+    con la fecha del día, para que reutilizarlo otro día no arrastre la fecha en que se parseó.
+    """
+    today = date.today()
+    for rn, key, rec in _iter_cached(path, _parsed_cache_path(path), _iter_parsed_records):
+        if rec["fecha_liq"] is None:
+            rec["fecha_liq"] = today
+            key = (key[0], key[1], today)
+        if rec["fecha_de_pago"] is None:
+            rec["fecha_de_pago"] = today
+        yield rn, key, rec
+
+
+def _iter_cached_anticipos_rows(path: str | Path) -> Iterator[tuple]:
+    """Filas de la hoja de ANTICIPOS, con el mismo artefacto en disco que COMPRAS."""
+    return _iter_cached(path, _anticipos_cache_path(path), _iter_rows)
+
+
+def _iter_cached(path, cache_path: Path, produce: Callable[[Any], Iterator]) -> Iterator:
+    hit = cache_path.exists()
+    if hit:
+        try:
+            # Marca de último uso: evict_import_cache sólo borra artefactos sin uso reciente.
+            os.utime(cache_path)
+        except FileNotFoundError:
+            hit = False
+        except OSError:
+            pass
+    if hit:
+        yield from _read_parsed_cache(cache_path)
+        return
+
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Nombre temporal único: dos hilos (o procesos) pueden parsear el mismo archivo a la vez.
+        fh = tempfile.NamedTemporaryFile(dir=cache_path.parent, prefix=cache_path.stem + ".", suffix=".tmp", delete=False)
+    except OSError:
+        # Sin directorio de cache escribible: parsear directo.
+        yield from produce(path)
+        return
+    tmp_path = Path(fh.name)
+
+    completed = False
+    try:
+        with fh:
+            for item in produce(path):
+                pickle.dump(item, fh, protocol=pickle.HIGHEST_PROTOCOL)
+                yield item
+        os.replace(tmp_path, cache_path)
+        completed = True
+    finally:
+        if not completed:
+            tmp_path.unlink(missing_ok=True)
 
 
 def preview_compras_excel(path: str | Path, *, limit: int = 20):
-    parsed, groups = _build_parsed_records(path)
+    # Se recorre todo el stream para contar grupos (divisiones), pero solo se retienen `limit` filas.
+    groups: dict[tuple, int] = {}
+    head: list[tuple[int, tuple, dict]] = []
+    for row_number, key, rec in _iter_cached_parsed_records(path):
+        groups[key] = groups.get(key, 0) + 1
+        if len(head) < limit:
+            head.append((row_number, key, rec))
+
     out = []
-    for row_number, key, rec in parsed[:limit]:
+    for row_number, key, rec in head:
         out.append(
             {
                 "row_number": row_number,
@@ -225,65 +581,189 @@ def preview_compras_excel(path: str | Path, *, limit: int = 20):
     return out
 
 
-def _resolve_or_create_productor(nombre: str):
-    n = _normalize_name(nombre)
-    if not n:
-        return None
+class _NameIndex:
+    """Índice en memoria por nombre exacto (sin mayúsculas/minúsculas) y por firma de tokens."""
 
-    direct = Productor.objects.filter(nombre__iexact=nombre).first()
-    if direct:
-        return direct
+    def __init__(self, objs):
+        self.by_exact: dict[str, Any] = {}
+        self.by_signature: dict[str, Any] = {}
+        for obj in objs:
+            self.add(obj)
 
-    sig = _name_signature(nombre)
-    for p in Productor.objects.all().only("id", "nombre"):
-        if _name_signature(p.nombre) == sig:
-            return p
+    def add(self, obj):
+        self.by_exact.setdefault(obj.nombre.upper(), obj)
+        self.by_signature.setdefault(_name_signature(obj.nombre), obj)
 
-    p = Productor(nombre=nombre, codigo="", activo=True)
-    p.save()
-    return p
+    def get(self, nombre: str):
+        return self.by_exact.get(nombre.upper()) or self.by_signature.get(_name_signature(nombre))
 
 
-def _resolve_or_create_persona(nombre: str):
-    n = _normalize_name(nombre)
-    if not n:
-        return None
+class ImportResolver:
+    """Resolución productor/persona facturadora para una corrida de importación.
+
+    Carga los catálogos una sola vez; cada fila se resuelve en O(1). Los nombres nuevos se
+    dan de alta en lote con `prepare()` (bulk_create con códigos PRD-xxxxx preasignados).
+    Con dry_run=True los nombres nuevos solo viven en memoria (instancias sin guardar).
+    """
+
+    def __init__(self, *, dry_run: bool = False):
+        self.dry_run = dry_run
+        self.productores = _NameIndex(Productor.objects.order_by("nombre", "id"))
+        self.personas = _NameIndex(PersonaFactura.objects.order_by("nombre", "id"))
+
+    @staticmethod
+    def _missing(index: _NameIndex, nombres) -> list[str]:
+        out: dict[str, str] = {}
+        for nombre in nombres:
+            nombre = (nombre or "").strip()
+            if not _normalize_name(nombre) or index.get(nombre):
+                continue
+            out.setdefault(_name_signature(nombre), nombre)
+        return list(out.values())
+
+    def prepare(self, *, productores=(), personas=()):
+        nuevos = self._missing(self.productores, productores)
+        if nuevos and self.dry_run:
+            for n in nuevos:
+                self.productores.add(Productor(nombre=n, codigo="", activo=True))
+        elif nuevos:
+            for _ in range(5):
+                try:
+                    with transaction.atomic():
+                        codigos = Productor._next_codigos(len(nuevos))
+                        created = Productor.objects.bulk_create(
+                            [Productor(nombre=n, codigo=c, activo=True) for n, c in zip(nuevos, codigos)]
+                        )
+                    break
+                except IntegrityError:
+                    continue
+            else:
+                raise RuntimeError("No se pudo generar codigo automatico para productor.")
+            for p in created:
+                self.productores.add(p)
+
+        nuevas = self._missing(self.personas, personas)
+        if nuevas and self.dry_run:
+            for n in nuevas:
+                self.personas.add(PersonaFactura(nombre=n))
+        elif nuevas:
+            for p in PersonaFactura.objects.bulk_create([PersonaFactura(nombre=n) for n in nuevas]):
+                self.personas.add(p)
+
+    def productor(self, nombre: str, *, create: bool = True):
+        if not _normalize_name(nombre):
+            return None
+        found = self.productores.get(nombre)
+        if found or not create:
+            return found
+        p = Productor(nombre=nombre, codigo="", activo=True)
+        if not self.dry_run:
+            p.save()
+        self.productores.add(p)
+        return p
+
+    def persona(self, nombre: str, *, create: bool = True):
+        if not _normalize_name(nombre):
+            return None
+        found = self.personas.get(nombre)
+        if found or not create:
+            return found
+        p = PersonaFactura(nombre=nombre)
+        if not self.dry_run:
+            p.save()
+        self.personas.add(p)
+        return p
+
+
+_IN_CHUNK = 500
+
+
+def _prefetch_base_compras(numeros) -> dict[tuple[int, int], Compra]:
+    """Compras base existentes por (numero_compra, productor_id), en consultas IN por bloques."""
+    out: dict[tuple[int, int], Compra] = {}
+    numeros = sorted(set(numeros))
+    for i in range(0, len(numeros), _IN_CHUNK):
+        qs = Compra.objects.filter(
+            numero_compra__in=numeros[i : i + _IN_CHUNK],
+            parent_compra__isnull=True,
+        ).select_related("productor", "tipo_cambio").order_by("-fecha_liq", "-id")
+        for c in qs:
+            # Mismo criterio que .first() con el ordering del modelo.
+            out.setdefault((c.numero_compra, c.productor_id), c)
+    return out
+
+
+def _row_fingerprint(key: tuple, ordinal: int, rec: dict) -> str:
+    # Huella del registro normalizado + key de grupo + n-ésima aparición del key (base=0, divisiones 1..n).
+    payload = repr((key, ordinal, sorted(rec.items())))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 
-    direct = PersonaFactura.objects.filter(nombre__iexact=nombre).first()
-    if direct:
-        return direct
+def _with_fingerprints(records) -> Iterator[tuple[str, int, tuple, dict, str]]:
+    # El ordinal corre sobre todos los archivos de la corrida: un key repetido en otro archivo es división.
+    seen: dict[tuple, int] = {}
+    for archivo, row_number, key, rec in records:
+        ordinal = seen.get(key, 0)
+        seen[key] = ordinal + 1
+        yield archivo, row_number, key, rec, _row_fingerprint(key, ordinal, rec)
 
-    sig = _name_signature(nombre)
-    for p in PersonaFactura.objects.all().only("id", "nombre"):
-        if _name_signature(p.nombre) == sig:
-            return p
 
-    return PersonaFactura.objects.create(nombre=nombre)
+def _row_ref(archivo: str, row_number: int) -> str:
+    # Referencia de fila para resoluciones de conflicto: "12" (un archivo) o "semana2.xlsx:12" (varios).
+    return f"{archivo}:{row_number}" if archivo else str(row_number)
 
 
-def detect_compras_conflicts(path: str | Path):
-    parsed, _groups = _build_parsed_records(path)
+def _prefetch_fingerprints(fingerprints) -> dict[str, Compra]:
+    out: dict[str, Compra] = {}
+    fingerprints = list(dict.fromkeys(fingerprints))
+    for i in range(0, len(fingerprints), _IN_CHUNK):
+        qs = Compra.objects.filter(import_fingerprint__in=fingerprints[i : i + _IN_CHUNK]).only(
+            "id", "parent_compra_id", "fecha_liq", "pacas", "compra_en_libras", "import_fingerprint"
+        )
+        for c in qs:
+            out.setdefault(c.import_fingerprint, c)
+    return out
+
+
+def _same_payload(existing: Compra, rec: dict) -> bool:
+    return (
+        (existing.fecha_liq == rec.get("fecha_liq"))
+        and ((existing.pacas or Decimal("0")) == (rec.get("pacas") or Decimal("0")))
+        and ((existing.compra_en_libras or Decimal("0")) == (rec.get("compra_en_libras") or Decimal("0")))
+    )
+
+
+def _detect_conflicts(records) -> list[dict]:
+    # `records()` produce (archivo, fila, key, rec) y se recorre dos veces, igual que en _import_compras.
+    resolver = ImportResolver()
+    numeros: set[int] = set()
+    fingerprints: list[str] = []
+    for _archivo, _rn, _key, rec, fp in _with_fingerprints(records()):
+        numeros.add(rec["numero_compra"])
+        fingerprints.append(fp)
+    existing_by_key = _prefetch_base_compras(numeros)
+    unchanged = _prefetch_fingerprints(fingerprints)
     out = []
-    for row_number, _key, rec0 in parsed:
+    for archivo, row_number, _key, rec0, fp in _with_fingerprints(records()):
+        # Misma regla que la importación: fila sin cambios y compra sin editar desde entonces se omite.
+        known = unchanged.get(fp)
+        if known is not None and _same_payload(known, rec0):
+            continue
         rec = dict(rec0)
-        productor = _resolve_or_create_productor(rec.pop("productor_nombre"))
-        existing = Compra.objects.filter(
-            numero_compra=rec["numero_compra"],
-            productor=productor,
-            parent_compra__isnull=True,
-        ).first()
+        # Un productor aún no registrado no puede tener compras previas: no hay conflicto.
+        productor = resolver.productor(rec.pop("productor_nombre"), create=False)
+        if not productor:
+            continue
+        existing = known if known is not None and known.parent_compra_id else existing_by_key.get((rec["numero_compra"], productor.id))
         if not existing:
             continue
-        same_payload = (
-            (existing.fecha_liq == rec.get("fecha_liq"))
-            and ((existing.pacas or Decimal("0")) == (rec.get("pacas") or Decimal("0")))
-            and ((existing.compra_en_libras or Decimal("0")) == (rec.get("compra_en_libras") or Decimal("0")))
-        )
-        if same_payload:
+        if _same_payload(existing, rec):
             continue
         out.append(
             {
                 "row_number": row_number,
+                "archivo": archivo,
+                "row_ref": _row_ref(archivo, row_number),
                 "numero_compra": rec.get("numero_compra"),
                 "productor": productor.nombre,
                 "existing_fecha": existing.fecha_liq,
@@ -297,147 +777,314 @@ def detect_compras_conflicts(path: str | Path):
     return out
 
 
-def import_compras_excel(path: str | Path, *, dry_run: bool = False, conflict_policy: str = "ask", conflict_resolutions: dict | None = None) -> ImportStats:
-    parsed, groups = _build_parsed_records(path)
+def detect_compras_conflicts(path: str | Path, *, archivo: str = ""):
+    def records():
+        for row_number, key, rec in _iter_cached_parsed_records(path):
+            yield archivo, row_number, key, rec
+
+    return _detect_conflicts(records)
+
+
+def detect_compras_files_conflicts(paths, *, labels=None):
+    """Conflictos de varios archivos con el mismo orden, etiquetas y huellas que `import_compras_files`."""
+    labels, ordered = _ordered_sources(paths, labels)
+
+    def records():
+        for archivo, path in zip(labels, ordered):
+            for row_number, key, rec in _iter_cached_parsed_records(path):
+                yield archivo, row_number, key, rec
+
+    return _detect_conflicts(records)
+
+
+_WRITE_CHUNK = 500
+
+# Campos que escribe una sobrescritura de conflicto (incluye derivados de calcular_campos_derivados).
+_OVERWRITE_FIELDS = [
+    "fecha_liq",
+    "pacas",
+    "compra_en_libras",
+    "factura",
+    "uuid_factura",
+    "regimen_fiscal",
+    "tipo_cambio",
+    "tipo_cambio_valor",
+    "dias_transcurridos",
+    "total_deuda_en_dls",
+    "total_en_pesos",
+    "import_fingerprint",
+    "updated_at",
+]
+
+
+@dataclass
+class _ComprasChunk:
+    bases: list[Compra] = field(default_factory=list)
+    divisions: list[Compra] = field(default_factory=list)
+    overwrites: dict[int, Compra] = field(default_factory=dict)
+    fingerprints: dict[int, Compra] = field(default_factory=dict)
+    logs: list[ImportRowLog] = field(default_factory=list)
+    stats: ImportStats = field(default_factory=ImportStats)
+
+    def log(self, run: ImportRun, archivo: str, row_number: int, status: str, message: str, compra_numero, productor_nombre: str):
+        self.logs.append(
+            ImportRowLog(
+                run=run,
+                archivo=archivo,
+                row_number=row_number,
+                status=status,
+                message=message,
+                compra_numero=compra_numero,
+                productor_nombre=productor_nombre,
+            )
+        )
+
+
+def _report_row(log: ImportRowLog) -> dict:
+    return {
+        "archivo": log.archivo,
+        "row_number": log.row_number,
+        "status": log.status,
+        "message": log.message,
+        "compra_numero": log.compra_numero,
+        "productor_nombre": log.productor_nombre,
+    }
+
+
+def _flush_compras_chunk(chunk: _ComprasChunk, *, dry_run: bool, tc_por_fecha: dict):
+    if dry_run:
+        # Sin escrituras: la bitácora del bloque se vuelve el reporte por fila.
+        chunk.stats.rows.extend(_report_row(log) for log in chunk.logs)
+        return
+    # Un bloque se escribe completo o no se escribe: bases -> divisiones (con parent ya asignado) -> bitácora.
+    with transaction.atomic():
+        for c in chunk.bases:
+            c.calcular_campos_derivados(tc_por_fecha)
+        Compra.objects.bulk_create(chunk.bases)
+        for d in chunk.divisions:
+            d.calcular_campos_derivados(tc_por_fecha)
+        Compra.objects.bulk_create(chunk.divisions)
+        if chunk.overwrites:
+            now = timezone.now()
+            for c in chunk.overwrites.values():
+                c.calcular_campos_derivados(tc_por_fecha)
+                c.updated_at = now
+            Compra.objects.bulk_update(list(chunk.overwrites.values()), _OVERWRITE_FIELDS)
+        if chunk.fingerprints:
+            Compra.objects.bulk_update(list(chunk.fingerprints.values()), ["import_fingerprint"])
+        ImportRowLog.objects.bulk_create(chunk.logs)
+        # bulk_create/bulk_update no pasan por Compra.save: bases con divisiones nuevas o sobrescritas
+        # recalculan aquí sus totales materializados.
+        afectadas = {d.parent_compra.pk for d in chunk.divisions} | {c.pk for c in chunk.overwrites.values()}
+        if afectadas:
+            recalcular_totales_compras(afectadas)
+        refresh_queue_entries(Q(pk__in=afectadas | {c.pk for c in (*chunk.bases, *chunk.divisions)}))
+
+
+def import_compras_excel(
+    path: str | Path,
+    *,
+    dry_run: bool = False,
+    conflict_policy: str = "ask",
+    conflict_resolutions: dict | None = None,
+    progress: ProgressCallback | None = None,
+) -> ImportStats:
+    """Importa COMPRAS. Con dry_run=True no escribe nada (ni ImportRun, ni bitácora, ni productores):
+    devuelve las mismas estadísticas más el reporte por fila en `stats.rows`."""
+    with _sin_escrituras(dry_run):
+        return _import_compras(
+            lambda: (("", rn, key, rec) for rn, key, rec in _iter_cached_parsed_records(path)),
+            source_name=str(path),
+            dry_run=dry_run,
+            conflict_policy=conflict_policy,
+            conflict_resolutions=conflict_resolutions,
+            progress=progress,
+        )
 
+
+def _import_compras(records, *, source_name, dry_run, conflict_policy, conflict_resolutions, progress) -> ImportStats:
+    """Motor de escritura (un solo escritor). `records()` produce (archivo, fila, key, rec) y se recorre dos veces."""
     stats = ImportStats()
     base_by_key: dict[tuple, Compra] = {}
-    run = ImportRun.objects.create(source_name=str(path), dry_run=dry_run)
-
-    for row_number, key, rec0 in parsed:
-        rec = dict(rec0)
+    run = None if dry_run else ImportRun.objects.create(source_name=source_name[:255], dry_run=dry_run)
+    stats.run_id = run.id if run else None
+
+    productor_names: dict[str, None] = {}
+    numeros: set[int] = set()
+    fechas: set[date] = set()
+    fingerprints: list[str] = []
+    rows_total = 0
+    for _archivo, _rn, _key, rec, fp in _with_fingerprints(records()):
+        rows_total += 1
+        fingerprints.append(fp)
+        productor_names.setdefault(rec["productor_nombre"])
+        numeros.add(rec["numero_compra"])
+        fechas.add(rec["fecha_liq"])
+    # Filas sin cambios desde una importación previa: se omiten por completo.
+    unchanged = _prefetch_fingerprints(fingerprints)
+    resolver = ImportResolver(dry_run=dry_run)
+    resolver.prepare(productores=productor_names)
+    existing_by_key = _prefetch_base_compras(numeros)
+    tc_por_fecha = {tc.fecha: tc for tc in TipoCambio.objects.filter(fecha__in=fechas)}
+    # Productores con compras nuevas: un solo precálculo Microsip al terminar, no uno por bloque.
+    prefetch_ids: set[int] = set()
+
+    def flush(chunk: _ComprasChunk):
         try:
-            productor = _resolve_or_create_productor(rec.pop("productor_nombre"))
+            _flush_compras_chunk(chunk, dry_run=dry_run, tc_por_fecha=tc_por_fecha)
+        except Exception as e:
+            # Bloque revertido: se olvidan sus altas para que filas posteriores no cuelguen de ellas.
+            failed = {id(c) for c in chunk.bases}
+            for c in chunk.bases + chunk.divisions:
+                c.pk = None
+                c._state.adding = True
+            # Compras existentes sobrescritas (o con huella nueva) en memoria: vuelven a lo guardado para que
+            # filas posteriores no comparen ni calculen divisiones contra datos revertidos.
+            touched = {**chunk.overwrites, **chunk.fingerprints}
+            try:
+                fresh = Compra.objects.in_bulk(list(touched))
+            except Exception:
+                fresh = {}
+            for pk, c in touched.items():
+                if pk not in fresh:
+                    failed.add(id(c))
+                    continue
+                for f in Compra._meta.concrete_fields:
+                    setattr(c, f.attname, getattr(fresh[pk], f.attname))
+            for d in (base_by_key, existing_by_key):
+                for k in [k for k, v in d.items() if id(v) in failed]:
+                    del d[k]
+            ImportRowLog.objects.bulk_create(
+                [
+                    ImportRowLog(
+                        run=run,
+                        archivo=log.archivo,
+                        row_number=log.row_number,
+                        status="error",
+                        message=f"Bloque revertido: {e}",
+                        compra_numero=log.compra_numero,
+                        productor_nombre=log.productor_nombre,
+                    )
+                    for log in chunk.logs
+                ]
+            )
+            stats.error_count += len(chunk.logs)
+            return
+        stats.add(chunk.stats)
+        prefetch_ids.update(c.productor_id for c in (*chunk.bases, *chunk.divisions))
+
+    if progress:
+        progress(stats, 0, rows_total)
+
+    chunk = _ComprasChunk()
+    rows_done = 0
+    for archivo, row_number, key, rec0, fp in _with_fingerprints(records()):
+        rows_done += 1
+        known = unchanged.get(fp)
+        # Solo se omite si la compra sigue igual a la fila: una edición a mano posterior vuelve a ser conflicto.
+        if known is not None and _same_payload(known, rec0):
+            stats.unchanged += 1
+            if key not in base_by_key and known.parent_compra_id is None:
+                # Las divisiones nuevas de este key cuelgan de la base ya importada.
+                base_by_key[key] = known
+            continue
+        if known is not None and known.parent_compra_id:
+            # División editada a mano: no se duplica; se reporta y se conserva.
+            chunk.stats.conflict_count += 1
+            chunk.log(run, archivo, row_number, "conflict", "División editada después de importarse: se conservó.", rec0.get("numero_compra"), rec0.get("productor_nombre", ""))
+            continue
+        rec = dict(rec0, import_fingerprint=fp)
+        try:
+            productor = resolver.productor(rec.pop("productor_nombre"))
             rec["productor"] = productor
 
-            existing = Compra.objects.filter(
-                numero_compra=rec["numero_compra"],
-                productor=productor,
-                parent_compra__isnull=True,
-            ).first()
+            existing = existing_by_key.get((rec["numero_compra"], productor.id))
 
             if key not in base_by_key:
                 if existing:
                     # Same key imported again: detect exact duplicate vs conflict
-                    same_payload = (
-                        (existing.fecha_liq == rec.get("fecha_liq"))
-                        and ((existing.pacas or Decimal("0")) == (rec.get("pacas") or Decimal("0")))
-                        and ((existing.compra_en_libras or Decimal("0")) == (rec.get("compra_en_libras") or Decimal("0")))
-                    )
-                    if same_payload:
-                        stats.duplicates += 1
+                    if _same_payload(existing, rec):
+                        chunk.stats.duplicates += 1
                         base = existing
-                        ImportRowLog.objects.create(
-                            run=run,
-                            row_number=row_number,
-                            status="duplicate",
-                            message="Compra idéntica ya existente: se omite.",
-                            compra_numero=rec.get("numero_compra"),
-                            productor_nombre=productor.nombre,
-                        )
+                        if existing.pk:
+                            # Se registra la huella para omitir la fila en la siguiente importación.
+                            existing.import_fingerprint = fp
+                            chunk.fingerprints[existing.pk] = existing
+                        chunk.log(run, archivo, row_number, "duplicate", "Compra idéntica ya existente: se omite.", rec.get("numero_compra"), productor.nombre)
                     else:
-                        stats.conflict_count += 1
-                        row_policy = (conflict_resolutions or {}).get(str(row_number), conflict_policy)
+                        chunk.stats.conflict_count += 1
+                        row_policy = (conflict_resolutions or {}).get(_row_ref(archivo, row_number), conflict_policy)
                         if row_policy == "overwrite":
                             existing.fecha_liq = rec.get("fecha_liq")
                             existing.pacas = rec.get("pacas")
                             existing.compra_en_libras = rec.get("compra_en_libras")
                             existing.factura = rec.get("factura", "")
                             existing.uuid_factura = rec.get("uuid_factura", "")
-                            if not dry_run:
-                                existing.save()
-                            stats.updated += 1
+                            existing.import_fingerprint = fp
+                            # Una base creada en este mismo bloque aún no tiene pk: se inserta ya sobrescrita.
+                            if existing.pk:
+                                chunk.overwrites[existing.pk] = existing
+                            chunk.stats.updated += 1
                             base = existing
-                            ImportRowLog.objects.create(
-                                run=run,
-                                row_number=row_number,
-                                status="updated",
-                                message="Conflicto resuelto: se sobrescribió compra existente.",
-                                compra_numero=rec.get("numero_compra"),
-                                productor_nombre=productor.nombre,
-                            )
+                            chunk.log(run, archivo, row_number, "updated", "Conflicto resuelto: se sobrescribió compra existente.", rec.get("numero_compra"), productor.nombre)
                         elif row_policy == "keep_existing":
                             base = existing
-                            ImportRowLog.objects.create(
-                                run=run,
-                                row_number=row_number,
-                                status="conflict",
-                                message="Conflicto detectado: se conservó compra existente.",
-                                compra_numero=rec.get("numero_compra"),
-                                productor_nombre=productor.nombre,
-                            )
+                            chunk.log(run, archivo, row_number, "conflict", "Conflicto detectado: se conservó compra existente.", rec.get("numero_compra"), productor.nombre)
                         else:
                             base = existing
-                            ImportRowLog.objects.create(
-                                run=run,
-                                row_number=row_number,
-                                status="conflict",
-                                message="Conflicto detectado: confirma política (conservar/sobrescribir).",
-                                compra_numero=rec.get("numero_compra"),
-                                productor_nombre=productor.nombre,
-                            )
+                            chunk.log(run, archivo, row_number, "conflict", "Conflicto detectado: confirma política (conservar/sobrescribir).", rec.get("numero_compra"), productor.nombre)
                 else:
                     base = Compra(**rec)
+                    chunk.bases.append(base)
                     if not dry_run:
-                        base.save()
-                    stats.created += 1
-                    ImportRowLog.objects.create(
-                        run=run,
-                        row_number=row_number,
-                        status="created",
-                        message="Compra base creada",
-                        compra_numero=rec.get("numero_compra"),
-                        productor_nombre=productor.nombre,
-                    )
+                        # Filas siguientes con el mismo (numero, productor) ya ven esta compra como existente.
+                        existing_by_key[(base.numero_compra, productor.id)] = base
+                    chunk.stats.created += 1
+                    chunk.log(run, archivo, row_number, "created", "Compra base creada", rec.get("numero_compra"), productor.nombre)
                 base_by_key[key] = base
-                continue
-
-            if groups.get(key, 0) <= 1:
-                continue
-
-            base = base_by_key[key]
-            base_total = base.compra_en_libras or Decimal("0")
-            pct = (rec["compra_en_libras"] * Decimal("100") / base_total) if base_total > 0 else Decimal("0")
-
-            division = Compra(**rec, parent_compra=base, porcentaje_division=pct, workflow_state=WorkflowStateChoices.IMPORTED)
-            if not dry_run:
-                division.save()
-            stats.divisions_created += 1
-            stats.created += 1
-            ImportRowLog.objects.create(
-                run=run,
-                row_number=row_number,
-                status="division",
-                message="División creada",
-                compra_numero=rec.get("numero_compra"),
-                productor_nombre=productor.nombre,
-            )
+            else:
+                # Segunda aparición (o posterior) del mismo key en el archivo: es división.
+                base = base_by_key[key]
+                base_total = base.compra_en_libras or Decimal("0")
+                pct = (rec["compra_en_libras"] * Decimal("100") / base_total) if base_total > 0 else Decimal("0")
+
+                chunk.divisions.append(Compra(**rec, parent_compra=base, porcentaje_division=pct))
+                chunk.stats.divisions_created += 1
+                chunk.stats.created += 1
+                chunk.log(run, archivo, row_number, "division", "División creada", rec.get("numero_compra"), productor.nombre)
         except Exception as e:
-            stats.error_count = getattr(stats, "error_count", 0) + 1
-            ImportRowLog.objects.create(
-                run=run,
-                row_number=row_number,
-                status="error",
-                message=str(e),
-                compra_numero=rec.get("numero_compra"),
-                productor_nombre=str(rec0.get("productor_nombre", "")),
-            )
-
+            chunk.stats.error_count += 1
+            chunk.log(run, archivo, row_number, "error", str(e), rec.get("numero_compra"), str(rec0.get("productor_nombre", "")))
+
+        if len(chunk.logs) >= _WRITE_CHUNK:
+            flush(chunk)
+            chunk = _ComprasChunk()
+            if progress:
+                progress(stats, rows_done, rows_total)
+
+    if chunk.logs:
+        flush(chunk)
+    if progress:
+        progress(stats, rows_done, rows_total)
+
+    if run is None:
+        return stats
+    schedule_microsip_candidates_prefetch(prefetch_ids)
     run.created_count = stats.created
     run.duplicate_count = stats.duplicates
     run.division_count = stats.divisions_created
-    run.error_count = getattr(stats, "error_count", 0)
-    run.save(update_fields=["created_count", "duplicate_count", "division_count", "error_count", "updated_at"])
+    run.error_count = stats.error_count
+    run.unchanged_count = stats.unchanged
+    run.save(update_fields=["created_count", "duplicate_count", "division_count", "error_count", "unchanged_count", "updated_at"])
 
     return stats
 
 
 def preview_anticipos_excel(path: str | Path, *, limit: int = 20):
-    rows = _read_rows(path)
-    if not rows:
+    split = _split_header(_iter_rows(path), _find_header_row_anticipos)
+    if split is None:
         return []
-    h = _find_header_row_anticipos(rows)
-    headers = [_norm_col(str(c or "")) for c in rows[h]]
+    first_row, headers, body = split
     idx = {h: i for i, h in enumerate(headers)}
 
     aliases = {
@@ -459,7 +1106,7 @@ def preview_anticipos_excel(path: str | Path, *, limit: int = 20):
         return default
 
     out = []
-    for rn, row in enumerate(rows[h + 1 :], start=h + 2):
+    for rn, row in enumerate(body, start=first_row):
         productor = str(val(row, "PRODUCTOR", "") or "").strip()
         monto = _to_decimal(val(row, "MONTO", 0))
         if not productor or monto <= 0:
@@ -482,42 +1129,90 @@ def preview_anticipos_excel(path: str | Path, *, limit: int = 20):
     return out
 
 
-def import_anticipos_excel(path: str | Path, *, dry_run: bool = False) -> ImportStats:
-    rows = _read_rows(path)
-    if not rows:
-        return ImportStats()
-    h = _find_header_row_anticipos(rows)
-    headers = [_norm_col(str(c or "")) for c in rows[h]]
-    idx = {h: i for i, h in enumerate(headers)}
+def import_anticipos_excel(path: str | Path, *, dry_run: bool = False, progress: ProgressCallback | None = None) -> ImportStats:
+    """Importa ANTICIPOS. Con dry_run=True no escribe nada; el reporte por fila queda en `stats.rows`."""
+    with _sin_escrituras(dry_run):
+        return _import_anticipos(
+            [("", lambda: _iter_rows(path))], source_name=f"{path}::ANTICIPOS", dry_run=dry_run, progress=progress
+        )
 
-    aliases = {
-        "ANTICIPO_NUM": ["NO ANTICIPO", "NUMERO ANTICIPO", "NUM ANTICIPO"],
-        "FECHA": ["FECHA DE PAGO", "FECHA"],
-        "PRODUCTOR": ["PRODUCTOR"],
-        "PERSONA": ["PERSONA QUE FACTURA"],
-        "FACTURA": ["FACTURA"],
-        "MONTO": ["ANTICIPO", "MONTO ANTICIPO", "MONTO"],
-        "MONEDA": ["MONEDA"],
-    }
 
-    def val(r, key, default=None):
-        for k in aliases.get(key, [key]):
-            i = idx.get(_norm_col(k))
-            if i is not None and i < len(r):
-                return r[i]
-        return default
+_PROGRESS_EVERY = 500
+
+_ANTICIPOS_ALIASES = {
+    "ANTICIPO_NUM": ["NO ANTICIPO", "NUMERO ANTICIPO", "NUM ANTICIPO"],
+    "FECHA": ["FECHA DE PAGO", "FECHA"],
+    "PRODUCTOR": ["PRODUCTOR"],
+    "PERSONA": ["PERSONA QUE FACTURA"],
+    "FACTURA": ["FACTURA"],
+    "MONTO": ["ANTICIPO", "MONTO ANTICIPO", "MONTO"],
+    "MONEDA": ["MONEDA"],
+}
+
+
+def _iter_anticipos_rows(sources) -> Iterator[tuple[str, int, tuple, Callable]]:
+    """(archivo, fila, celdas, val) de cada archivo; `val(row, key)` usa los encabezados de su archivo."""
+    for archivo, rows in sources:
+        split = _split_header(rows(), _find_header_row_anticipos)
+        if split is None:
+            continue
+        first_row, headers, body = split
+        idx = {h: i for i, h in enumerate(headers)}
+
+        def val(r, key, default=None, idx=idx):
+            for k in _ANTICIPOS_ALIASES.get(key, [key]):
+                i = idx.get(_norm_col(k))
+                if i is not None and i < len(r):
+                    return r[i]
+            return default
+
+        for rn, row in enumerate(body, start=first_row):
+            yield archivo, rn, row, val
 
+
+def _import_anticipos(sources, *, source_name: str, dry_run: bool, progress) -> ImportStats:
     stats = ImportStats()
-    run = ImportRun.objects.create(source_name=f"{path}::ANTICIPOS", dry_run=dry_run)
+    run = None if dry_run else ImportRun.objects.create(source_name=source_name[:255], dry_run=dry_run)
+    stats.run_id = run.id if run else None
 
-    for rn, row in enumerate(rows[h + 1 :], start=h + 2):
+    def log(archivo, rn, status, message, compra_numero=None, productor_nombre=""):
+        entry = ImportRowLog(
+            run=run, archivo=archivo, row_number=rn, status=status, message=message, compra_numero=compra_numero, productor_nombre=productor_nombre
+        )
+        if run is None:
+            stats.rows.append(_report_row(entry))
+        else:
+            entry.save()
+
+    # Primera pasada (solo nombres) para dar de alta productores/personas nuevos en lote.
+    productor_names: dict[str, None] = {}
+    persona_names: dict[str, None] = {}
+    rows_total = 0
+    for _archivo, _rn, row, val in _iter_anticipos_rows(sources):
+        rows_total += 1
+        productor_nombre = str(val(row, "PRODUCTOR", "") or "").strip()
+        try:
+            if not productor_nombre or _to_decimal(val(row, "MONTO", 0)) <= 0:
+                continue
+        except Exception:
+            continue
+        productor_names.setdefault(productor_nombre)
+        persona_names.setdefault(str(val(row, "PERSONA", "") or "").strip())
+    resolver = ImportResolver(dry_run=dry_run)
+    resolver.prepare(productores=productor_names, personas=persona_names)
+
+    if progress:
+        progress(stats, 0, rows_total)
+    for rows_done, (archivo, rn, row, val) in enumerate(_iter_anticipos_rows(sources)):
+        if progress and rows_done and rows_done % _PROGRESS_EVERY == 0:
+            progress(stats, rows_done, rows_total)
         try:
             productor_nombre = str(val(row, "PRODUCTOR", "") or "").strip()
             monto = _to_decimal(val(row, "MONTO", 0))
             if not productor_nombre or monto <= 0:
                 continue
 
-            productor = _resolve_or_create_productor(productor_nombre)
+            productor = resolver.productor(productor_nombre)
 
             numero = int(_to_decimal(val(row, "ANTICIPO_NUM", 0)))
             fecha_pago = _to_date(val(row, "FECHA", date.today()))
@@ -527,7 +1222,8 @@ def import_anticipos_excel(path: str | Path, *, dry_run: bool = False) -> Import
             existing = None
             if numero > 0:
                 existing = Anticipo.objects.filter(numero_anticipo=numero).first()
-            else:
+            elif productor.pk:
+                # Un productor nuevo (solo en memoria en dry-run) no puede tener anticipos previos.
                 factura_txt = str(val(row, "FACTURA", "") or "").strip()
                 uuid_nc_txt = str(val(row, "UUID_NC", "") or "").strip()
                 q = Anticipo.objects.filter(
@@ -544,7 +1240,7 @@ def import_anticipos_excel(path: str | Path, *, dry_run: bool = False) -> Import
             if existing:
                 changed = False
                 persona_txt_existing = str(val(row, "PERSONA", "") or "").strip()
-                persona_obj_existing = _resolve_or_create_persona(persona_txt_existing)
+                persona_obj_existing = resolver.persona(persona_txt_existing)
                 factura_new = str(val(row, "FACTURA", "") or "").strip()
                 uuid_new = str(val(row, "UUID_NC", "") or "").strip()
 
@@ -562,17 +1258,18 @@ def import_anticipos_excel(path: str | Path, *, dry_run: bool = False) -> Import
                         setattr(existing, field, new_val)
                         changed = True
 
-                if changed and not dry_run:
-                    existing.save()
+                if changed:
+                    if not dry_run:
+                        existing.save()
                     stats.updated += 1
-                    ImportRowLog.objects.create(run=run, row_number=rn, status="updated", message="Anticipo existente actualizado", compra_numero=existing.numero_anticipo, productor_nombre=productor_nombre)
+                    log(archivo, rn, "updated", "Anticipo existente actualizado", existing.numero_anticipo, productor_nombre)
                 else:
                     stats.duplicates += 1
-                    ImportRowLog.objects.create(run=run, row_number=rn, status="duplicate", message="Anticipo ya existe", compra_numero=existing.numero_anticipo, productor_nombre=productor_nombre)
+                    log(archivo, rn, "duplicate", "Anticipo ya existe", existing.numero_anticipo, productor_nombre)
                 continue
 
             persona_txt = str(val(row, "PERSONA", "") or "").strip()
-            persona_obj = _resolve_or_create_persona(persona_txt)
+            persona_obj = resolver.persona(persona_txt)
 
             ant = Anticipo(
                 numero_anticipo=(numero if numero > 0 else None),
@@ -588,14 +1285,131 @@ def import_anticipos_excel(path: str | Path, *, dry_run: bool = False) -> Import
             if not dry_run:
                 ant.save()
             stats.created += 1
-            ImportRowLog.objects.create(run=run, row_number=rn, status="created", message="Anticipo creado", compra_numero=numero or None, productor_nombre=productor_nombre)
+            log(archivo, rn, "created", "Anticipo creado", numero or None, productor_nombre)
         except Exception as e:
             stats.error_count += 1
-            ImportRowLog.objects.create(run=run, row_number=rn, status="error", message=str(e), productor_nombre=str(val(row, "PRODUCTOR", "") or ""))
+            log(archivo, rn, "error", str(e), productor_nombre=str(val(row, "PRODUCTOR", "") or ""))
 
+    if progress:
+        progress(stats, rows_total, rows_total)
+    if run is None:
+        return stats
     run.created_count = stats.created
     run.duplicate_count = stats.duplicates
     run.division_count = 0
     run.error_count = stats.error_count
     run.save(update_fields=["created_count", "duplicate_count", "division_count", "error_count", "updated_at"])
     return stats
+
+
+def _warm_parsed_cache(path) -> None:
+    # En el proceso hijo solo se escribe el artefacto en disco; no se regresan registros al padre.
+    for _ in _iter_cached_parsed_records(path):
+        pass
+
+
+def _warm_anticipos_cache(path) -> None:
+    for _ in _iter_cached_anticipos_rows(path):
+        pass
+
+
+def _init_parse_worker():
+    # Con "spawn" (Windows) el proceso hijo no hereda Django inicializado.
+    import django
+
+    django.setup()
+
+
+def _warm_in_parallel(
+    paths: list, max_workers: int | None, *, cache_path=_parsed_cache_path, warm=_warm_parsed_cache
+) -> None:
+    """Parseo CPU-bound por archivo en un pool de procesos que deja listo el cache de cada archivo.
+
+    El escritor luego lee en streaming desde esos artefactos. Con un solo archivo o `max_workers=1` no
+    hay pool: el escritor parsea en streaming y escribe el cache al pasar.
+    """
+    pending = [p for p in paths if not cache_path(p).exists()]
+    if len(pending) <= 1 or max_workers == 1:
+        return
+    workers = min(len(pending), max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_parse_worker) as pool:
+        list(pool.map(warm, pending))
+
+
+def _ordered_sources(paths, names=None) -> tuple[list[str], list[str]]:
+    # Orden determinista por nombre de archivo (no por orden de carga); etiquetas únicas para la bitácora.
+    # `names` trae el nombre de carga de cada ruta cuando la ruta ya no lo conserva (storage lo sanea).
+    paths = [str(p) for p in paths]
+    names = list(names) if names else [Path(p).name for p in paths]
+    labels: list[str] = []
+    ordered: list[str] = []
+    for name, p in sorted(zip(names, paths)):
+        label = name
+        n = 2
+        while label in labels:
+            label = f"{name} ({n})"
+            n += 1
+        labels.append(label)
+        ordered.append(p)
+    return labels, ordered
+
+
+def import_compras_files(
+    paths,
+    *,
+    labels=None,
+    dry_run: bool = False,
+    conflict_policy: str = "ask",
+    conflict_resolutions: dict | None = None,
+    progress: ProgressCallback | None = None,
+    max_workers: int | None = None,
+) -> ImportStats:
+    """Importa varios archivos COMPRAS en una sola corrida.
+
+    El parseo va en paralelo (procesos que dejan el cache de cada archivo); la escritura es de un solo
+    escritor que lee ese cache en streaming, en orden de nombre de archivo. Un mismo
+    (numero, firma, fecha_liq) en otro archivo se importa como división. Las resoluciones de
+    conflicto se indexan por "archivo:fila", con `labels` (nombres de carga en el orden de `paths`)
+    cuando las rutas no conservan el nombre original.
+    """
+    labels, ordered = _ordered_sources(paths, labels)
+    _warm_in_parallel(ordered, max_workers)
+
+    def records():
+        for archivo, path in zip(labels, ordered):
+            for rn, key, rec in _iter_cached_parsed_records(path):
+                yield archivo, rn, key, rec
+
+    with _sin_escrituras(dry_run):
+        return _import_compras(
+            records,
+            source_name=" + ".join(labels),
+            dry_run=dry_run,
+            conflict_policy=conflict_policy,
+            conflict_resolutions=conflict_resolutions,
+            progress=progress,
+        )
+
+
+def import_anticipos_files(
+    paths,
+    *,
+    labels=None,
+    dry_run: bool = False,
+    progress: ProgressCallback | None = None,
+    max_workers: int | None = None,
+) -> ImportStats:
+    """Importa varios archivos ANTICIPOS en un solo escritor, en orden de nombre.
+
+    Como en COMPRAS, la lectura de cada hoja va en paralelo (procesos que dejan sus filas en el cache)
+    y el escritor las lee en streaming de ahí, en ambas pasadas.
+    """
+    labels, ordered = _ordered_sources(paths, labels)
+    _warm_in_parallel(ordered, max_workers, cache_path=_anticipos_cache_path, warm=_warm_anticipos_cache)
+    sources = [
+        (archivo, (lambda path=path: _iter_cached_anticipos_rows(path))) for archivo, path in zip(labels, ordered)
+    ]
+    with _sin_escrituras(dry_run):
+        return _import_anticipos(
+            sources, source_name=" + ".join(labels) + "::ANTICIPOS", dry_run=dry_run, progress=progress
+        )
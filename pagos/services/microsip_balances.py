@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from pagos.models import MicrosipCargoAbierto, MicrosipClienteRfc, MicrosipSaldoCliente, MicrosipWatermark
+
+from .microsip_debt import _client_base, _fetch, _norm_name
+
+# Los importes (cargos 'C' y cobros 'R') sólo se agregan en Microsip: su ID es la marca de agua.
+WATERMARK_IMPORTES = "IMPORTES_DOCTOS_CC"
+
+_CONCEPTOS_VENTA = {"Venta", "Venta en mostrador"}
+_NETO = "(i.IMPORTE + i.IMPUESTO - i.IVA_RETENIDO - i.ISR_RETENIDO)"
+
+MAX_IMPORTE_SQL = "SELECT COALESCE(MAX(IMPTE_DOCTO_CC_ID), 0) AS ULTIMO FROM IMPORTES_DOCTOS_CC"
+
+OPEN_CARGOS_SQL = f"""
+WITH CARGOS AS (
+  SELECT d.DOCTO_CC_ID, d.CLIENTE_ID, SUM({_NETO}) AS CARGO_NETO
+  FROM DOCTOS_CC d
+  JOIN CONCEPTOS_CC c ON c.CONCEPTO_CC_ID = d.CONCEPTO_CC_ID
+  JOIN IMPORTES_DOCTOS_CC i ON i.DOCTO_CC_ID = d.DOCTO_CC_ID
+  WHERE d.CANCELADO = 'N' AND d.ESTATUS = 'N' AND i.CANCELADO = 'N' AND i.ESTATUS = 'N'
+    AND i.TIPO_IMPTE = 'C' AND c.NOMBRE IN ('Venta', 'Venta en mostrador')
+    AND i.IMPTE_DOCTO_CC_ID <= ?
+  GROUP BY d.DOCTO_CC_ID, d.CLIENTE_ID
+),
+ABONOS AS (
+  SELECT i.DOCTO_CC_ACR_ID AS DOCTO_CC_ID, SUM({_NETO}) AS ABONO_NETO
+  FROM IMPORTES_DOCTOS_CC i
+  WHERE i.CANCELADO = 'N' AND i.ESTATUS = 'N' AND i.TIPO_IMPTE = 'R' AND i.DOCTO_CC_ACR_ID IS NOT NULL
+    AND i.IMPTE_DOCTO_CC_ID <= ?
+  GROUP BY i.DOCTO_CC_ACR_ID
+)
+SELECT ca.DOCTO_CC_ID, ca.CLIENTE_ID, ca.CARGO_NETO, COALESCE(ab.ABONO_NETO, 0) AS ABONO_NETO
+FROM CARGOS ca
+LEFT JOIN ABONOS ab ON ab.DOCTO_CC_ID = ca.DOCTO_CC_ID
+WHERE (ca.CARGO_NETO - COALESCE(ab.ABONO_NETO, 0)) > 0
+"""
+
+NEW_IMPORTES_SQL = f"""
+SELECT i.IMPTE_DOCTO_CC_ID, i.DOCTO_CC_ID, i.DOCTO_CC_ACR_ID, i.TIPO_IMPTE, {_NETO} AS NETO,
+       d.CLIENTE_ID, d.CANCELADO, d.ESTATUS, c.NOMBRE AS CONCEPTO
+FROM IMPORTES_DOCTOS_CC i
+JOIN DOCTOS_CC d ON d.DOCTO_CC_ID = i.DOCTO_CC_ID
+JOIN CONCEPTOS_CC c ON c.CONCEPTO_CC_ID = d.CONCEPTO_CC_ID
+WHERE i.IMPTE_DOCTO_CC_ID > ? AND i.IMPTE_DOCTO_CC_ID <= ?
+  AND i.CANCELADO = 'N' AND i.ESTATUS = 'N'
+ORDER BY i.IMPTE_DOCTO_CC_ID
+"""
+
+# Las remisiones cambian de estatus (P -> facturada) sin ID nuevo: se relee sólo el agregado de pendientes.
+PENDING_REMISIONES_SQL = """
+SELECT v.CLIENTE_ID,
+       SUM(COALESCE(v.IMPORTE_NETO, 0)+COALESCE(v.TOTAL_IMPUESTOS, 0)-COALESCE(v.TOTAL_RETENCIONES, 0)
+          +COALESCE(v.FLETES, 0)+COALESCE(v.OTROS_CARGOS, 0)-COALESCE(v.TOTAL_ANTICIPOS, 0)) AS REMISION_PENDIENTE
+FROM DOCTOS_VE v
+WHERE v.TIPO_DOCTO = 'R' AND v.ESTATUS = 'P'
+GROUP BY v.CLIENTE_ID
+"""
+
+# Catálogo completo (sin documentos): se relee en cada corrida para captar altas, renombres y RFCs.
+# El primer RFC por cliente sigue el mismo orden que el resumen Microsip.
+CATALOGO_SQL = """
+SELECT cl.CLIENTE_ID, TRIM(cl.NOMBRE) AS CLIENTE, cl.MONEDA_ID, TRIM(COALESCE(dc.RFC_CURP, '')) AS RFC
+FROM CLIENTES cl
+LEFT JOIN DIRS_CLIENTES dc ON dc.CLIENTE_ID = cl.CLIENTE_ID
+ORDER BY cl.CLIENTE_ID, dc.USAR_PARA_FACTURAR DESC, dc.ES_DIR_PPAL DESC, dc.DIR_CLI_ID
+"""
+_CATALOGO_CAMPOS = ("nombre", "nombre_norm", "cliente_base", "rfc", "moneda_id")
+
+_Q = Decimal("0.0001")
+
+
+def _dec(value) -> Decimal:
+    # Firebird regresa Decimal; el sustituto SQLite, float.
+    return Decimal(str(value or 0)).quantize(_Q)
+
+
+@dataclass
+class BalanceRefreshResult:
+    mode: str
+    importes_nuevos: int = 0
+    cargos_abiertos: int = 0
+    clientes_actualizados: int = 0
+    catalogo_cambios: int = 0
+    watermark: int = 0
+
+
+def _sync_catalog() -> tuple[dict[int, MicrosipSaldoCliente], int]:
+    """Alinea nombre/moneda/RFC del espejo con el catálogo Microsip; regresa {cliente_id: fila} y cambios."""
+    catalogo: dict[int, dict] = {}
+    rfcs: set[tuple[int, str]] = set()
+    for r in _fetch(CATALOGO_SQL):
+        cid = int(r["CLIENTE_ID"])
+        rfc = (r["RFC"] or "").strip().upper()
+        if cid not in catalogo:
+            nombre = (r["CLIENTE"] or "").strip()
+            catalogo[cid] = {
+                "nombre": nombre,
+                "nombre_norm": _norm_name(nombre),
+                "cliente_base": _client_base(nombre),
+                "rfc": rfc,
+                "moneda_id": int(r["MONEDA_ID"] or 0),
+            }
+        if rfc:
+            rfcs.add((cid, rfc))
+
+    actuales = {s.cliente_id: s for s in MicrosipSaldoCliente.objects.all()}
+    to_create, to_update = [], []
+    for cid, campos in catalogo.items():
+        row = actuales.get(cid)
+        if row is None:
+            row = actuales[cid] = MicrosipSaldoCliente(cliente_id=cid, **campos)
+            to_create.append(row)
+        elif any(getattr(row, k) != v for k, v in campos.items()):
+            for k, v in campos.items():
+                setattr(row, k, v)
+            to_update.append(row)
+    MicrosipSaldoCliente.objects.bulk_create(to_create, batch_size=1000)
+    MicrosipSaldoCliente.objects.bulk_update(to_update, list(_CATALOGO_CAMPOS), batch_size=1000)
+
+    existentes = {(c, r): pk for pk, c, r in MicrosipClienteRfc.objects.values_list("pk", "cliente_id", "rfc")}
+    MicrosipClienteRfc.objects.bulk_create(
+        [MicrosipClienteRfc(cliente_id=c, rfc=r) for c, r in rfcs - set(existentes)], batch_size=1000
+    )
+    MicrosipClienteRfc.objects.filter(pk__in=[pk for key, pk in existentes.items() if key not in rfcs]).delete()
+    return actuales, len(to_create) + len(to_update)
+
+
+def _apply_new_importes(rows) -> set[int]:
+    """Aplica cargos/cobros nuevos a los cargos abiertos locales; regresa los clientes afectados."""
+    cargos_nuevos: dict[int, MicrosipCargoAbierto] = {}
+    abonos: dict[int, Decimal] = {}
+    for r in rows:
+        neto = _dec(r["NETO"])
+        if r["TIPO_IMPTE"] == "C":
+            if r["CANCELADO"] != "N" or r["ESTATUS"] != "N" or (r["CONCEPTO"] or "").strip() not in _CONCEPTOS_VENTA:
+                continue
+            docto = int(r["DOCTO_CC_ID"])
+            cargo = cargos_nuevos.get(docto) or MicrosipCargoAbierto(docto_cc_id=docto, cliente_id=int(r["CLIENTE_ID"]))
+            cargo.cargo_neto += neto
+            cargos_nuevos[docto] = cargo
+        elif r["TIPO_IMPTE"] == "R" and r["DOCTO_CC_ACR_ID"] is not None:
+            acr = int(r["DOCTO_CC_ACR_ID"])
+            abonos[acr] = abonos.get(acr, Decimal("0")) + neto
+
+    # Un cargo puede tener más importes 'C' después de la marca anterior: se suman al existente.
+    existentes = MicrosipCargoAbierto.objects.in_bulk(set(cargos_nuevos) | set(abonos), field_name="docto_cc_id")
+    for docto, nuevo in cargos_nuevos.items():
+        if docto in existentes:
+            existentes[docto].cargo_neto += nuevo.cargo_neto
+        else:
+            existentes[docto] = nuevo
+    afectados = set()
+    for acr, monto in abonos.items():
+        cargo = existentes.get(acr)
+        if cargo is not None:
+            cargo.abono_neto += monto
+
+    to_create, to_update, to_delete = [], [], []
+    for docto, cargo in existentes.items():
+        if docto not in cargos_nuevos and docto not in abonos:
+            continue
+        afectados.add(cargo.cliente_id)
+        if cargo.cargo_neto - cargo.abono_neto <= 0:
+            if cargo.pk:
+                to_delete.append(cargo.pk)
+        elif cargo.pk:
+            to_update.append(cargo)
+        else:
+            to_create.append(cargo)
+    MicrosipCargoAbierto.objects.bulk_create(to_create, batch_size=1000)
+    MicrosipCargoAbierto.objects.bulk_update(to_update, ["cargo_neto", "abono_neto"], batch_size=1000)
+    MicrosipCargoAbierto.objects.filter(pk__in=to_delete).delete()
+    return afectados
+
+
+def _rebuild_open_cargos(watermark: int):
+    rows = _fetch(OPEN_CARGOS_SQL, (watermark, watermark))
+    MicrosipCargoAbierto.objects.all().delete()
+    MicrosipCargoAbierto.objects.bulk_create(
+        [
+            MicrosipCargoAbierto(
+                docto_cc_id=int(r["DOCTO_CC_ID"]),
+                cliente_id=int(r["CLIENTE_ID"]),
+                cargo_neto=_dec(r["CARGO_NETO"]),
+                abono_neto=_dec(r["ABONO_NETO"]),
+            )
+            for r in rows
+        ],
+        batch_size=1000,
+    )
+    return len(rows)
+
+
+def _refresh_saldos(actuales: dict[int, MicrosipSaldoCliente], clientes_cargo: set[int] | None, remisiones: dict[int, Decimal]) -> int:
+    """Recalcula saldo por cliente (todos si `clientes_cargo` es None) y remisiones pendientes."""
+    saldos_qs = MicrosipCargoAbierto.objects.all()
+    if clientes_cargo is not None:
+        saldos_qs = saldos_qs.filter(cliente_id__in=clientes_cargo)
+    saldos = {
+        r["cliente_id"]: r["saldo"]
+        for r in saldos_qs.values("cliente_id").annotate(saldo=Sum(F("cargo_neto") - F("abono_neto")))
+    }
+    recalcular = (set(actuales) | set(saldos)) if clientes_cargo is None else set(clientes_cargo)
+    candidatos = recalcular | set(remisiones) | {cid for cid, s in actuales.items() if s.remision_pendiente}
+
+    to_create, to_update = [], []
+    now = timezone.now()
+    for cid in candidatos:
+        row = actuales.get(cid)
+        saldo = _dec(saldos.get(cid)) if cid in recalcular or row is None else row.saldo_pendiente
+        remision = _dec(remisiones.get(cid))
+        if row is None:
+            if not saldo and not remision:
+                continue
+            # Cliente dado de alta después de leer el catálogo: nombre y RFC llegan en la siguiente corrida.
+            row = MicrosipSaldoCliente(cliente_id=cid)
+            to_create.append(row)
+        elif (row.saldo_pendiente, row.remision_pendiente) != (saldo, remision):
+            to_update.append(row)
+        else:
+            continue
+        row.saldo_pendiente = saldo
+        row.remision_pendiente = remision
+        row.total = saldo + remision
+        row.updated_at = now
+    MicrosipSaldoCliente.objects.bulk_create(to_create, batch_size=1000)
+    MicrosipSaldoCliente.objects.bulk_update(to_update, ["saldo_pendiente", "remision_pendiente", "total", "updated_at"], batch_size=1000)
+    return len(to_create) + len(to_update)
+
+
+def refresh_microsip_balances(*, full: bool = False) -> BalanceRefreshResult:
+    """Actualiza el espejo local de clientes Microsip (catálogo, RFCs y saldos).
+
+    El catálogo de clientes se relee completo en cada corrida (es chico). Saldos incrementales: lee sólo los importes con ID mayor a la marca de agua (cargos nuevos y cobros) y
+    el agregado de remisiones pendientes. Completo (`full=True` o sin marca previa): reconstruye los
+    cargos abiertos; sirve también para reconciliar cancelaciones, que no generan ID nuevo.
+    """
+    mark = MicrosipWatermark.objects.filter(tabla=WATERMARK_IMPORTES).first()
+    # La marca se lee antes que los datos y acota todas las consultas: un importe que llegue
+    # durante la corrida entra en la siguiente, nunca dos veces.
+    ultimo = int(_fetch(MAX_IMPORTE_SQL)[0]["ULTIMO"] or 0)
+    remisiones = {int(r["CLIENTE_ID"]): _dec(r["REMISION_PENDIENTE"]) for r in _fetch(PENDING_REMISIONES_SQL)}
+
+    if full or mark is None:
+        result = BalanceRefreshResult(mode="completo", watermark=ultimo)
+        with transaction.atomic():
+            actuales, result.catalogo_cambios = _sync_catalog()
+            _rebuild_open_cargos(ultimo)
+            result.clientes_actualizados = _refresh_saldos(actuales, None, remisiones)
+            MicrosipWatermark.objects.update_or_create(tabla=WATERMARK_IMPORTES, defaults={"ultimo_id": ultimo})
+    else:
+        result = BalanceRefreshResult(mode="incremental", watermark=max(ultimo, mark.ultimo_id))
+        rows = _fetch(NEW_IMPORTES_SQL, (mark.ultimo_id, ultimo)) if ultimo > mark.ultimo_id else []
+        result.importes_nuevos = len(rows)
+        with transaction.atomic():
+            actuales, result.catalogo_cambios = _sync_catalog()
+            afectados = _apply_new_importes(rows)
+            result.clientes_actualizados = _refresh_saldos(actuales, afectados, remisiones)
+            MicrosipWatermark.objects.filter(pk=mark.pk).update(ultimo_id=result.watermark)
+    result.cargos_abiertos = MicrosipCargoAbierto.objects.count()
+    return result
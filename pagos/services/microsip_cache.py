@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Copia local por proceso del último valor leído: si la versión compartida no cambió se evita
+# des-serializar de nuevo las filas en cada petición.
+_local: dict[str, tuple[float, object]] = {}
+_local_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, "MICROSIP_CACHE_ALIAS", "microsip")]
+
+
+def _keys(name: str) -> tuple[str, str, str]:
+    return f"microsip:{name}:at", f"microsip:{name}:data", f"microsip:{name}:lock"
+
+
+def _expired_key(name: str) -> str:
+    return f"microsip:{name}:expired"
+
+
+def _read(name: str):
+    """Regresa (at, valor, vencido) del cache compartido, o (None, None, True) si no hay entrada válida.
+
+    `vencido` indica que la versión se marcó con `expire_shared_cache` (se sirve, pero se recalcula)."""
+    at_key, data_key, _ = _keys(name)
+    cache = _cache()
+    meta = cache.get_many([at_key, _expired_key(name)])
+    at = meta.get(at_key)
+    if at is None:
+        return None, None, True
+    expired = meta.get(_expired_key(name)) == at
+    with _local_lock:
+        hit = _local.get(name)
+    if hit and hit[0] == at:
+        return at, hit[1], expired
+    entry = cache.get(data_key)
+    if not entry or entry.get("at") != at:
+        return None, None, True
+    with _local_lock:
+        _local[name] = (at, entry["value"])
+    return at, entry["value"], expired
+
+
+def _store(name: str, value, ttl: float, stale: float):
+    at_key, data_key, _ = _keys(name)
+    at = time.time()
+    timeout = ttl + stale
+    cache = _cache()
+    # Primero los datos y luego la marca de versión: un lector nunca ve una versión sin datos.
+    cache.set(data_key, {"at": at, "value": value}, timeout)
+    cache.set(at_key, at, timeout)
+    with _local_lock:
+        _local[name] = (at, value)
+
+
+def _try_lock(name: str, lock_timeout: float) -> str | None:
+    token = uuid.uuid4().hex
+    return token if _cache().add(_keys(name)[2], token, lock_timeout) else None
+
+
+def _unlock(name: str, token: str):
+    lock_key = _keys(name)[2]
+    cache = _cache()
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def _refresh(name: str, compute, ttl: float, stale: float, token: str):
+    try:
+        value = compute()
+        _store(name, value, ttl, stale)
+        return value
+    finally:
+        _unlock(name, token)
+
+
+def _start_background_refresh(name: str, compute, ttl: float, stale: float, token: str):
+    def run():
+        try:
+            _refresh(name, compute, ttl, stale, token)
+        except Exception:
+            # Si falla, los lectores siguen con el valor anterior hasta que expire la ventana stale.
+            pass
+
+    threading.Thread(target=run, name=f"microsip-refresh-{name}", daemon=True).start()
+
+
+def shared_cached(name: str, compute, *, ttl: float | None = None, stale: float | None = None, force: bool = False):
+    """Valor compartido entre procesos vía el cache de Django (alias MICROSIP_CACHE_ALIAS).
+
+    - Fresco (< ttl): se regresa sin consultar Microsip.
+    - Viejo pero dentro de `stale`: se regresa de inmediato y un solo proceso lo recalcula en
+      segundo plano (stale-while-revalidate).
+    - Ausente: un solo proceso calcula (lock con `cache.add`); los demás esperan el resultado y
+      sólo calculan por su cuenta si el dueño del lock tarda más que `lock_timeout`.
+    - `force=True` recalcula ya y publica el valor nuevo para todos los procesos.
+    """
+    ttl = getattr(settings, "MICROSIP_CACHE_TTL", 300) if ttl is None else ttl
+    stale = getattr(settings, "MICROSIP_CACHE_STALE_SECONDS", 3600) if stale is None else stale
+    lock_timeout = getattr(settings, "MICROSIP_CACHE_LOCK_SECONDS", 120)
+
+    if force:
+        return _refresh(name, compute, ttl, stale, _try_lock(name, lock_timeout) or "")
+
+    at, value, expired = _read(name)
+    if at is not None:
+        if expired or time.time() - at > ttl:
+            token = _try_lock(name, lock_timeout)
+            if token:
+                _start_background_refresh(name, compute, ttl, stale, token)
+        return value
+
+    deadline = time.monotonic() + lock_timeout
+    while True:
+        token = _try_lock(name, lock_timeout)
+        if token:
+            return _refresh(name, compute, ttl, stale, token)
+        time.sleep(0.2)
+        at, value, _expired = _read(name)
+        if at is not None:
+            return value
+        if time.monotonic() > deadline:
+            return compute()
+
+
+def peek_shared_cache(name: str, *, ttl: float | None = None):
+    """Valor vigente (dentro de `ttl` y no vencido) sin calcular ni refrescar; None si no hay."""
+    ttl = getattr(settings, "MICROSIP_CACHE_TTL", 300) if ttl is None else ttl
+    at, value, expired = _read(name)
+    if at is None or expired or time.time() - at > ttl:
+        return None
+    return value
+
+
+def expire_shared_cache(name: str):
+    """Marca la versión actual como vencida: se sigue sirviendo y el siguiente lector la recalcula en segundo plano."""
+    at = _cache().get(_keys(name)[0])
+    if at is not None:
+        _cache().set(_expired_key(name), at, getattr(settings, "MICROSIP_CACHE_STALE_SECONDS", 3600))
+
+
+def invalidate_shared_cache(name: str):
+    at_key, data_key, _ = _keys(name)
+    _cache().delete_many([at_key, data_key])
+    with _local_lock:
+        _local.pop(name, None)
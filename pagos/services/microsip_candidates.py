@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from pagos.models import Productor
+
+from .microsip_cache import shared_cached
+from .microsip_debt import (
+    _mirror_ready,
+    find_microsip_candidates_for_productor,
+    list_all_microsip_debt_clients,
+    list_microsip_clients_by_rfc,
+)
+from .microsip_source import get_microsip_source, use_microsip_source
+
+
+def _cache_name(productor: Productor) -> str:
+    # Nombre y RFC forman parte de la llave: si cambian, la entrada anterior deja de usarse sola.
+    firma = hashlib.sha1(f"{productor.nombre}|{(productor.rfc or '').strip().upper()}".encode()).hexdigest()[:12]
+    return f"candidatos:{productor.pk}:{firma}"
+
+
+def _ttl() -> float:
+    return getattr(settings, "MICROSIP_CANDIDATES_TTL", 3600)
+
+
+def compute_microsip_candidates(nombre: str, rfc: str) -> dict:
+    """Las tres búsquedas de la pantalla de mapeo: por nombre, lista de deudores y por RFC.
+
+    Con el espejo local son consultas indexadas y se corren en serie; contra Microsip en línea se
+    corren en paralelo (cada una toma su conexión del pool).
+    """
+    mirror = _mirror_ready()
+    lookups = {
+        "candidates": lambda: find_microsip_candidates_for_productor(nombre, limit=20, mirror=mirror),
+        "manual": lambda: list_all_microsip_debt_clients(limit=80, mirror=mirror),
+        "rfc": lambda: list_microsip_clients_by_rfc(rfc, limit=30, mirror=mirror) if (rfc or "").strip() else [],
+    }
+    if mirror:
+        return {k: fn() for k, fn in lookups.items()}
+
+    # El origen Microsip puede estar sustituido sólo en este hilo (use_microsip_source).
+    source = get_microsip_source()
+
+    def run(fn):
+        with use_microsip_source(source):
+            return fn()
+
+    with ThreadPoolExecutor(max_workers=len(lookups), thread_name_prefix="microsip-candidatos") as ex:
+        futures = {k: ex.submit(run, fn) for k, fn in lookups.items()}
+        return {k: f.result() for k, f in futures.items()}
+
+
+def microsip_candidates_for_productor(productor: Productor, *, force: bool = False) -> dict:
+    """Candidatos Microsip del productor desde el cache compartido; si no están, se calculan y publican."""
+    return shared_cached(
+        _cache_name(productor),
+        lambda: compute_microsip_candidates(productor.nombre, productor.rfc or ""),
+        ttl=_ttl(),
+        stale=0,
+        force=force,
+    )
+
+
+def _prefetch(productor_ids: list[int], source):
+    try:
+        with use_microsip_source(source):
+            for productor in Productor.objects.filter(pk__in=productor_ids):
+                try:
+                    microsip_candidates_for_productor(productor, force=True)
+                except Exception:
+                    # Microsip no disponible: la pantalla de mapeo calculará al abrirse.
+                    pass
+    finally:
+        connection.close()
+
+
+def _start_prefetch(productor_ids: list[int]):
+    threading.Thread(
+        target=_prefetch, args=(productor_ids, get_microsip_source()), name="microsip-candidatos", daemon=True
+    ).start()
+
+
+def schedule_microsip_candidates_prefetch(productor_ids):
+    """Precalcula en segundo plano los candidatos de los productores, después del commit en curso."""
+    ids = sorted({int(pk) for pk in productor_ids if pk})
+    if not ids or not getattr(settings, "MICROSIP_CANDIDATES_PREFETCH", True):
+        return
+    transaction.on_commit(lambda: _start_prefetch(ids))
@@ -1,12 +1,29 @@
 from __future__ import annotations
 
+from dataclasses import dataclass, field
 from decimal import Decimal
-from pathlib import Path
 import unicodedata
 import re
-import time
 
-from pagos.models import Compra, DebtSnapshot, TipoCambio
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from pagos.models import (
+    Compra,
+    DebtSnapshot,
+    MicrosipClienteRfc,
+    MicrosipSaldoCliente,
+    MicrosipWatermark,
+    TipoCambio,
+    WorkflowStateChoices,
+)
+
+from .debt import debt_payloads_for, register_debt_snapshot
+from .microsip_cache import expire_shared_cache, invalidate_shared_cache, peek_shared_cache, shared_cached
+from .microsip_pool import get_microsip_pool
+from .microsip_source import get_microsip_source
+from .readiness_queue import refresh_queue_entries
 
 
 SUMMARY_SQL_FILTERED = """
@@ -69,9 +86,65 @@ WHERE (COALESCE(c.SALDO_PENDIENTE,0)+COALESCE(c.REMISION_PENDIENTE,0)) > 0
 ORDER BY CLIENTE
 """
 
-_CACHE_TTL = 300
-_cache_at = 0.0
-_cache_rows: list[dict] = []
+# Versión por cliente del resumen: los CLIENTE_ID van como parámetros (`__IDS__` sólo se expande a
+# "?, ?, ...") y el filtro se aplica dentro de cada CTE, así Firebird lee sólo los documentos del cliente.
+SUMMARY_SQL_BY_CLIENT = """
+WITH CARGOS AS (
+  SELECT d.DOCTO_CC_ID, d.CLIENTE_ID, cl.NOMBRE AS CLIENTE, cl.MONEDA_ID,
+         SUM(i.IMPORTE + i.IMPUESTO - i.IVA_RETENIDO - i.ISR_RETENIDO) AS CARGO_NETO
+  FROM DOCTOS_CC d
+  JOIN CONCEPTOS_CC c ON c.CONCEPTO_CC_ID = d.CONCEPTO_CC_ID
+  JOIN CLIENTES cl ON cl.CLIENTE_ID = d.CLIENTE_ID
+  JOIN IMPORTES_DOCTOS_CC i ON i.DOCTO_CC_ID = d.DOCTO_CC_ID
+  WHERE d.CLIENTE_ID IN (__IDS__)
+    AND d.CANCELADO = 'N' AND d.ESTATUS = 'N' AND i.CANCELADO = 'N' AND i.ESTATUS = 'N'
+    AND i.TIPO_IMPTE = 'C' AND c.NOMBRE IN ('Venta', 'Venta en mostrador')
+  GROUP BY d.DOCTO_CC_ID, d.CLIENTE_ID, cl.NOMBRE, cl.MONEDA_ID
+),
+ABONOS AS (
+  SELECT i.DOCTO_CC_ACR_ID AS DOCTO_CC_ID,
+         SUM(i.IMPORTE + i.IMPUESTO - i.IVA_RETENIDO - i.ISR_RETENIDO) AS ABONO_NETO
+  FROM IMPORTES_DOCTOS_CC i
+  JOIN DOCTOS_CC da ON da.DOCTO_CC_ID = i.DOCTO_CC_ACR_ID
+  WHERE da.CLIENTE_ID IN (__IDS__)
+    AND i.CANCELADO = 'N' AND i.ESTATUS = 'N' AND i.TIPO_IMPTE = 'R'
+  GROUP BY i.DOCTO_CC_ACR_ID
+),
+SALDO_CLIENTE AS (
+  SELECT ca.CLIENTE_ID, ca.CLIENTE, ca.MONEDA_ID,
+         SUM(ca.CARGO_NETO - COALESCE(ab.ABONO_NETO, 0)) AS SALDO_PENDIENTE
+  FROM CARGOS ca
+  LEFT JOIN ABONOS ab ON ab.DOCTO_CC_ID = ca.DOCTO_CC_ID
+  WHERE (ca.CARGO_NETO - COALESCE(ab.ABONO_NETO, 0)) > 0
+  GROUP BY ca.CLIENTE_ID, ca.CLIENTE, ca.MONEDA_ID
+),
+REM_CLIENTE AS (
+  SELECT v.CLIENTE_ID, cl.NOMBRE AS CLIENTE, cl.MONEDA_ID,
+         SUM(COALESCE(v.IMPORTE_NETO, 0)+COALESCE(v.TOTAL_IMPUESTOS, 0)-COALESCE(v.TOTAL_RETENCIONES, 0)
+            +COALESCE(v.FLETES, 0)+COALESCE(v.OTROS_CARGOS, 0)-COALESCE(v.TOTAL_ANTICIPOS, 0)) AS REMISION_PENDIENTE
+  FROM DOCTOS_VE v
+  JOIN CLIENTES cl ON cl.CLIENTE_ID = v.CLIENTE_ID
+  WHERE v.CLIENTE_ID IN (__IDS__) AND v.TIPO_DOCTO = 'R' AND v.ESTATUS = 'P'
+  GROUP BY v.CLIENTE_ID, cl.NOMBRE, cl.MONEDA_ID
+),
+COMBINADO AS (
+  SELECT COALESCE(s.CLIENTE_ID, r.CLIENTE_ID) AS CLIENTE_ID,
+         COALESCE(s.CLIENTE, r.CLIENTE) AS CLIENTE,
+         COALESCE(s.MONEDA_ID, r.MONEDA_ID) AS MONEDA_ID,
+         COALESCE(s.SALDO_PENDIENTE, 0) AS SALDO_PENDIENTE,
+         COALESCE(r.REMISION_PENDIENTE, 0) AS REMISION_PENDIENTE
+  FROM SALDO_CLIENTE s
+  FULL JOIN REM_CLIENTE r ON r.CLIENTE_ID = s.CLIENTE_ID AND r.MONEDA_ID = s.MONEDA_ID
+)
+SELECT COALESCE(c.CLIENTE_ID, 0) AS CLIENTE_ID, TRIM(c.CLIENTE) AS CLIENTE,
+       c.MONEDA_ID,
+       COALESCE(c.SALDO_PENDIENTE, 0) AS SALDO_PENDIENTE,
+       COALESCE(c.REMISION_PENDIENTE, 0) AS REMISION_PENDIENTE,
+       (COALESCE(c.SALDO_PENDIENTE,0)+COALESCE(c.REMISION_PENDIENTE,0)) AS TOTAL
+FROM COMBINADO c
+WHERE (COALESCE(c.SALDO_PENDIENTE,0)+COALESCE(c.REMISION_PENDIENTE,0)) > 0
+ORDER BY CLIENTE
+"""
 
 
 def _json_safe(value):
@@ -104,31 +177,34 @@ def _safe_like_token(value: str) -> str:
     return (tokens[0] if tokens else n)[:40]
 
 
-def _fetch(sql: str):
-    import fdb
-
-    candidates = [
-        (Path(__file__).resolve().parents[3] / "data" / "ALGODONERA.FDB"),
-        (Path(__file__).resolve().parents[2] / "data" / "ALGODONERA.FDB"),
-    ]
-    db_file = next((p for p in candidates if p.exists()), candidates[0])
-    con = fdb.connect(dsn=str(db_file.resolve()), user="SYSDBA", password="masterkey", charset="ISO8859_1")
-    try:
+def _fetch(sql: str, params=()):
+    # Conexión tomada del pool del proceso: evita el handshake de Firebird en cada consulta.
+    sql = get_microsip_source().prepare(sql)
+    with get_microsip_pool().connection() as con:
         cur = con.cursor()
-        cur.execute(sql)
+        cur.execute(sql, params)
         cols = [d[0] for d in cur.description]
         return [dict(zip(cols, r)) for r in cur.fetchall()]
-    finally:
-        con.close()
 
 
 def _rows_all_cached(force: bool = False):
-    global _cache_at, _cache_rows
-    now = time.time()
-    if force or not _cache_rows or (now - _cache_at) > _CACHE_TTL:
-        _cache_rows = _fetch(SUMMARY_SQL_FILTERED.replace("__CLIENT_FILTER__", "1=1"))
-        _cache_at = now
-    return _cache_rows
+    # Cache compartido entre procesos (ver microsip_cache.shared_cached): un solo worker corre la
+    # consulta pesada y los demás leen el resultado.
+    return shared_cached("summary", lambda: _fetch(SUMMARY_SQL_FILTERED.replace("__CLIENT_FILTER__", "1=1")), force=force)
+
+
+def invalidate_microsip_cache():
+    invalidate_shared_cache("summary")
+
+
+def _mapped_cliente_ids(value: str) -> list[int]:
+    # microsip_cliente_id guarda los IDs del cliente base unidos con "|" (variantes 1/2).
+    return sorted({int(x) for x in (value or "").split("|") if x.strip().isdigit()})
+
+
+def _fetch_client_rows(cliente_ids: list[int]):
+    marks = ", ".join("?" for _ in cliente_ids)
+    return _fetch(SUMMARY_SQL_BY_CLIENT.replace("__IDS__", marks), (*cliente_ids, *cliente_ids, *cliente_ids))
 
 
 def _aggregate_clients(rows):
@@ -174,28 +250,136 @@ def _aggregate_clients(rows):
     return sorted(out, key=lambda x: (x["usd"] + x["mxn"]), reverse=True)
 
 
-def find_microsip_candidates_for_productor(productor_name: str, limit: int = 12):
-    token = _safe_like_token(productor_name)
-    all_clients = _aggregate_clients(_rows_all_cached())
-    filtered = [c for c in all_clients if token in _norm_name(c["cliente"]) or any(token in _norm_name(a) for a in c["aliases"])]
-    return filtered[:limit]
+class _ClientIndex:
+    """Agregado por cliente base más índice invertido token -> clientes.
 
+    Se arma una vez por versión de las filas del cache; las búsquedas consultan el vocabulario
+    (mucho menor que clientes x alias) y sólo verifican por subcadena a los candidatos, con los
+    textos ya normalizados.
+    """
+
+    def __init__(self, rows):
+        self.clients = _aggregate_clients(rows)
+        self.by_base = {c["cliente"]: c for c in self.clients}
+        self.names = []
+        self.rfcs = []
+        self.tokens: dict[str, set[int]] = {}
+        self._word_hits: dict[str, set[int]] = {}
+        for i, c in enumerate(self.clients):
+            names = {_norm_name(c["cliente"])} | {_norm_name(a) for a in c["aliases"]}
+            rfc = _norm_name(c.get("rfc", ""))
+            self.names.append(tuple(names))
+            self.rfcs.append(rfc)
+            for text in (*names, rfc):
+                for tok in text.split():
+                    self.tokens.setdefault(tok, set()).add(i)
+
+    def _hits(self, word: str) -> set[int]:
+        # Clientes con algún token que contiene `word`; memo por índice (se descarta al refrescar).
+        hits = self._word_hits.get(word)
+        if hits is None:
+            hits = set(self.tokens.get(word, ()))
+            for tok, ids in self.tokens.items():
+                if word in tok and tok != word:
+                    hits |= ids
+            self._word_hits[word] = hits
+        return hits
+
+    def search(self, query: str, *, include_rfc: bool = False, limit: int = 100):
+        """Clientes cuyo nombre/alias (o RFC) contiene `query` normalizado, en orden de deuda."""
+        words = query.split()
+        if not words:
+            return [dict(c) for c in self.clients[:limit]]
+        ids = set.intersection(*(self._hits(w) for w in words))
+        out = []
+        # Toda palabra de la consulta cae dentro de un token; la subcadena completa se verifica aquí.
+        for i in sorted(ids):
+            if any(query in n for n in self.names[i]) or (include_rfc and query in self.rfcs[i]):
+                out.append(dict(self.clients[i]))
+                if len(out) >= limit:
+                    break
+        return out
+
+
+_index_memo: tuple[object, _ClientIndex] | None = None
+
+
+def _client_index() -> _ClientIndex:
+    global _index_memo
+    rows = _rows_all_cached()
+    memo = _index_memo
+    if memo is None or memo[0] is not rows:
+        memo = (rows, _ClientIndex(rows))
+        _index_memo = memo
+    return memo[1]
+
+
+def _mirror_ready() -> bool:
+    # El espejo local (refrescar_saldos_microsip) existe desde su primera corrida; antes de eso se
+    # consulta Microsip en línea.
+    return MicrosipWatermark.objects.exists()
+
+
+def _mirror_row(s: MicrosipSaldoCliente) -> dict:
+    # Misma forma que una fila del resumen Microsip.
+    return {
+        "CLIENTE_ID": s.cliente_id,
+        "CLIENTE": s.nombre,
+        "RFC": s.rfc,
+        "MONEDA_ID": s.moneda_id,
+        "SALDO_PENDIENTE": s.saldo_pendiente,
+        "REMISION_PENDIENTE": s.remision_pendiente,
+        "TOTAL": s.total,
+    }
+
+
+def _mirror_search(query: str, *, include_rfc: bool = False, limit: int = 100):
+    """Equivalente de `_ClientIndex.search` sobre el espejo: agrega por cliente base en SQL."""
+    deuda = MicrosipSaldoCliente.objects.filter(total__gt=0)
+    bases = deuda
+    if query:
+        match = Q(cliente_base__contains=query) | Q(nombre_norm__contains=query)
+        if include_rfc:
+            match |= Q(rfc__contains=query)
+        bases = deuda.filter(cliente_base__in=deuda.filter(match).values("cliente_base"))
+    dec = DecimalField(max_digits=18, decimal_places=4)
+    top = list(
+        bases.values("cliente_base")
+        .annotate(
+            usd=Sum(Case(When(moneda_id=620, then=F("total")), default=Value(0), output_field=dec)),
+            mxn=Sum(Case(When(moneda_id=1, then=F("total")), default=Value(0), output_field=dec)),
+        )
+        .order_by(-(F("usd") + F("mxn")), "cliente_base")
+        .values_list("cliente_base", flat=True)[:limit]
+    )
+    if not top:
+        return []
+    by_base = {c["cliente"]: c for c in _aggregate_clients(_mirror_row(s) for s in deuda.filter(cliente_base__in=top))}
+    return [by_base[b] for b in top if b in by_base]
 
-def list_all_microsip_debt_clients(search: str = "", limit: int = 100):
-    all_clients = _aggregate_clients(_rows_all_cached())
-    if (search or "").strip():
-        token = _norm_name(search)
-        all_clients = [
-            c for c in all_clients
-            if token in _norm_name(c["cliente"]) or any(token in _norm_name(a) for a in c["aliases"]) or token in _norm_name(c.get("rfc", ""))
-        ]
-    return all_clients[:limit]
 
+def find_microsip_candidates_for_productor(productor_name: str, limit: int = 12, *, mirror: bool | None = None):
+    # `mirror` permite decidir el origen una sola vez (p. ej. antes de repartir búsquedas en hilos).
+    if _mirror_ready() if mirror is None else mirror:
+        return _mirror_search(_safe_like_token(productor_name), limit=limit)
+    return _client_index().search(_safe_like_token(productor_name), limit=limit)
 
-def list_microsip_clients_by_rfc(rfc: str, limit: int = 40):
-    r = _norm_name(rfc)
-    if not r:
-        return []
+
+def list_all_microsip_debt_clients(search: str = "", limit: int = 100, *, mirror: bool | None = None):
+    if _mirror_ready() if mirror is None else mirror:
+        return _mirror_search(_norm_name(search), include_rfc=True, limit=limit)
+    return _client_index().search(_norm_name(search), include_rfc=True, limit=limit)
+
+
+def _mirror_clients_by_rfc(r: str, limit: int):
+    ids = MicrosipClienteRfc.objects.filter(rfc=r).values("cliente_id")
+    clientes = list(MicrosipSaldoCliente.objects.filter(cliente_id__in=ids).order_by("nombre")[:limit])
+    deuda = MicrosipSaldoCliente.objects.filter(total__gt=0, cliente_base__in={c.cliente_base for c in clientes})
+    totals_by_base = {c["cliente"]: c for c in _aggregate_clients(_mirror_row(s) for s in deuda)}
+    return [{"CLIENTE_ID": c.cliente_id, "CLIENTE": c.nombre, "RFC": r} for c in clientes], totals_by_base
+
+
+def _live_clients_by_rfc(r: str, limit: int):
     sql = f"""
     SELECT FIRST {int(limit)}
       cl.CLIENTE_ID,
@@ -203,13 +387,22 @@ def list_microsip_clients_by_rfc(rfc: str, limit: int = 40):
       TRIM(COALESCE(dc.RFC_CURP,'')) AS RFC
     FROM CLIENTES cl
     LEFT JOIN DIRS_CLIENTES dc ON dc.CLIENTE_ID = cl.CLIENTE_ID
-    WHERE UPPER(TRIM(COALESCE(dc.RFC_CURP,''))) = '{r}'
+    WHERE UPPER(TRIM(COALESCE(dc.RFC_CURP,''))) = ?
     ORDER BY cl.NOMBRE
     """
-    rows = _fetch(sql)
-
+    rows = _fetch(sql, (r,))
     # Totales reales de deuda/remisión por cliente base (para no mostrar 0 falso en candidatos RFC).
-    totals_by_base = {c["cliente"]: c for c in _aggregate_clients(_rows_all_cached())}
+    return rows, _client_index().by_base
+
+
+def list_microsip_clients_by_rfc(rfc: str, limit: int = 40, *, mirror: bool | None = None):
+    r = _norm_name(rfc)
+    if not r:
+        return []
+    if _mirror_ready() if mirror is None else mirror:
+        rows, totals_by_base = _mirror_clients_by_rfc(r, limit)
+    else:
+        rows, totals_by_base = _live_clients_by_rfc(r, limit)
 
     # Unificar IDs (1/2) bajo el mismo cliente base para mapear ambos al productor.
     by_base = {}
@@ -248,19 +441,8 @@ def list_microsip_clients_by_rfc(rfc: str, limit: int = 40):
     return sorted(out, key=lambda x: x["cliente"])
 
 
-def sync_microsip_debt_for_compra(compra: Compra):
-    mapped_name = (compra.productor.microsip_cliente_nombre or "").strip()
-    if not mapped_name:
-        raise ValueError("Productor sin cliente Microsip mapeado. Selecciona cliente exacto en 'Mapear cliente Microsip'.")
-
-    all_rows = _rows_all_cached()
-
-    base = _client_base(mapped_name)
-    rows = [r for r in all_rows if _client_base(r.get("CLIENTE", "")) == base]
-    match_mode = "exact_mapped_base"
-    token_used = base
-
-    total_mxn, total_usd = Decimal("0"), Decimal("0")
+def _sum_by_moneda(rows) -> tuple[Decimal, Decimal]:
+    total_usd, total_mxn = Decimal("0"), Decimal("0")
     for r in rows:
         moneda = int(r.get("MONEDA_ID") or 0)
         total = Decimal(str(r.get("TOTAL") or 0))
@@ -268,25 +450,99 @@ def sync_microsip_debt_for_compra(compra: Compra):
             total_mxn += total
         elif moneda == 620:
             total_usd += total
+    return total_usd, total_mxn
+
+
+class _DebtSource:
+    """Filas de deuda de una sola fuente, cruzadas igual para una compra que en lote: por los
+    CLIENTE_ID mapeados y, si el productor no tiene IDs, por cliente base."""
+
+    def __init__(self, rows, mirror: bool = False):
+        self.mirror = mirror
+        self.by_id: dict[str, list[dict]] = {}
+        self.by_base: dict[str, list[dict]] = {}
+        for r in rows:
+            self.by_id.setdefault(str(r.get("CLIENTE_ID") or "").strip(), []).append(r)
+            self.by_base.setdefault(_client_base(r.get("CLIENTE", "")), []).append(r)
 
-    snap = DebtSnapshot.objects.create(
-        compra=compra,
-        fuente="microsip",
-        total_usd=total_usd,
-        total_mxn=total_mxn,
-        detalle_json=_json_safe({"match_mode": match_mode, "match_token": token_used, "rows": rows}),
+    def rows_for(self, base: str, cliente_ids: list[int]) -> tuple[list[dict], str, str]:
+        """(filas, match_mode, match_token) del productor mapeado."""
+        if cliente_ids:
+            rows = [r for cid in cliente_ids for r in self.by_id.get(str(cid), [])]
+            mode, token = "cliente_id", "|".join(str(x) for x in cliente_ids)
+        else:
+            rows, mode, token = self.by_base.get(base, []), "exact_mapped_base", base
+        return rows, ("local_mirror" if self.mirror else mode), token
+
+
+def _debt_source(*, force: bool, base: str = "", cliente_ids: list[int] | None = None, batch: bool = False) -> _DebtSource:
+    """Fuente de deuda Microsip: espejo local -> resumen en cache -> documentos de los CLIENTE_ID -> resumen completo.
+
+    Con `batch` (todas las compras abiertas) no se filtra por cliente: una sola lectura para todos.
+    `force` salta el espejo y el cache y consulta Microsip al momento.
+    """
+    if not force and _mirror_ready():
+        saldos = MicrosipSaldoCliente.objects.filter(total__gt=0)
+        if not batch:
+            saldos = saldos.filter(cliente_id__in=cliente_ids) if cliente_ids else saldos.filter(cliente_base=base)
+        return _DebtSource([_mirror_row(s) for s in saldos.order_by("nombre")], mirror=True)
+    cached = None if force or batch else peek_shared_cache("summary")
+    if cached is not None:
+        return _DebtSource(cached)
+    if cliente_ids and not batch:
+        # Sin cache (o forzado): consulta acotada a los documentos del cliente mapeado.
+        rows = _fetch_client_rows(cliente_ids)
+        if force:
+            # Los demás procesos siguen sirviendo el resumen y lo recalculan en segundo plano.
+            expire_shared_cache("summary")
+        return _DebtSource(rows)
+    return _DebtSource(_rows_all_cached(force=force))
+
+
+def sync_microsip_debt_for_compra(compra: Compra, force: bool = False):
+    """Guarda un DebtSnapshot con la deuda Microsip del cliente mapeado.
+
+    Lee el espejo local de saldos si ya se construyó; si no, el resumen del cache compartido si está
+    disponible. Sin ninguno de los dos (o con `force=True`) consulta sólo los documentos de los
+    CLIENTE_ID mapeados. Productores mapeados sin ID caen a la consulta completa.
+    """
+    mapped_name = (compra.productor.microsip_cliente_nombre or "").strip()
+    if not mapped_name:
+        raise ValueError("Productor sin cliente Microsip mapeado. Selecciona cliente exacto en 'Mapear cliente Microsip'.")
+
+    base = _client_base(mapped_name)
+    cliente_ids = _mapped_cliente_ids(compra.productor.microsip_cliente_id)
+    rows, match_mode, token_used = _debt_source(force=force, base=base, cliente_ids=cliente_ids).rows_for(base, cliente_ids)
+
+    total_usd, total_mxn = _sum_by_moneda(rows)
+
+    snap = register_debt_snapshot(
+        compra,
+        total_usd,
+        total_mxn,
+        {"match_mode": match_mode, "match_token": token_used, "rows": _json_safe(rows)},
     )
 
+    def tc_for(fecha):
+        tc_row = TipoCambio.objects.filter(fecha=fecha).first() if fecha else None
+        return tc_row or TipoCambio.objects.order_by("-fecha").first()
+
+    _apply_debt_totals(compra, total_usd, total_mxn, tc_for)
+    compra.save(update_fields=_DEBT_FIELDS)
+    return snap
+
+
+_DEBT_FIELDS = ["retencion_deudas_usd", "retencion_deudas_mxn", "tipo_cambio", "tipo_cambio_valor", "total_deuda_en_dls", "saldo_pendiente", "saldo_por_pagar", "updated_at"]
+
+
+def _apply_debt_totals(compra: Compra, total_usd: Decimal, total_mxn: Decimal, tc_for):
+    # tc_for(fecha_liq) -> TipoCambio del día (o el último disponible) cuando la compra no tiene TC.
     compra.retencion_deudas_usd = total_usd
     compra.retencion_deudas_mxn = total_mxn
 
     tc = compra.tipo_cambio_valor or Decimal("0")
     if tc <= 0:
-        tc_row = None
-        if compra.fecha_liq:
-            tc_row = TipoCambio.objects.filter(fecha=compra.fecha_liq).first()
-        if not tc_row:
-            tc_row = TipoCambio.objects.order_by("-fecha").first()
+        tc_row = tc_for(compra.fecha_liq)
         if tc_row:
             compra.tipo_cambio = tc_row
             compra.tipo_cambio_valor = tc_row.tc
@@ -298,5 +554,84 @@ def sync_microsip_debt_for_compra(compra: Compra):
         compra.total_deuda_en_dls = total_usd
 
     compra.saldo_pendiente = (compra.compra_en_libras or Decimal("0")) - (compra.total_deuda_en_dls or Decimal("0"))
-    compra.save(update_fields=["retencion_deudas_usd", "retencion_deudas_mxn", "tipo_cambio", "tipo_cambio_valor", "total_deuda_en_dls", "saldo_pendiente", "updated_at"])
-    return snap
+
+
+@dataclass
+class DebtSyncResult:
+    synced: int = 0
+    changed: int = 0
+    unmapped: int = 0
+    delta_usd: Decimal = Decimal("0")
+    delta_mxn: Decimal = Decimal("0")
+    changes: list[dict] = field(default_factory=list)
+
+
+def sync_microsip_debt_for_open_compras(*, dry_run: bool = False, force: bool = True) -> DebtSyncResult:
+    """Sincroniza la deuda Microsip de todas las compras abiertas (no pagadas, no canceladas).
+
+    Toma una sola foto de la deuda (el espejo local si ya existe y no se fuerza; si no, el resumen
+    Microsip, que `force=True` consulta al momento), la cruza con cada productor igual que
+    `sync_microsip_debt_for_compra` y escribe snapshots y campos de deuda en lote, en una transacción.
+    """
+    source = _debt_source(force=force, batch=True)
+
+    compras = list(
+        Compra.objects.select_related("productor", "tipo_cambio")
+        .filter(cancelada=False)
+        .exclude(workflow_state=WorkflowStateChoices.PAID)
+        .order_by("id")
+    )
+    fechas = {c.fecha_liq for c in compras if c.fecha_liq and not (c.tipo_cambio_valor or 0) > 0}
+    tc_por_fecha = {tc.fecha: tc for tc in TipoCambio.objects.filter(fecha__in=fechas)}
+    tc_latest = TipoCambio.objects.order_by("-fecha").first() if compras else None
+
+    result = DebtSyncResult()
+    snapshots, snapshot_rows, updated = [], [], []
+    now = timezone.now()
+    for compra in compras:
+        mapped_name = (compra.productor.microsip_cliente_nombre or "").strip()
+        if not mapped_name:
+            result.unmapped += 1
+            continue
+        client_rows, match_mode, token = source.rows_for(
+            _client_base(mapped_name), _mapped_cliente_ids(compra.productor.microsip_cliente_id)
+        )
+        total_usd, total_mxn = _sum_by_moneda(client_rows)
+        before = [getattr(compra, f) for f in _DEBT_FIELDS[:-1]]
+        old_usd, old_mxn = compra.retencion_deudas_usd or Decimal("0"), compra.retencion_deudas_mxn or Decimal("0")
+
+        _apply_debt_totals(compra, total_usd, total_mxn, lambda fecha: tc_por_fecha.get(fecha) or tc_latest)
+        # Igual que Compra.save(): re-deriva TC y deuda en DLS con el TC precargado.
+        compra.calcular_campos_derivados(tc_por_fecha=tc_por_fecha)
+        result.synced += 1
+        snapshots.append(
+            DebtSnapshot(
+                compra=compra,
+                fuente="microsip",
+                total_usd=total_usd,
+                total_mxn=total_mxn,
+                detalle_json={"match_mode": match_mode, "match_token": token, "batch": True},
+            )
+        )
+        snapshot_rows.append(_json_safe(client_rows))
+        if total_usd != old_usd or total_mxn != old_mxn:
+            result.changed += 1
+            result.delta_usd += total_usd - old_usd
+            result.delta_mxn += total_mxn - old_mxn
+            result.changes.append(
+                {"compra_id": compra.id, "numero_compra": compra.numero_compra, "productor": compra.productor.nombre,
+                 "usd_antes": old_usd, "usd": total_usd, "mxn_antes": old_mxn, "mxn": total_mxn}
+            )
+        if [getattr(compra, f) for f in _DEBT_FIELDS[:-1]] != before:
+            compra.updated_at = now
+            updated.append(compra)
+
+    if not dry_run:
+        with transaction.atomic():
+            # Compras del mismo cliente comparten filas: un solo payload por contenido.
+            for snap, payload in zip(snapshots, debt_payloads_for(snapshot_rows)):
+                snap.payload = payload
+            DebtSnapshot.objects.bulk_create(snapshots, batch_size=500)
+            Compra.objects.bulk_update(updated, _DEBT_FIELDS, batch_size=500)
+            refresh_queue_entries(Q(pk__in=[c.pk for c in updated]))
+    return result
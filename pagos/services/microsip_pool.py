@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+from .microsip_source import get_microsip_source
+
+
+@dataclass
+class _Slot:
+    con: object
+    created_at: float
+    last_used: float
+
+
+@dataclass
+class PoolMetrics:
+    checkouts: int = 0
+    created: int = 0
+    reused: int = 0
+    evicted_idle: int = 0
+    discarded: int = 0
+    timeouts: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "created": self.created,
+                "reused": self.reused,
+                "evicted_idle": self.evicted_idle,
+                "discarded": self.discarded,
+                "timeouts": self.timeouts,
+                "wait_total_ms": round(self.wait_total * 1000, 3),
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+                "wait_avg_ms": round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+            }
+
+
+class ConnectionPool:
+    """Pool de conexiones reutilizables, seguro entre hilos.
+
+    - `max_size` limita las conexiones abiertas (en uso + ociosas); al llegar al tope se espera
+      hasta `timeout` segundos y luego se lanza TimeoutError.
+    - Las conexiones ociosas más de `idle_timeout` se cierran al siguiente checkout.
+    - Una conexión ociosa más de `check_after` segundos se valida con `health_sql` antes de
+      entregarse; si falla se descarta y se abre otra.
+    - Al devolverla se hace rollback para cerrar la transacción de lectura (Firebird ve una
+      foto fija de los datos mientras la transacción siga abierta).
+    - Tras un fork (workers, comandos hijos) el pool se reinicia sin tocar las conexiones del padre.
+    """
+
+    def __init__(
+        self,
+        connect,
+        *,
+        max_size: int = 4,
+        idle_timeout: float = 300.0,
+        check_after: float = 30.0,
+        timeout: float = 10.0,
+        health_sql: str = "SELECT 1 FROM RDB$DATABASE",
+    ):
+        self._connect = connect
+        self.max_size = max(int(max_size), 1)
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.timeout = timeout
+        self.health_sql = health_sql
+        self.metrics = PoolMetrics()
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle: list[_Slot] = []
+        self._open = 0
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    @staticmethod
+    def _close(slot: _Slot):
+        try:
+            slot.con.close()
+        except Exception:
+            pass
+
+    def _healthy(self, slot: _Slot) -> bool:
+        try:
+            cur = slot.con.cursor()
+            cur.execute(self.health_sql)
+            cur.fetchall()
+            slot.con.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _evict_idle(self, now: float) -> list[_Slot]:
+        stale = [s for s in self._idle if now - s.last_used > self.idle_timeout]
+        if stale:
+            self._idle = [s for s in self._idle if now - s.last_used <= self.idle_timeout]
+            self._open -= len(stale)
+        return stale
+
+    def acquire(self) -> _Slot:
+        t0 = time.monotonic()
+        deadline = t0 + self.timeout
+        while True:
+            with self._cond:
+                self._check_fork()
+                stale = self._evict_idle(time.time())
+                slot, create = None, False
+                while slot is None and not create:
+                    if self._idle:
+                        # LIFO: la más reciente es la que menos probable es que el servidor haya cerrado.
+                        slot = self._idle.pop()
+                    elif self._open < self.max_size:
+                        self._open += 1
+                        create = True
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            with self.metrics._lock:
+                                self.metrics.timeouts += 1
+                            raise TimeoutError(f"Pool Microsip agotado ({self.max_size} conexiones en uso).")
+                        self._cond.wait(remaining)
+            # Cierre y conexión fuera del candado: no bloquean a otros hilos.
+            for s in stale:
+                self._close(s)
+            with self.metrics._lock:
+                self.metrics.evicted_idle += len(stale)
+            if create:
+                try:
+                    now = time.time()
+                    slot = _Slot(self._connect(), now, now)
+                except BaseException:
+                    self._forget()
+                    raise
+                created = True
+            else:
+                created = False
+                if time.time() - slot.last_used > self.check_after and not self._healthy(slot):
+                    self._close(slot)
+                    self._forget(discarded=True)
+                    continue
+            waited = time.monotonic() - t0
+            with self.metrics._lock:
+                self.metrics.checkouts += 1
+                self.metrics.created += int(created)
+                self.metrics.reused += int(not created)
+                self.metrics.wait_total += waited
+                self.metrics.wait_max = max(self.metrics.wait_max, waited)
+            return slot
+
+    def _forget(self, discarded: bool = False):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+        if discarded:
+            with self.metrics._lock:
+                self.metrics.discarded += 1
+
+    def release(self, slot: _Slot, *, broken: bool = False):
+        if not broken:
+            try:
+                slot.con.rollback()
+            except Exception:
+                broken = True
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            if broken:
+                self._open -= 1
+            else:
+                slot.last_used = time.time()
+                self._idle.append(slot)
+            self._cond.notify()
+        if broken:
+            self._close(slot)
+            with self.metrics._lock:
+                self.metrics.discarded += 1
+
+    @contextmanager
+    def connection(self):
+        slot = self.acquire()
+        # Cualquier salida con error (también KeyboardInterrupt, GeneratorExit o SystemExit) descarta la
+        # conexión: puede quedar a media consulta. El lugar en el pool se libera siempre.
+        broken = True
+        try:
+            yield slot.con
+            broken = False
+        finally:
+            self.release(slot, broken=broken)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for s in idle:
+            self._close(s)
+
+    def stats(self) -> dict:
+        with self._cond:
+            state = {"max_size": self.max_size, "open": self._open, "idle": len(self._idle), "in_use": self._open - len(self._idle)}
+        return {**state, **self.metrics.as_dict()}
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pool_lock = threading.Lock()
+
+
+def get_microsip_pool() -> ConnectionPool:
+    # Un pool por origen de datos configurado (Firebird de producción o el sustituto SQLite).
+    source = get_microsip_source()
+    pool = _pools.get(source.key)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(source.key)
+            if pool is None:
+                pool = _pools[source.key] = ConnectionPool(
+                    source.connect,
+                    max_size=getattr(settings, "MICROSIP_POOL_MAX_SIZE", 4),
+                    idle_timeout=getattr(settings, "MICROSIP_POOL_IDLE_SECONDS", 300),
+                    timeout=getattr(settings, "MICROSIP_POOL_TIMEOUT", 10),
+                    health_sql=source.health_sql,
+                )
+    return pool
+
+
+def microsip_pool_stats() -> dict:
+    return get_microsip_pool().stats()
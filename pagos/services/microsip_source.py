@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import random
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+
+
+class MicrosipSource:
+    """Origen de datos para las consultas Microsip: cómo conectar y cómo adaptar el SQL (dialecto Firebird)."""
+
+    key = ""
+    health_sql = "SELECT 1"
+
+    def connect(self):
+        raise NotImplementedError
+
+    def prepare(self, sql: str) -> str:
+        return sql
+
+
+class FirebirdSource(MicrosipSource):
+    health_sql = "SELECT 1 FROM RDB$DATABASE"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.key = f"firebird:{self.path}"
+
+    def connect(self):
+        import fdb
+
+        return fdb.connect(dsn=str(self.path), user="SYSDBA", password="masterkey", charset="ISO8859_1")
+
+
+_FIRST_RE = re.compile(r"SELECT\s+FIRST\s+(\d+)\s+", re.IGNORECASE)
+
+
+@lru_cache(maxsize=64)
+def firebird_to_sqlite(sql: str) -> str:
+    """Traduce `SELECT FIRST n` (tope o subconsulta entre paréntesis) a `LIMIT n`; el resto del SQL es común."""
+    while True:
+        m = _FIRST_RE.search(sql)
+        if not m:
+            return sql
+        n = m.group(1)
+        head = sql[: m.start()]
+        body = sql[m.end():]
+        if head.rstrip().endswith("("):
+            # Subconsulta: LIMIT antes del paréntesis que la cierra.
+            depth = 1
+            for i, ch in enumerate(body):
+                depth += ch == "("
+                depth -= ch == ")"
+                if depth == 0:
+                    break
+            sql = f"{head}SELECT {body[:i].rstrip()} LIMIT {n}{body[i:]}"
+        else:
+            sql = f"{head}SELECT {body.rstrip().rstrip(';')}\nLIMIT {n}\n"
+
+
+class SQLiteSource(MicrosipSource):
+    """Sustituto local con el mismo esquema de Microsip (pruebas de carga y benchmarks sin el .FDB)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.key = f"sqlite:{self.path}"
+
+    def connect(self):
+        # El pool entrega cada conexión a un solo hilo a la vez, pero no siempre al mismo.
+        return sqlite3.connect(str(self.path), check_same_thread=False)
+
+    def prepare(self, sql: str) -> str:
+        return firebird_to_sqlite(sql)
+
+
+def microsip_db_path() -> Path:
+    configured = getattr(settings, "MICROSIP_DB_PATH", None)
+    if configured:
+        return Path(configured)
+    candidates = [
+        (Path(__file__).resolve().parents[3] / "data" / "ALGODONERA.FDB"),
+        (Path(__file__).resolve().parents[2] / "data" / "ALGODONERA.FDB"),
+    ]
+    return next((p for p in candidates if p.exists()), candidates[0]).resolve()
+
+
+_override = threading.local()
+
+
+def get_microsip_source() -> MicrosipSource:
+    source = getattr(_override, "source", None)
+    if source is not None:
+        return source
+    if getattr(settings, "MICROSIP_SOURCE", "firebird") == "sqlite":
+        return SQLiteSource(settings.MICROSIP_SQLITE_PATH)
+    return FirebirdSource(microsip_db_path())
+
+
+@contextmanager
+def use_microsip_source(source: MicrosipSource):
+    """Usa `source` en este hilo (benchmarks, comandos de prueba) sin cambiar settings."""
+    previous = getattr(_override, "source", None)
+    _override.source = source
+    try:
+        yield source
+    finally:
+        _override.source = previous
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS CLIENTES (
+  CLIENTE_ID INTEGER PRIMARY KEY,
+  NOMBRE VARCHAR(100) NOT NULL,
+  MONEDA_ID INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS DIRS_CLIENTES (
+  DIR_CLI_ID INTEGER PRIMARY KEY,
+  CLIENTE_ID INTEGER NOT NULL,
+  RFC_CURP VARCHAR(18),
+  USAR_PARA_FACTURAR CHAR(1) DEFAULT 'S',
+  ES_DIR_PPAL CHAR(1) DEFAULT 'S'
+);
+CREATE TABLE IF NOT EXISTS CONCEPTOS_CC (
+  CONCEPTO_CC_ID INTEGER PRIMARY KEY,
+  NOMBRE VARCHAR(50) NOT NULL
+);
+CREATE TABLE IF NOT EXISTS DOCTOS_CC (
+  DOCTO_CC_ID INTEGER PRIMARY KEY,
+  CONCEPTO_CC_ID INTEGER NOT NULL,
+  CLIENTE_ID INTEGER NOT NULL,
+  FECHA DATE,
+  CANCELADO CHAR(1) DEFAULT 'N',
+  ESTATUS CHAR(1) DEFAULT 'N'
+);
+CREATE TABLE IF NOT EXISTS IMPORTES_DOCTOS_CC (
+  IMPTE_DOCTO_CC_ID INTEGER PRIMARY KEY,
+  DOCTO_CC_ID INTEGER NOT NULL,
+  DOCTO_CC_ACR_ID INTEGER,
+  TIPO_IMPTE CHAR(1) NOT NULL,
+  IMPORTE NUMERIC(15, 2) DEFAULT 0,
+  IMPUESTO NUMERIC(15, 2) DEFAULT 0,
+  IVA_RETENIDO NUMERIC(15, 2) DEFAULT 0,
+  ISR_RETENIDO NUMERIC(15, 2) DEFAULT 0,
+  CANCELADO CHAR(1) DEFAULT 'N',
+  ESTATUS CHAR(1) DEFAULT 'N'
+);
+CREATE TABLE IF NOT EXISTS DOCTOS_VE (
+  DOCTO_VE_ID INTEGER PRIMARY KEY,
+  CLIENTE_ID INTEGER NOT NULL,
+  TIPO_DOCTO CHAR(1) NOT NULL,
+  ESTATUS CHAR(1) NOT NULL,
+  FECHA DATE,
+  IMPORTE_NETO NUMERIC(15, 2) DEFAULT 0,
+  TOTAL_IMPUESTOS NUMERIC(15, 2) DEFAULT 0,
+  TOTAL_RETENCIONES NUMERIC(15, 2) DEFAULT 0,
+  FLETES NUMERIC(15, 2) DEFAULT 0,
+  OTROS_CARGOS NUMERIC(15, 2) DEFAULT 0,
+  TOTAL_ANTICIPOS NUMERIC(15, 2) DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS DIRS_CLIENTES_CLIENTE ON DIRS_CLIENTES (CLIENTE_ID);
+CREATE INDEX IF NOT EXISTS DOCTOS_CC_CLIENTE ON DOCTOS_CC (CLIENTE_ID);
+CREATE INDEX IF NOT EXISTS IMPORTES_DOCTO ON IMPORTES_DOCTOS_CC (DOCTO_CC_ID);
+CREATE INDEX IF NOT EXISTS IMPORTES_ACR ON IMPORTES_DOCTOS_CC (DOCTO_CC_ACR_ID);
+CREATE INDEX IF NOT EXISTS DOCTOS_VE_CLIENTE ON DOCTOS_VE (CLIENTE_ID);
+"""
+
+_NOMBRES = ["JUAN", "MARIA", "JOSE", "ANA", "LUIS", "EVA", "PEDRO", "SARA", "JACOB", "HELENA", "ABRAHAM", "CORNELIO"]
+_APELLIDOS = ["PEREZ", "LOPEZ", "REIMER", "FRIESEN", "WIEBE", "GOMEZ", "KLASSEN", "MARTINEZ", "PENNER", "BERGEN", "DYCK", "FEHR"]
+_BATCH = 50_000
+
+
+def generate_synthetic_book(path: Path, *, documentos: int = 10_000, clientes: int | None = None, seed: int = 7) -> dict:
+    """Crea (o reemplaza) un libro de cuentas por cobrar sintético en SQLite.
+
+    Por cada cargo de venta, ~40% tiene un cobro que lo liquida total o parcialmente; además hay
+    ~10% de remisiones en DOCTOS_VE. ~30% de los clientes tienen variante "1 "/"2 " en otra moneda.
+    """
+    rnd = random.Random(seed)
+    path = Path(path)
+    path.unlink(missing_ok=True)
+    documentos = max(int(documentos), 1)
+    clientes = max(int(clientes or documentos // 20), 1)
+
+    con = sqlite3.connect(str(path))
+    con.execute("PRAGMA journal_mode=OFF")
+    con.execute("PRAGMA synchronous=OFF")
+    con.executescript(SQLITE_SCHEMA)
+    con.executemany(
+        "INSERT INTO CONCEPTOS_CC (CONCEPTO_CC_ID, NOMBRE) VALUES (?, ?)",
+        [(1, "Venta"), (2, "Venta en mostrador"), (3, "Cobro")],
+    )
+
+    cliente_rows, dir_rows = [], []
+    cid = 0
+    for n in range(clientes):
+        nombre = f"{rnd.choice(_APELLIDOS)} {rnd.choice(_NOMBRES)} {n:05d}"
+        rfc = f"{nombre[:4].replace(' ', 'X')}{rnd.randrange(500101, 991231)}{rnd.choice('ABC')}{rnd.randrange(10, 99)}"
+        variants = [("1 " + nombre, 1), ("2 " + nombre, 620)] if rnd.random() < 0.3 else [(nombre, rnd.choice((1, 620)))]
+        for name, moneda in variants:
+            cid += 1
+            cliente_rows.append((cid, name, moneda))
+            dir_rows.append((cid, cid, rfc, "S", "S"))
+    con.executemany("INSERT INTO CLIENTES (CLIENTE_ID, NOMBRE, MONEDA_ID) VALUES (?, ?, ?)", cliente_rows)
+    con.executemany(
+        "INSERT INTO DIRS_CLIENTES (DIR_CLI_ID, CLIENTE_ID, RFC_CURP, USAR_PARA_FACTURAR, ES_DIR_PPAL) VALUES (?, ?, ?, ?, ?)",
+        dir_rows,
+    )
+
+    start = date(2024, 1, 1)
+    doc_id = imp_id = 0
+    doctos, importes = [], []
+
+    def flush():
+        con.executemany(
+            "INSERT INTO DOCTOS_CC (DOCTO_CC_ID, CONCEPTO_CC_ID, CLIENTE_ID, FECHA, CANCELADO, ESTATUS) VALUES (?, ?, ?, ?, ?, ?)",
+            doctos,
+        )
+        con.executemany(
+            "INSERT INTO IMPORTES_DOCTOS_CC (IMPTE_DOCTO_CC_ID, DOCTO_CC_ID, DOCTO_CC_ACR_ID, TIPO_IMPTE, IMPORTE, IMPUESTO, "
+            "IVA_RETENIDO, ISR_RETENIDO, CANCELADO, ESTATUS) VALUES (?, ?, ?, ?, ?, ?, 0, 0, ?, 'N')",
+            importes,
+        )
+        doctos.clear()
+        importes.clear()
+
+    for _ in range(documentos):
+        cliente = rnd.randrange(1, cid + 1)
+        fecha = (start + timedelta(days=rnd.randrange(900))).isoformat()
+        importe = round(rnd.uniform(1_000, 200_000), 2)
+        impuesto = round(importe * 0.16, 2) if rnd.random() < 0.5 else 0
+        cancelado = "S" if rnd.random() < 0.02 else "N"
+        doc_id += 1
+        imp_id += 1
+        cargo_id = doc_id
+        doctos.append((cargo_id, rnd.choice((1, 1, 1, 2)), cliente, fecha, cancelado, "N"))
+        importes.append((imp_id, cargo_id, None, "C", importe, impuesto, cancelado))
+        if rnd.random() < 0.4:
+            abono = importe + impuesto if rnd.random() < 0.6 else round((importe + impuesto) * rnd.uniform(0.1, 0.9), 2)
+            doc_id += 1
+            imp_id += 1
+            doctos.append((doc_id, 3, cliente, fecha, "N", "N"))
+            importes.append((imp_id, doc_id, cargo_id, "R", abono, 0, "N"))
+        if len(doctos) >= _BATCH:
+            flush()
+    flush()
+
+    remisiones = []
+    for n in range(documentos // 10):
+        neto = round(rnd.uniform(500, 50_000), 2)
+        remisiones.append(
+            (n + 1, rnd.randrange(1, cid + 1), "R", "P" if rnd.random() < 0.6 else "F",
+             (start + timedelta(days=rnd.randrange(900))).isoformat(), neto, round(neto * 0.16, 2), 0, 0, 0, 0)
+        )
+    con.executemany(
+        "INSERT INTO DOCTOS_VE (DOCTO_VE_ID, CLIENTE_ID, TIPO_DOCTO, ESTATUS, FECHA, IMPORTE_NETO, TOTAL_IMPUESTOS, "
+        "TOTAL_RETENCIONES, FLETES, OTROS_CARGOS, TOTAL_ANTICIPOS) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        remisiones,
+    )
+    con.commit()
+    con.close()
+    return {"clientes": cid, "documentos_cc": doc_id, "cargos": documentos, "remisiones": len(remisiones)}
@@ -0,0 +1,343 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, CharField, Count, Exists, F, IntegerField, OuterRef, Prefetch, Q, Subquery, Value, When
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+
+from pagos.models import (
+    Compra,
+    DocumentoCompra,
+    InvoiceValidationResult,
+    PagoCompra,
+    QueueEntry,
+    QueueProjectionState,
+    WorkflowStateChoices,
+)
+
+from .beneficiary import bulk_beneficiary_validation
+
+QUEUE_STATES = ("SOLICITUD_PENDIENTE", "SOLICITUD_ENVIADA", "WAITING_BANK_CONFIRMATION", "READY_TO_PAY", "PAID")
+
+# Prioridad en centésimas (entero) para ordenar y paginar sin comparar flotantes.
+_STATE_SCORE = {"READY_TO_PAY": 10000, "WAITING_BANK_CONFIRMATION": 7000, "SOLICITUD_ENVIADA": 4000, "SOLICITUD_PENDIENTE": 2000}
+_MAX_AGING_DAYS = 30
+_MAX_SALDO_SCORE = 2000  # 20 puntos = saldo de 200,000 USD o más
+
+
+def _queue_state():
+    W = WorkflowStateChoices
+    return Case(
+        When(workflow_state=W.WAITING_INVOICE, solicitud_factura_enviada=True, then=Value("SOLICITUD_ENVIADA")),
+        When(workflow_state=W.WAITING_INVOICE, then=Value("SOLICITUD_PENDIENTE")),
+        When(workflow_state__in=[W.INVOICE_BLOCKED, W.INVOICE_VALID], then=Value("SOLICITUD_ENVIADA")),
+        When(workflow_state=W.WAITING_BANK_CONFIRMATION, then=Value("WAITING_BANK_CONFIRMATION")),
+        When(workflow_state=W.READY_TO_PAY, then=Value("READY_TO_PAY")),
+        When(workflow_state=W.PAID, then=Value("PAID")),
+        default=Value("OTHER"),
+        output_field=CharField(),
+    )
+
+
+def _priority(today: date):
+    estado = Case(*[When(q_estado=s, then=Value(v)) for s, v in _STATE_SCORE.items()], default=Value(0), output_field=IntegerField())
+    # Un punto por día desde fecha_liq, tope 30: escalones de fecha en vez de aritmética de fechas (no es portable).
+    antiguedad = Case(
+        *[When(fecha_liq__lte=today - timedelta(days=d), then=Value(d * 100)) for d in range(_MAX_AGING_DAYS, 0, -1)],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    saldo = Case(
+        When(saldo_por_pagar__gte=Decimal(_MAX_SALDO_SCORE) * 100, then=Value(_MAX_SALDO_SCORE)),
+        When(saldo_por_pagar__gt=0, then=Cast(Round(F("saldo_por_pagar") / Value(Decimal("100"))), IntegerField())),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return estado + antiguedad + saldo
+
+
+def _doc_exists(etapa: str, ext: str, compra_q: Q):
+    return Exists(DocumentoCompra.objects.filter(compra_q, etapa=etapa, archivo__iendswith=ext))
+
+
+def readiness_queue_queryset(today: date | None = None):
+    """Compras abiertas del queue con estado, prioridad y banderas de bloqueo calculados en SQL.
+
+    Excluye bases con divisiones (su pipeline vive en las divisiones)."""
+    today = today or timezone.localdate()
+    ultima_validacion = InvoiceValidationResult.objects.filter(compra=OuterRef("pk")).order_by("-created_at", "-id").values("id")[:1]
+    propia = Q(compra=OuterRef("pk"))
+    return (
+        Compra.objects.filter(cancelada=False)
+        .exclude(Exists(Compra.objects.filter(parent_compra=OuterRef("pk"))))
+        .annotate(
+            q_estado=_queue_state(),
+            q_pdf_compra=_doc_exists("compra_original", ".pdf", propia | Q(compra=OuterRef("parent_compra"))),
+            q_xml_factura=_doc_exists("factura", ".xml", propia),
+            q_pdf_factura=_doc_exists("factura", ".pdf", propia),
+            q_validacion_id=Subquery(ultima_validacion),
+        )
+        .annotate(q_prioridad=_priority(today))
+    )
+
+
+def _decode_cursor(raw: str):
+    try:
+        prioridad, fecha, pk = (raw or "").split("_")
+        return int(prioridad), date.fromisoformat(fecha), int(pk)
+    except ValueError:
+        return None
+
+
+def _after(cursor, prioridad: str, pk: str) -> Q:
+    p, f, i = cursor
+    return Q(**{f"{prioridad}__lt": p}) | Q(**{prioridad: p, "fecha_liq__lt": f}) | Q(**{prioridad: p, "fecha_liq": f, f"{pk}__lt": i})
+
+
+def queue_blockers(c: Compra, beneficiary: dict | None = None) -> list[str]:
+    """Bloqueos de una compra anotada por `readiness_queue_queryset` (sin consultas propias)."""
+    W = WorkflowStateChoices
+    b = []
+    if not c.q_pdf_compra:
+        b.append("Falta compra original PDF")
+    if not (c.productor.rfc or "").strip():
+        b.append("Falta RFC productor")
+    if c.workflow_state in {W.WAITING_INVOICE, W.INVOICE_BLOCKED}:
+        if not c.q_xml_factura:
+            b.append("Falta XML factura")
+        if not c.q_pdf_factura:
+            b.append("Falta PDF factura")
+    if c.workflow_state in {W.INVOICE_VALID, W.WAITING_BANK_CONFIRMATION, W.READY_TO_PAY} and not c.bank_account_confirmed:
+        b.append("Falta confirmación bancaria")
+    if c.workflow_state == W.READY_TO_PAY and (beneficiary or {}).get("status") == "red":
+        b.append("Beneficiario no coincide")
+    return b
+
+
+def _with_details(qs) -> list[Compra]:
+    """Filas anotadas con sus bloqueos, motivo de la última validación y paso del flujo, en consultas fijas:
+    filas, pagos (paso del flujo), validaciones y, si hay compras listas para pago, cuentas y excepciones."""
+    rows = list(
+        qs.select_related("productor", "parent_compra").prefetch_related(
+            Prefetch("pagos_registrados", queryset=PagoCompra.objects.only("id", "compra_id"))
+        )
+    )
+    validaciones = InvoiceValidationResult.objects.in_bulk([c.q_validacion_id for c in rows if c.q_validacion_id])
+    latest = {c.id: validaciones.get(c.q_validacion_id) for c in rows}
+    listas = [c for c in rows if c.workflow_state == WorkflowStateChoices.READY_TO_PAY]
+    beneficiarios = bulk_beneficiary_validation(listas, latest) if listas else {}
+    for c in rows:
+        c.q_tiene_divisiones = False
+        c.queue_state = c.q_estado
+        c.priority_score = (Decimal(c.q_prioridad) / 100).quantize(Decimal("0.01"))
+        c.blocked_reason = latest[c.id].blocked_reason if latest[c.id] else ""
+        c.queue_blockers = queue_blockers(c, beneficiarios.get(c.id))
+        c.queue_step = c.flujo_step_default
+    return rows
+
+
+_ENTRY_FIELDS = ["queue_state", "workflow_state", "priority", "fecha_liq", "blockers", "blocked_reason", "flujo_step", "computed_for"]
+
+
+def _entry_for(c: Compra, today: date) -> QueueEntry:
+    return QueueEntry(
+        compra_id=c.id,
+        queue_state=c.q_estado,
+        workflow_state=c.workflow_state,
+        priority=c.q_prioridad,
+        fecha_liq=c.fecha_liq,
+        blockers=c.queue_blockers,
+        blocked_reason=c.blocked_reason,
+        flujo_step=c.queue_step,
+        computed_for=today,
+    )
+
+
+def _compute_entries(ids: list[int], today: date, chunk_size: int = 500):
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i : i + chunk_size]
+        yield chunk, [_entry_for(c, today) for c in _with_details(readiness_queue_queryset(today).filter(pk__in=chunk))]
+
+
+def _upsert(entries: list[QueueEntry]):
+    if entries:
+        QueueEntry.objects.bulk_create(entries, update_conflicts=True, unique_fields=["compra"], update_fields=[*_ENTRY_FIELDS, "updated_at"])
+
+
+def refresh_queue_entries(filtro: Q, today: date | None = None) -> int:
+    """Recalcula la proyección QueueEntry de las compras que cumplen `filtro` (alta, cambio o baja)."""
+    today = today or timezone.localdate()
+    ids = list(Compra.objects.filter(filtro).values_list("pk", flat=True))
+    if not ids:
+        return 0
+    n = 0
+    with transaction.atomic():
+        for chunk, entries in _compute_entries(ids, today):
+            visibles = {e.compra_id for e in entries}
+            QueueEntry.objects.filter(compra_id__in=[pk for pk in chunk if pk not in visibles]).delete()
+            _upsert(entries)
+            n += len(entries)
+        # Altas, bajas y cambios de estado pasan por aquí: el resumen se borra al confirmar.
+        invalidate_queue_summary()
+    return n
+
+
+def stale_queue_entries(today: date | None = None):
+    """Filas calculadas para un día anterior: su prioridad ya no refleja la antigüedad de hoy."""
+    return QueueEntry.objects.filter(computed_for__lt=today or timezone.localdate())
+
+
+def refresh_stale_queue_entries(today: date | None = None) -> int:
+    """Re-envejece la proyección (un punto de prioridad por día); corre diario fuera de las peticiones."""
+    today = today or timezone.localdate()
+    return refresh_queue_entries(Q(queue_entry__computed_for__lt=today), today)
+
+
+@dataclass
+class QueueRebuildResult:
+    revisadas: int = 0
+    faltantes: int = 0
+    sobrantes: int = 0
+    distintas: int = 0
+    diferencias: list[dict] = field(default_factory=list)
+
+
+def rebuild_queue_entries(*, dry_run: bool = False, today: date | None = None) -> QueueRebuildResult:
+    """Recalcula toda la proyección desde cero y la compara con lo guardado (con `dry_run` sólo reporta)."""
+    today = today or timezone.localdate()
+    result = QueueRebuildResult()
+    ids = list(readiness_queue_queryset(today).order_by("pk").values_list("pk", flat=True))
+    guardadas_ids = set(QueueEntry.objects.values_list("compra_id", flat=True))
+    sobrantes = guardadas_ids - set(ids)
+    result.sobrantes = len(sobrantes)
+    result.diferencias += [{"compra_id": pk, "sobrante": True} for pk in sorted(sobrantes)]
+    with transaction.atomic():
+        for chunk, entries in _compute_entries(ids, today):
+            guardadas = QueueEntry.objects.in_bulk(chunk)
+            for e in entries:
+                result.revisadas += 1
+                old = guardadas.get(e.compra_id)
+                if old is None:
+                    result.faltantes += 1
+                    result.diferencias.append({"compra_id": e.compra_id, "faltante": True})
+                    continue
+                campos = {f: (getattr(old, f), getattr(e, f)) for f in _ENTRY_FIELDS if f != "computed_for" and getattr(old, f) != getattr(e, f)}
+                if campos:
+                    result.distintas += 1
+                    result.diferencias.append({"compra_id": e.compra_id, **campos})
+            if not dry_run:
+                _upsert(entries)
+        if not dry_run and sobrantes:
+            QueueEntry.objects.filter(compra_id__in=sobrantes).delete()
+        if not dry_run:
+            QueueProjectionState.objects.update_or_create(pk=1, defaults={"construida_at": timezone.now()})
+    return result
+
+
+def queue_projection_built() -> bool:
+    # Los hooks escriben filas desde el despliegue; sólo una reconstrucción completa deja la marca.
+    return QueueProjectionState.objects.exists()
+
+
+def _projection_counts() -> dict:
+    return QueueEntry.objects.aggregate(**{s: Count("pk", filter=Q(queue_state=s)) for s in QUEUE_STATES})
+
+
+@dataclass
+class QueuePage:
+    items: list[Compra] = field(default_factory=list)
+    counts: dict = field(default_factory=dict)
+    next_cursor: str = ""
+
+
+def _live_page(state: str, cursor, page_size: int, today: date) -> QueuePage:
+    # Proyección aún no construida (ver `reconstruir_queue_preparacion`): mismo resultado calculado al vuelo.
+    qs = readiness_queue_queryset(today)
+    page = QueuePage(counts=qs.aggregate(**{s: Count("id", filter=Q(q_estado=s)) for s in QUEUE_STATES}))
+    rows = qs.filter(q_estado=state) if state else qs.filter(q_estado__in=QUEUE_STATES)
+    if cursor:
+        rows = rows.filter(_after(cursor, "q_prioridad", "id"))
+    page.items = _with_details(rows.order_by("-q_prioridad", "-fecha_liq", "-id")[: page_size + 1])
+    if len(page.items) > page_size:
+        page.items = page.items[:page_size]
+        c = page.items[-1]
+        page.next_cursor = f"{c.q_prioridad}_{c.fecha_liq.isoformat()}_{c.id}"
+    return page
+
+
+def readiness_queue_page(state: str = "", after: str = "", page_size: int | None = None, today: date | None = None) -> QueuePage:
+    """Una página del queue ordenada por prioridad, paginada por llave (prioridad, fecha_liq, id).
+
+    Lee la proyección QueueEntry (conteos y filas son dos lecturas indexadas) una vez construida con
+    `reconstruir_queue_preparacion --apply`; antes calcula la página al vuelo. La antigüedad de las
+    filas se actualiza una vez al día con `reconstruir_queue_preparacion --reenvejecer --apply`."""
+    page_size = page_size or getattr(settings, "READINESS_QUEUE_PAGE_SIZE", 100)
+    today = today or timezone.localdate()
+    cursor = _decode_cursor(after)
+    if not queue_projection_built():
+        return _live_page(state, cursor, page_size, today)
+    page = QueuePage(counts=_projection_counts())
+
+    rows = QueueEntry.objects.filter(queue_state=state) if state else QueueEntry.objects.filter(queue_state__in=QUEUE_STATES)
+    if cursor:
+        rows = rows.filter(_after(cursor, "priority", "compra_id"))
+    entries = list(rows.select_related("compra__productor", "compra__parent_compra").order_by("-priority", "-fecha_liq", "-compra_id")[: page_size + 1])
+    if len(entries) > page_size:
+        entries = entries[:page_size]
+        e = entries[-1]
+        page.next_cursor = f"{e.priority}_{e.fecha_liq.isoformat()}_{e.compra_id}"
+    for e in entries:
+        c = e.compra
+        c.queue_state = e.queue_state
+        c.priority_score = (Decimal(e.priority) / 100).quantize(Decimal("0.01"))
+        c.blocked_reason = e.blocked_reason
+        c.queue_blockers = e.blockers
+        c.queue_step = e.flujo_step
+        page.items.append(c)
+    return page
+
+
+_SUMMARY_KEY = "pagos:queue_summary"
+
+
+def _summary_cache():
+    return caches[getattr(settings, "QUEUE_SUMMARY_CACHE_ALIAS", "default")]
+
+
+def cached_queue_summary() -> tuple[dict, str]:
+    """(`queue_summary()`, ETag) desde un cache corto; la ETag es el hash del resumen serializado."""
+    hit = _summary_cache().get(_SUMMARY_KEY)
+    if hit is not None:
+        return hit
+    summary = queue_summary()
+    etag = '"%s"' % hashlib.sha1(json.dumps(summary, sort_keys=True).encode()).hexdigest()
+    _summary_cache().set(_SUMMARY_KEY, (summary, etag), getattr(settings, "QUEUE_SUMMARY_CACHE_TTL", 15))
+    return summary, etag
+
+
+def invalidate_queue_summary():
+    _summary_cache().delete(_SUMMARY_KEY)
+    # Otra petición pudo recalcular con datos previos al commit: se borra de nuevo al confirmar.
+    transaction.on_commit(lambda: _summary_cache().delete(_SUMMARY_KEY))
+
+
+def queue_summary() -> dict:
+    """Compras no canceladas por workflow_state (incluye bases con divisiones), en un solo aggregate."""
+    estados = [
+        WorkflowStateChoices.WAITING_INVOICE,
+        WorkflowStateChoices.INVOICE_BLOCKED,
+        WorkflowStateChoices.WAITING_BANK_CONFIRMATION,
+        WorkflowStateChoices.READY_TO_PAY,
+        WorkflowStateChoices.PAID,
+    ]
+    return Compra.objects.filter(cancelada=False).aggregate(
+        **{str(s): Count("pk", filter=Q(workflow_state=s)) for s in estados}
+    )
@@ -1,11 +1,19 @@
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.core.files.base import ContentFile
 from unittest.mock import patch
-from datetime import timedelta
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+import tempfile
+
+from openpyxl import Workbook
 
 from .models import (
     Anticipo,
@@ -14,6 +22,11 @@ from .models import (
     Contador,
     DocumentoCompra,
     EmailTemplate,
+    ImportJob,
+    ImportJobStatusChoices,
+    ImportJobTipoChoices,
+    ImportRowLog,
+    ImportRun,
     InvoiceValidationResult,
     PersonaFactura,
     MonedaChoices,
@@ -23,7 +36,17 @@ from .models import (
     WorkflowStateChoices,
 )
 from .forms import ContadorForm, EmailTemplateForm
-from .services import build_invoice_request_email, parse_and_validate_cfdi_xml
+from .services import (
+    build_invoice_request_email,
+    detect_compras_conflicts,
+    enqueue_import_job,
+    import_anticipos_excel,
+    import_compras_excel,
+    import_compras_files,
+    parse_and_validate_cfdi_xml,
+    preview_compras_excel,
+    run_import_job,
+)
 
 
 class PagosFlowTests(TestCase):
@@ -215,6 +238,45 @@ class PagosFlowTests(TestCase):
         self.assertEqual(self.compra.saldo_por_pagar, 1000)
         self.assertEqual(self.compra.estatus_de_pago, "PENDIENTE")
 
+    def test_totales_materializados_se_mantienen_y_verifican(self):
+        from django.core.management import call_command
+        from pagos.models import Deduccion
+
+        self.compra.compra_en_libras = 1000
+        self.compra.retencion_resico = 10
+        self.compra.save()
+        division = Compra.objects.create(
+            numero_compra=1,
+            productor=self.productor,
+            parent_compra=self.compra,
+            porcentaje_division=20,
+            compra_en_libras=200,
+            tipo_cambio=self.tc,
+        )
+        PagoCompra.objects.create(compra=self.compra, monto=100, moneda=MonedaChoices.DOLARES)
+        AplicacionAnticipo.objects.create(anticipo=self.anticipo, compra=self.compra, fecha=timezone.now().date(), monto_aplicado=50)
+        Deduccion.objects.create(compra=self.compra, concepto="Flete", monto=25, moneda=MonedaChoices.DOLARES)
+
+        self.compra.refresh_from_db()
+        self.assertEqual(
+            [self.compra.total_monto_dividido, self.compra.total_pagado_vigente, self.compra.total_aplicado_anticipos,
+             self.compra.total_deducciones_usd, self.compra.saldo_por_pagar],
+            [200, 100, 50, 25, 800 - 100 - 50 - 10],
+        )
+        self.assertEqual(Compra.objects.filter(saldo_por_pagar__gt=0).order_by("-saldo_por_pagar").first(), self.compra)
+        division.delete()
+        self.compra.refresh_from_db()
+        self.assertEqual((self.compra.total_monto_dividido, self.compra.saldo_por_pagar), (0, 1000 - 100 - 50 - 10))
+
+        # El comando detecta y corrige un valor desalineado.
+        Compra.objects.filter(pk=self.compra.pk).update(saldo_por_pagar=0)
+        out = StringIO()
+        call_command("recalcular_totales_compras", stdout=out)
+        self.assertIn("con_diferencia=1", out.getvalue())
+        call_command("recalcular_totales_compras", "--apply", stdout=StringIO())
+        self.compra.refresh_from_db()
+        self.assertEqual(self.compra.saldo_por_pagar, 840)
+
     def test_parse_cfdi_xml_basico(self):
         xml = b'''<?xml version="1.0" encoding="UTF-8"?>
 <cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" xmlns:tfd="http://www.sat.gob.mx/TimbreFiscalDigital" Moneda="USD" MetodoPago="PUE">
@@ -248,6 +310,13 @@ class ContadorEmailsTests(TestCase):
         self.assertEqual(obj.emails_adicionales, "a@example.com, b@example.com")
 
 
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "microsip": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "microsip-tests"},
+        "queue": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "queue-tests"},
+    }
+)
 class QueueAndInboxGuardsTests(TestCase):
     def setUp(self):
         self.user = get_user_model().objects.create_superuser(username="operador", email="op@example.com", password="secret123")
@@ -277,6 +346,205 @@ class QueueAndInboxGuardsTests(TestCase):
         compra.refresh_from_db()
         self.assertEqual(compra.workflow_state, WorkflowStateChoices.WAITING_BANK_CONFIRMATION)
 
+    def test_home_consultas_constantes_y_antiguedad_en_sql(self):
+        hoy = timezone.localdate()
+        self._make_compra(numero_compra=201, fecha_liq=hoy - timedelta(days=20), pago=500)
+
+        def consultas_home():
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.get(reverse("home"), {"aging": "all"})
+            return len(ctx.captured_queries), resp
+
+        n_pocas, _ = consultas_home()
+        for i, dias in enumerate([3, 10, 20, 45, 90]):
+            self._make_compra(numero_compra=210 + i, fecha_liq=hoy - timedelta(days=dias), pago=100)
+        base = self._make_compra(numero_compra=230, fecha_liq=hoy - timedelta(days=40), pago=1000)
+        self._make_compra(numero_compra=230, parent_compra=base, porcentaje_division=100, fecha_liq=hoy - timedelta(days=40))
+        n_muchas, resp = consultas_home()
+
+        self.assertEqual(n_pocas, n_muchas)
+        # La base dividida no cuenta; su división sí.
+        self.assertEqual(resp.context["aging"], {"0_7": 1, "8_15": 1, "16_30": 2, "31_plus": 3})
+        self.assertEqual(resp.context["sla_over_15"], 5)
+        self.assertNotIn(base.id, [c.id for c in resp.context["object_list"]])
+        esperado = sum(c.saldo_por_pagar for c in Compra.objects.exclude(pk=base.pk) if c.saldo_por_pagar > 0)
+        self.assertEqual(resp.context["pending_total_usd"], esperado)
+
+        resp = self.client.get(reverse("home"), {"aging": "16_30"})
+        self.assertEqual(sorted(c.numero_compra for c in resp.context["object_list"]), [201, 212])
+        self.assertEqual(resp.context["object_list"][0].aging_days, 20)
+
+    @override_settings(READINESS_QUEUE_PAGE_SIZE=3)
+    def test_queue_en_sql_pagina_por_llave_con_consultas_fijas(self):
+        from .models import ProductorCuentaBancaria
+
+        hoy = timezone.localdate()
+        W = WorkflowStateChoices
+        ProductorCuentaBancaria.objects.create(productor=self.productor, titular="Otra Persona Distinta", cuenta="123")
+        lista = self._make_compra(numero_compra=300, workflow_state=W.READY_TO_PAY, fecha_liq=hoy - timedelta(days=5),
+                                  compra_en_libras=50000, cuenta_productor="123", bank_account_confirmed=True)
+        InvoiceValidationResult.objects.create(compra=lista, valid=True, raw_result={"nombre_emisor": "Proveedor Uno"})
+        banco = self._make_compra(numero_compra=301, workflow_state=W.WAITING_BANK_CONFIRMATION, fecha_liq=hoy - timedelta(days=40))
+        for i, dias in enumerate([1, 12, 12, 20]):
+            self._make_compra(numero_compra=310 + i, workflow_state=W.WAITING_INVOICE, fecha_liq=hoy - timedelta(days=dias),
+                              solicitud_factura_enviada=bool(i % 2))
+        base = self._make_compra(numero_compra=320, workflow_state=W.WAITING_INVOICE)
+        self._make_compra(numero_compra=320, parent_compra=base, porcentaje_division=50, workflow_state=W.WAITING_INVOICE)
+        doc = DocumentoCompra(compra=base, etapa="compra_original", tipo_documento="COMPRA_ORIGINAL")
+        doc.archivo.save("compra.pdf", ContentFile(b"%PDF-1.4 base"), save=True)
+
+        def pagina(after=""):
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.get(reverse("readiness_queue"), {"after": after} if after else {})
+            return resp, len(ctx.captured_queries)
+
+        vistas, consultas, after = [], [], ""
+        while True:
+            resp, n = pagina(after)
+            vistas += resp.context["compras"]
+            consultas.append(n)
+            after = resp.context["next_cursor"]
+            if not after:
+                break
+
+        self.assertEqual(resp.context["counts"], {"SOLICITUD_PENDIENTE": 3, "SOLICITUD_ENVIADA": 2, "WAITING_BANK_CONFIRMATION": 1, "READY_TO_PAY": 1, "PAID": 0})
+        self.assertEqual(len(vistas), 7)
+        self.assertNotIn(base.id, [c.id for c in vistas])
+        self.assertEqual([c.id for c in vistas[:2]], [lista.id, banco.id])
+        scores = [c.priority_score for c in vistas]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        # Misma fórmula que antes: estado + días (tope 30) + saldo/10,000 (tope 20).
+        lista.refresh_from_db()
+        esperado = Decimal("105") + min(lista.saldo_por_pagar / Decimal("10000"), Decimal("20"))
+        self.assertEqual(vistas[0].priority_score, esperado.quantize(Decimal("0.01")))
+        self.assertIn("Beneficiario no coincide", vistas[0].queue_blockers)
+        division = next(c for c in vistas if c.parent_compra_id == base.id)
+        self.assertNotIn("Falta compra original PDF", division.queue_blockers)
+        self.assertIn("Falta XML factura", division.queue_blockers)
+        # Páginas con y sin compras listas para pago: sólo cambian las consultas de beneficiario.
+        self.assertLessEqual(max(consultas) - min(consultas), 3)
+
+    def test_proyeccion_queue_sigue_eventos_y_se_reconstruye(self):
+        from django.core.cache import caches
+        from django.core.management import call_command
+
+        from .models import QueueEntry
+        from .services import rebuild_queue_entries, transition_compra
+
+        W = WorkflowStateChoices
+        compra = self._make_compra(numero_compra=400, workflow_state=W.INVOICE_VALID)
+        entry = QueueEntry.objects.get(compra=compra)
+        self.assertEqual(entry.queue_state, "SOLICITUD_ENVIADA")
+        self.assertIn("Falta compra original PDF", entry.blockers)
+        self.assertIn("Falta confirmación bancaria", entry.blockers)
+
+        doc = DocumentoCompra(compra=compra, etapa="compra_original", tipo_documento="COMPRA_ORIGINAL")
+        doc.archivo.save("compra.pdf", ContentFile(b"%PDF-1.4"), save=True)
+        compra.bank_account_confirmed = True
+        compra.save(update_fields=["bank_account_confirmed", "updated_at"])
+        InvoiceValidationResult.objects.create(compra=compra, valid=True, blocked_reason="")
+        transition_compra(compra, W.WAITING_BANK_CONFIRMATION)
+        entry.refresh_from_db()
+        self.assertEqual((entry.queue_state, entry.workflow_state), ("WAITING_BANK_CONFIRMATION", W.WAITING_BANK_CONFIRMATION))
+        self.assertNotIn("Falta compra original PDF", entry.blockers)
+        self.assertNotIn("Falta confirmación bancaria", entry.blockers)
+
+        prioridad = entry.priority
+        PagoCompra.objects.create(compra=compra, monto=600)
+        entry.refresh_from_db()
+        self.assertLess(entry.priority, prioridad)
+
+        # Una división saca a su base del queue; la división entra.
+        division = self._make_compra(numero_compra=400, parent_compra=compra, porcentaje_division=50, workflow_state=W.WAITING_INVOICE)
+        self.assertFalse(QueueEntry.objects.filter(compra=compra).exists())
+        self.assertTrue(QueueEntry.objects.filter(compra=division).exists())
+
+        self.assertEqual(rebuild_queue_entries(dry_run=True).diferencias, [])
+        # Desfase a propósito: la verificación lo detecta y --apply lo corrige.
+        QueueEntry.objects.filter(compra=division).delete()
+        # Sin reconstrucción completa la página se calcula al vuelo, aunque los hooks ya escribieron filas.
+        resp = self.client.get(reverse("readiness_queue"))
+        self.assertEqual([c.id for c in resp.context["compras"]], [division.id])
+        out = StringIO()
+        call_command("reconstruir_queue_preparacion", stdout=out)
+        self.assertIn("faltantes=1", out.getvalue())
+        call_command("reconstruir_queue_preparacion", "--apply", stdout=StringIO())
+        self.assertEqual(rebuild_queue_entries(dry_run=True).diferencias, [])
+
+        # Lecturas: sesión + usuario + marca de proyección + conteos + filas, sin importar cuántas compras haya.
+        with self.assertNumQueries(5):
+            resp = self.client.get(reverse("readiness_queue"))
+        self.assertEqual([c.id for c in resp.context["compras"]], [division.id])
+        caches["queue"].clear()
+        # El resumen cuenta toda compra no cancelada, también la base con divisiones que no está en el queue.
+        resp = self.client.get(reverse("api_queue_summary"))
+        self.assertEqual(resp.json()["summary"][W.WAITING_INVOICE], 1)
+        self.assertEqual(resp.json()["summary"][W.WAITING_BANK_CONFIRMATION], 1)
+
+        # Al cambiar de día la lectura no recalcula; el re-envejecimiento diario es del comando.
+        QueueEntry.objects.update(computed_for=timezone.localdate() - timedelta(days=1), priority=0)
+        with self.assertNumQueries(5):
+            resp = self.client.get(reverse("readiness_queue"))
+        out = StringIO()
+        call_command("reconstruir_queue_preparacion", "--reenvejecer", stdout=out)
+        self.assertIn("filas de días anteriores=1", out.getvalue())
+        call_command("reconstruir_queue_preparacion", "--reenvejecer", "--apply", stdout=StringIO())
+        resp = self.client.get(reverse("readiness_queue"))
+        self.assertGreater(resp.context["compras"][0].priority_score, 0)
+        self.assertEqual(QueueEntry.objects.filter(computed_for__lt=timezone.localdate()).count(), 0)
+
+    def test_proyeccion_queue_solo_se_refresca_con_campos_del_queue(self):
+        from .models import QueueEntry
+
+        compra = self._make_compra(numero_compra=450, workflow_state=WorkflowStateChoices.WAITING_INVOICE)
+        QueueEntry.objects.filter(compra=compra).update(priority=0)
+
+        # Campos ajenos al queue (update_fields o productor sin cambio de RFC): no se recalcula.
+        compra.correo = "otro@example.com"
+        compra.save(update_fields=["correo", "updated_at"])
+        compra.productor.notas = "sin efecto en el queue"
+        compra.productor.save()
+        self.assertEqual(QueueEntry.objects.get(compra=compra).priority, 0)
+
+        compra.productor.rfc = "PEJX800101AB1"
+        compra.productor.save()
+        self.assertGreater(QueueEntry.objects.get(compra=compra).priority, 0)
+
+    def test_resumen_queue_en_cache_con_etag(self):
+        from django.core.cache import caches
+
+        from django.db.models import Q
+
+        from .services import refresh_queue_entries, transition_compra
+
+        caches["queue"].clear()
+        W = WorkflowStateChoices
+        compra = self._make_compra(numero_compra=500, workflow_state=W.INVOICE_VALID, bank_account_confirmed=True)
+        self._make_compra(numero_compra=501, workflow_state=W.WAITING_BANK_CONFIRMATION)
+        url = reverse("api_queue_summary")
+
+        # sesión + usuario + un solo aggregate; después, sólo sesión + usuario.
+        with self.assertNumQueries(3):
+            resp = self.client.get(url)
+        etag = resp["ETag"]
+        self.assertEqual(resp.json()["summary"][W.WAITING_BANK_CONFIRMATION], 1)
+        with self.assertNumQueries(2):
+            resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, b"")
+
+        InvoiceValidationResult.objects.create(compra=compra, valid=True)
+        transition_compra(compra, W.WAITING_BANK_CONFIRMATION)
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["ETag"], etag)
+        self.assertEqual(resp.json()["summary"][W.WAITING_BANK_CONFIRMATION], 2)
+
+        # Cambios en lote (sin Compra.save) también invalidan al refrescar la proyección.
+        Compra.objects.filter(pk=compra.pk).update(cancelada=True)
+        refresh_queue_entries(Q(pk=compra.pk))
+        self.assertEqual(self.client.get(url).json()["summary"][W.WAITING_BANK_CONFIRMATION], 1)
+
     @patch("pagos.views.mark_gmail_message_processed")
     @patch("pagos.views.create_invoice_validation_for_compra")
     @patch("pagos.views.fetch_gmail_attachments_for_compra")
@@ -505,3 +773,790 @@ class ResicoPolicyValidationTests(TestCase):
 </cfdi:Comprobante>'''
         result = parse_and_validate_cfdi_xml(xml, requires_resico_retention=True, resico_policy="AUTO")
         self.assertTrue(result["valid"])
+
+
+class ComprasImportTests(TestCase):
+    HEADERS = ["COMPRA", "PRODUCTOR", "FECHA LIQ", "PACAS", "TOTAL DLS"]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache_dir = Path(self.tmpdir.name) / "cache"
+        cache_settings = override_settings(IMPORT_CACHE_DIR=self.cache_dir)
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+
+    def _write_xlsx(self, rows, name="compras.xlsx"):
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "COMPRAS"
+        ws.append(["REPORTE DE COMPRAS"])
+        ws.append(self.HEADERS)
+        for r in rows:
+            ws.append(r)
+        path = Path(self.tmpdir.name) / name
+        wb.save(path)
+        return path
+
+    def test_preview_detecta_divisiones_en_todo_el_archivo(self):
+        path = self._write_xlsx([
+            [10, "Juan Perez", date(2026, 3, 1), 10, 1000],
+            [11, "Maria Lopez", date(2026, 3, 2), 5, 500],
+            [10, "PEREZ JUAN", date(2026, 3, 1), 4, 400],
+        ])
+        rows = preview_compras_excel(path, limit=1)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["row_number"], 3)
+        self.assertTrue(rows[0]["es_division_detectada"])
+
+    def test_import_crea_base_y_division(self):
+        path = self._write_xlsx([
+            [10, "Juan Perez", date(2026, 3, 1), 10, 1000],
+            [10, "Juan Perez", date(2026, 3, 1), 4, 400],
+        ])
+        stats = import_compras_excel(path)
+        self.assertEqual(stats.created, 2)
+        self.assertEqual(stats.divisions_created, 1)
+        base = Compra.objects.get(numero_compra=10, parent_compra__isnull=True)
+        self.assertEqual(base.divisiones.count(), 1)
+        self.assertEqual(base.divisiones.first().porcentaje_division, 40)
+        self.assertEqual(ImportRowLog.objects.filter(status="division").count(), 1)
+
+    def test_reimport_reporta_duplicado_y_conflicto(self):
+        import_compras_excel(self._write_xlsx([[20, "Juan Perez", date(2026, 3, 1), 10, 1000]]))
+        same = self._write_xlsx([[20, "Juan Perez", date(2026, 3, 1), 10, 1000]], name="same.xlsx")
+        self.assertEqual(detect_compras_conflicts(same), [])
+        changed = self._write_xlsx([[20, "Juan Perez", date(2026, 3, 1), 12, 1200]], name="changed.xlsx")
+        conflicts = detect_compras_conflicts(changed)
+        self.assertEqual(len(conflicts), 1)
+        self.assertEqual(conflicts[0]["incoming_pacas"], 12)
+
+        stats = import_compras_excel(changed, conflict_policy="overwrite")
+        self.assertEqual(stats.updated, 1)
+        self.assertEqual(Compra.objects.get(numero_compra=20).pacas, 12)
+
+    def test_import_aplica_tc_por_fecha_y_revierte_bloque_fallido(self):
+        TipoCambio.objects.create(fecha=date(2026, 3, 1), tc=18)
+        path = self._write_xlsx([
+            [30, "Juan Perez", date(2026, 3, 1), 10, 1000],
+            [30, "Juan Perez", date(2026, 3, 1), 4, 400],
+        ])
+        with patch("pagos.services.imports.Compra.objects.bulk_create", side_effect=RuntimeError("db caida")):
+            stats = import_compras_excel(path)
+        self.assertEqual(stats.created, 0)
+        self.assertEqual(stats.error_count, 2)
+        self.assertFalse(Compra.objects.filter(numero_compra=30).exists())
+        self.assertEqual(ImportRowLog.objects.filter(status="error").count(), 2)
+
+        stats = import_compras_excel(path)
+        self.assertEqual(stats.created, 2)
+        base = Compra.objects.get(numero_compra=30, parent_compra__isnull=True)
+        self.assertEqual(base.tipo_cambio_valor, 18)
+        self.assertEqual(base.divisiones.get().tipo_cambio.fecha, date(2026, 3, 1))
+
+    def test_artefacto_parseado_se_reutiliza_por_hash(self):
+        path = self._write_xlsx([[30, "Juan Perez", date(2026, 3, 1), 10, 1000]])
+        first = preview_compras_excel(path)
+        self.assertEqual(len(list(self.cache_dir.glob("compras-*.pkl"))), 1)
+
+        copy = Path(self.tmpdir.name) / "reupload.xlsx"
+        copy.write_bytes(path.read_bytes())
+        with patch("pagos.services.imports._iter_rows", side_effect=AssertionError("no debe re-parsear")):
+            self.assertEqual(preview_compras_excel(copy), first)
+            self.assertEqual(detect_compras_conflicts(copy), [])
+            stats = import_compras_excel(copy)
+        self.assertEqual(stats.created, 1)
+
+    def test_cache_de_importacion_se_desaloja_por_antiguedad(self):
+        import os
+        import time
+
+        from django.core.management import call_command
+        from pagos.services.imports import _parsed_cache_path
+
+        viejo = self._write_xlsx([[31, "Juan Perez", date(2026, 3, 1), 10, 1000]], name="viejo.xlsx")
+        nuevo = self._write_xlsx([[32, "Juan Perez", date(2026, 3, 1), 10, 1000]], name="nuevo.xlsx")
+        preview_compras_excel(viejo)
+        preview_compras_excel(nuevo)
+        self.assertEqual(list(self.cache_dir.glob("*.tmp")), [])
+        huerfano = self.cache_dir / "compras-x.tmp"
+        huerfano.write_bytes(b"")
+        hace_10_dias = time.time() - 10 * 86400
+        for p in self.cache_dir.glob("*"):
+            os.utime(p, (hace_10_dias, hace_10_dias))
+        # Leer un artefacto lo marca como usado.
+        preview_compras_excel(nuevo)
+
+        out = StringIO()
+        call_command("limpiar_cache_importaciones", stdout=out)
+        self.assertIn("días=2", out.getvalue())
+        self.assertEqual(len(list(self.cache_dir.glob("*"))), 3)
+        call_command("limpiar_cache_importaciones", "--apply", stdout=StringIO())
+        self.assertEqual(list(self.cache_dir.glob("*")), [_parsed_cache_path(nuevo)])
+
+    def test_resolucion_productores_usa_indice_y_alta_en_lote(self):
+        Productor.objects.create(codigo="PRD-00001", nombre="Juan Perez")
+        path = self._write_xlsx([
+            [40, "PEREZ JUAN", date(2026, 3, 1), 10, 1000],
+            [41, "Ana Gomez", date(2026, 3, 1), 5, 500],
+            [42, "gomez ana", date(2026, 3, 2), 5, 500],
+            [43, "Luis Diaz", date(2026, 3, 2), 5, 500],
+        ])
+        stats = import_compras_excel(path)
+        self.assertEqual(stats.created, 4)
+        self.assertEqual(Productor.objects.count(), 3)
+        self.assertEqual(Compra.objects.filter(productor__nombre="Juan Perez").count(), 1)
+        self.assertEqual(Compra.objects.filter(productor__nombre="Ana Gomez").count(), 2)
+        codigos = set(Productor.objects.values_list("codigo", flat=True))
+        self.assertEqual(len(codigos), 3)
+        self.assertTrue(all(c.startswith("PRD-") for c in codigos))
+
+    def test_import_anticipos_resuelve_productor_y_persona(self):
+        Productor.objects.create(codigo="PRD-00001", nombre="Juan Perez")
+        wb = Workbook()
+        ws = wb.active
+        ws.append(["NO ANTICIPO", "FECHA", "PRODUCTOR", "PERSONA QUE FACTURA", "ANTICIPO", "MONEDA"])
+        ws.append([501, date(2026, 3, 1), "perez juan", "Eva Reimer", 1000, "DOLARES"])
+        ws.append([502, date(2026, 3, 2), "Nuevo Productor", "REIMER EVA", 500, "PESOS"])
+        ws.append([None, None, "TOTAL", None, 0, None])
+        path = Path(self.tmpdir.name) / "anticipos.xlsx"
+        wb.save(path)
+
+        stats = import_anticipos_excel(path)
+        self.assertEqual(stats.created, 2)
+        self.assertEqual(Productor.objects.count(), 2)
+        self.assertFalse(Productor.objects.filter(nombre="TOTAL").exists())
+        self.assertEqual(PersonaFactura.objects.count(), 1)
+        self.assertEqual(Anticipo.objects.get(numero_anticipo=501).productor.nombre, "Juan Perez")
+
+    def test_dry_run_no_escribe_y_reporta_por_fila(self):
+        path = self._write_xlsx([
+            [40, "Productor Nuevo", date(2026, 3, 1), 10, 1000],
+            [40, "Productor Nuevo", date(2026, 3, 1), 4, 400],
+        ])
+        dry = import_compras_excel(path, dry_run=True)
+        self.assertEqual(ImportRun.objects.count(), 0)
+        self.assertEqual(ImportRowLog.objects.count(), 0)
+        self.assertEqual(Productor.objects.count(), 0)
+        self.assertEqual(Compra.objects.count(), 0)
+        self.assertEqual([r["status"] for r in dry.rows], ["created", "division"])
+
+        real = import_compras_excel(path)
+        self.assertEqual((dry.created, dry.divisions_created), (real.created, real.divisions_created))
+        self.assertEqual(real.rows, [])
+
+    def test_trabajo_en_segundo_plano_reporta_avance(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.core.management import call_command
+
+        path = self._write_xlsx([
+            [60, "Juan Perez", date(2026, 3, 1), 10, 1000],
+            [60, "Juan Perez", date(2026, 3, 1), 4, 400],
+        ])
+        user = get_user_model().objects.create_user(username="importador", password="x")
+        with override_settings(MEDIA_ROOT=Path(self.tmpdir.name) / "media"):
+            upload = SimpleUploadedFile("compras.xlsx", path.read_bytes())
+            job = enqueue_import_job(ImportJobTipoChoices.COMPRAS, upload, user=user)
+            other = enqueue_import_job(ImportJobTipoChoices.COMPRAS, SimpleUploadedFile("compras.xlsx", b"x"), user=user)
+            self.assertNotEqual(Path(job.archivo.name).parent, Path(other.archivo.name).parent)
+            call_command("procesar_importaciones", "--once", stdout=StringIO())
+
+        job.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(job.status, ImportJobStatusChoices.DONE)
+        self.assertEqual(other.status, ImportJobStatusChoices.FAILED)
+        # Terminado (bien o mal), el archivo cargado y su carpeta se borran.
+        media = Path(self.tmpdir.name) / "media"
+        for j in (job, other):
+            self.assertFalse((media / j.archivo.name).parent.exists())
+        self.client.force_login(user)
+        data = self.client.get(reverse("api_import_job_status", args=[job.id])).json()["job"]
+        self.assertEqual((data["rows_parsed"], data["created"], data["errors"]), (2, 2, 0))
+        self.assertTrue(data["done"])
+        self.assertEqual(job.run.rows.count(), 2)
+
+    def test_plan_de_columnas_fallback_crystal_y_formato_de_fecha(self):
+        from pagos.services.imports import _norm_col, _parse_compras_rows, _to_date
+
+        headers = [_norm_col(h) for h in ["COMPRA", "PRODUCTOR", "FECHA LIQ", "", "TOTAL DLLS LIBRAS"]]
+        rows = [
+            (70, "Juan Perez", "12/31/2026", "1,500.50", None),
+            (71, "Juan Perez", "03/04/2026", None, 800),
+            (72, "Ana Gomez"),
+            (None, "TOTAL", None, None, 2300),
+        ]
+        recs = list(_parse_compras_rows(headers, iter(rows), 3))
+        self.assertEqual([rn for rn, _k, _r in recs], [3, 4, 5])
+        self.assertEqual(recs[0][2]["compra_en_libras"], Decimal("1500.50"))
+        self.assertEqual(recs[1][2]["compra_en_libras"], 800)
+        # Una fecha ambigua no depende de filas anteriores (12/31 es mm/dd): se lee dd/mm, igual que en ANTICIPOS.
+        self.assertEqual(recs[0][2]["fecha_liq"], date(2026, 12, 31))
+        self.assertEqual(recs[1][2]["fecha_liq"], date(2026, 4, 3))
+        self.assertEqual(recs[1][2]["fecha_liq"], _to_date("03/04/2026"))
+        self.assertEqual(recs[2][2]["compra_en_libras"], 0)
+
+    def test_cache_guarda_fecha_liq_vacia_sin_fecha_del_dia(self):
+        from pagos.services.imports import _iter_cached_parsed_records, _parsed_cache_path, _read_parsed_cache
+
+        path = self._write_xlsx([[73, "Juan Perez", None, 10, 1000]])
+        list(_iter_cached_parsed_records(path))
+        # El artefacto no fija la fecha en que se parseó; se completa al leerlo.
+        [(_rn, key, rec)] = list(_read_parsed_cache(_parsed_cache_path(path)))
+        self.assertIsNone(rec["fecha_liq"])
+        self.assertIsNone(key[2])
+        manana = date.today() + timedelta(days=1)
+        with patch("pagos.services.imports.date") as fake_date:
+            fake_date.today.return_value = manana
+            [(_rn, key, rec)] = list(_iter_cached_parsed_records(path))
+        self.assertEqual((rec["fecha_liq"], rec["fecha_de_pago"], key[2]), (manana, manana, manana))
+
+    def test_reimport_omite_filas_sin_cambios(self):
+        rows = [
+            [80, "Juan Perez", date(2026, 3, 1), 10, 1000],
+            [81, "Ana Gomez", date(2026, 3, 2), 5, 500],
+        ]
+        import_compras_excel(self._write_xlsx(rows))
+        stats = import_compras_excel(self._write_xlsx(rows + [[80, "Juan Perez", date(2026, 3, 1), 4, 400]], name="semana2.xlsx"))
+        self.assertEqual((stats.unchanged, stats.created, stats.divisions_created), (2, 1, 1))
+        run = ImportRun.objects.get(pk=stats.run_id)
+        self.assertEqual(run.unchanged_count, 2)
+        self.assertEqual(list(run.rows.values_list("status", flat=True)), ["division"])
+        base = Compra.objects.get(numero_compra=80, parent_compra__isnull=True)
+        self.assertEqual(base.divisiones.get().porcentaje_division, 40)
+        self.assertEqual(detect_compras_conflicts(self._write_xlsx(rows, name="semana3.xlsx")), [])
+
+    def test_reimport_detecta_compra_editada_despues_de_importar(self):
+        path = self._write_xlsx([[82, "Juan Perez", date(2026, 3, 1), 10, 1000]])
+        import_compras_excel(path)
+        compra = Compra.objects.get(numero_compra=82)
+        compra.pacas = 9
+        compra.save()
+
+        # La fila del Excel no cambió, pero la compra sí: ya no se omite por huella.
+        conflicts = detect_compras_conflicts(path)
+        self.assertEqual([(c["row_number"], c["existing_pacas"], c["incoming_pacas"]) for c in conflicts], [(3, 9, 10)])
+        stats = import_compras_excel(path, conflict_resolutions={"3": "overwrite"})
+        self.assertEqual((stats.unchanged, stats.conflict_count, stats.updated), (0, 1, 1))
+        compra.refresh_from_db()
+        self.assertEqual(compra.pacas, 10)
+        self.assertEqual(import_compras_excel(path).unchanged, 1)
+
+    def test_bloque_revertido_restaura_compra_sobrescrita(self):
+        import_compras_excel(self._write_xlsx([[95, "Juan Perez", date(2026, 3, 1), 10, 1000]], name="base.xlsx"))
+        path = self._write_xlsx([
+            [95, "Juan Perez", date(2026, 3, 1), 12, 1200],
+            [95, "Juan Perez", date(2026, 3, 1), 4, 400],
+        ])
+        # Un bloque por fila; el de la sobrescritura falla al recalcular totales.
+        with patch("pagos.services.imports._WRITE_CHUNK", 1), patch(
+            "pagos.services.imports.recalcular_totales_compras", side_effect=[RuntimeError("falla"), None]
+        ):
+            stats = import_compras_excel(path, conflict_policy="overwrite")
+        self.assertEqual(stats.error_count, 1)
+        base = Compra.objects.get(numero_compra=95, parent_compra__isnull=True)
+        self.assertEqual(base.compra_en_libras, 1000)
+        # La división se calcula contra la base guardada, no contra la sobrescritura revertida.
+        self.assertEqual(base.divisiones.get().porcentaje_division, 40)
+
+    def test_precalculo_microsip_una_vez_por_importacion(self):
+        path = self._write_xlsx([
+            [96, "Juan Perez", date(2026, 3, 1), 10, 1000],
+            [97, "Ana Gomez", date(2026, 3, 1), 5, 500],
+            [98, "Juan Perez", date(2026, 3, 2), 4, 400],
+        ])
+        with patch("pagos.services.imports._WRITE_CHUNK", 1), patch(
+            "pagos.services.imports.schedule_microsip_candidates_prefetch"
+        ) as schedule:
+            import_compras_excel(path, dry_run=True)
+            schedule.assert_not_called()
+            import_compras_excel(path)
+        schedule.assert_called_once_with(set(Productor.objects.values_list("id", flat=True)))
+
+    def test_varios_archivos_detecta_division_entre_archivos(self):
+        a = self._write_xlsx([[90, "Juan Perez", date(2026, 3, 1), 10, 1000]], name="a.xlsx")
+        b = self._write_xlsx([
+            [90, "PEREZ JUAN", date(2026, 3, 1), 4, 400],
+            [91, "Ana Gomez", date(2026, 3, 2), 5, 500],
+        ], name="b.xlsx")
+        # El orden de escritura es por nombre de archivo, no el de los argumentos.
+        dry = import_compras_files([b, a], dry_run=True, max_workers=2)
+        self.assertEqual(Compra.objects.count(), 0)
+        self.assertEqual([(r["archivo"], r["row_number"], r["status"]) for r in dry.rows], [
+            ("a.xlsx", 3, "created"),
+            ("b.xlsx", 3, "division"),
+            ("b.xlsx", 4, "created"),
+        ])
+
+        stats = import_compras_files([b, a], max_workers=1)
+        self.assertEqual((stats.created, stats.divisions_created), (3, 1))
+        base = Compra.objects.get(numero_compra=90, parent_compra__isnull=True)
+        self.assertEqual(base.pacas, 10)
+        self.assertEqual(base.divisiones.get().porcentaje_division, 40)
+        self.assertEqual(ImportRowLog.objects.get(status="division").archivo, "b.xlsx")
+
+    def test_varios_archivos_anticipos_se_leen_en_paralelo_desde_el_cache(self):
+        from pagos.services import import_anticipos_files
+
+        paths = []
+        for name, numero, productor in [("b.xlsx", 602, "Ana Gomez"), ("a.xlsx", 601, "Juan Perez")]:
+            wb = Workbook()
+            ws = wb.active
+            ws.append(["NO ANTICIPO", "FECHA", "PRODUCTOR", "ANTICIPO", "MONEDA"])
+            ws.append([numero, date(2026, 3, 1), productor, 1000, "DOLARES"])
+            path = Path(self.tmpdir.name) / name
+            wb.save(path)
+            paths.append(path)
+
+        stats = import_anticipos_files(paths, max_workers=2)
+        self.assertEqual(stats.created, 2)
+        self.assertEqual(len(list(self.cache_dir.glob("anticipos-*.pkl"))), 2)
+        self.assertEqual(list(ImportRowLog.objects.order_by("id").values_list("archivo", flat=True)), ["a.xlsx", "b.xlsx"])
+
+    def test_worker_solo_toma_trabajos_sin_latido(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from pagos.services import fail_stale_import_jobs
+
+        path = self._write_xlsx([[61, "Juan Perez", date(2026, 3, 1), 10, 1000]])
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        with override_settings(MEDIA_ROOT=Path(self.tmpdir.name) / "media"):
+            vivo, caido = [
+                enqueue_import_job(ImportJobTipoChoices.COMPRAS, SimpleUploadedFile("compras.xlsx", path.read_bytes()))
+                for _ in range(2)
+            ]
+            # Ambos sin avance desde hace una hora; solo el primero sigue latiendo.
+            ImportJob.objects.filter(pk=vivo.pk).update(
+                status=ImportJobStatusChoices.RUNNING, worker_id="w1", heartbeat_at=timezone.now(), updated_at=hace_una_hora
+            )
+            ImportJob.objects.filter(pk=caido.pk).update(
+                status=ImportJobStatusChoices.RUNNING, worker_id="w1", heartbeat_at=hace_una_hora, updated_at=hace_una_hora
+            )
+            self.assertEqual([j.pk for j in fail_stale_import_jobs(5, worker_id="w2")], [caido.pk])
+            self.assertEqual(fail_stale_import_jobs(5, worker_id="w3"), [])
+            media = Path(self.tmpdir.name) / "media"
+            self.assertTrue((media / vivo.archivo.name).exists())
+            self.assertFalse((media / caido.archivo.name).exists())
+
+            # El worker original ya no es dueño del trabajo tomado: su resultado no pisa el FAILED.
+            caido.refresh_from_db()
+            caido.worker_id = "w1"
+            self.assertEqual(run_import_job(caido).status, ImportJobStatusChoices.FAILED)
+            self.assertEqual(run_import_job(ImportJob.objects.get(pk=vivo.pk)).status, ImportJobStatusChoices.DONE)
+
+    def test_trabajo_varios_archivos_respeta_resoluciones_con_nombre_de_carga(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        import_compras_excel(self._write_xlsx([[92, "Juan Perez", date(2026, 3, 1), 10, 1000]]))
+        a = self._write_xlsx([[93, "Ana Gomez", date(2026, 3, 2), 5, 500]], name="Semana 1.xlsx")
+        b = self._write_xlsx([[92, "Juan Perez", date(2026, 3, 1), 12, 1200]], name="Semana 2 (2).xlsx")
+        with override_settings(MEDIA_ROOT=Path(self.tmpdir.name) / "media"):
+            # El storage guarda "Semana_2_2.xlsx"; la resolución usa el nombre con que se previsualizó.
+            job = enqueue_import_job(
+                ImportJobTipoChoices.COMPRAS,
+                SimpleUploadedFile(b.name, b.read_bytes()),
+                extra_files=[SimpleUploadedFile(a.name, a.read_bytes())],
+                conflict_resolutions={"Semana 2 (2).xlsx:3": "overwrite"},
+            )
+            self.assertNotEqual(Path(job.archivo.name).name, "Semana 2 (2).xlsx")
+            job = run_import_job(ImportJob.objects.get(pk=job.pk))
+            self.assertFalse(any((Path(self.tmpdir.name) / "media").rglob("*.xlsx")))
+
+        self.assertEqual(job.status, ImportJobStatusChoices.DONE)
+        self.assertEqual(Compra.objects.get(numero_compra=92).pacas, 12)
+        self.assertEqual(
+            list(job.run.rows.order_by("id").values_list("archivo", "status")),
+            [("Semana 1.xlsx", "created"), ("Semana 2 (2).xlsx", "updated")],
+        )
+
+    def test_deteccion_conflictos_no_crece_en_consultas(self):
+        rows = [[n, "Juan Perez", date(2026, 3, 1), 10, 1000] for n in range(50, 60)]
+        import_compras_excel(self._write_xlsx(rows))
+        changed = self._write_xlsx([[n, "Juan Perez", date(2026, 3, 1), 11, 1100] for n in range(50, 60)], name="changed.xlsx")
+        preview_compras_excel(changed)
+        # catálogo productores + catálogo personas + prefetch de compras base + prefetch de huellas
+        with self.assertNumQueries(4):
+            conflicts = detect_compras_conflicts(changed)
+        self.assertEqual(len(conflicts), 10)
+
+
+class _FakeCursor:
+    def __init__(self, con):
+        self.con = con
+        self.description = [("UNO",)]
+
+    def execute(self, sql, params=()):
+        if self.con.dead:
+            raise RuntimeError("conexión perdida")
+        self.con.queries.append(sql)
+
+    def fetchall(self):
+        return [(1,)]
+
+
+class _FakeConnection:
+    def __init__(self):
+        self.dead = False
+        self.closed = False
+        self.queries = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class MicrosipPoolTests(TestCase):
+    def setUp(self):
+        from pagos.services.microsip_pool import ConnectionPool
+
+        self.opened = []
+
+        def connect():
+            self.opened.append(_FakeConnection())
+            return self.opened[-1]
+
+        self.pool = ConnectionPool(connect, max_size=1, idle_timeout=60, check_after=0, timeout=0.05)
+
+    def test_reutiliza_conexion_y_reporta_metricas(self):
+        with patch("pagos.services.microsip_debt.get_microsip_pool", return_value=self.pool):
+            from pagos.services.microsip_debt import _fetch
+
+            self.assertEqual(_fetch("SELECT 1"), [{"UNO": 1}])
+            self.assertEqual(_fetch("SELECT 2"), [{"UNO": 1}])
+        self.assertEqual(len(self.opened), 1)
+        # Cada devolución cierra la transacción de lectura.
+        self.assertEqual(self.opened[0].rollbacks, 3)
+        stats = self.pool.stats()
+        self.assertEqual((stats["checkouts"], stats["created"], stats["reused"], stats["idle"]), (2, 1, 1, 1))
+
+        with self.pool.connection():
+            with self.assertRaises(TimeoutError):
+                self.pool.acquire()
+        self.assertEqual(self.pool.stats()["timeouts"], 1)
+        self.assertGreater(self.pool.stats()["wait_max_ms"], 0)
+
+    def test_interrupcion_libera_el_lugar_y_descarta_conexion(self):
+        with self.assertRaises(KeyboardInterrupt):
+            with self.pool.connection():
+                raise KeyboardInterrupt
+        self.assertTrue(self.opened[0].closed)
+        # Con max_size=1, el lugar debe estar libre para la siguiente conexión.
+        with self.pool.connection() as con:
+            self.assertIs(con, self.opened[1])
+
+    def test_descarta_conexion_caida_y_ociosa(self):
+        with self.pool.connection():
+            pass
+        self.opened[0].dead = True
+        with self.pool.connection() as con:
+            self.assertIs(con, self.opened[1])
+        self.assertTrue(self.opened[0].closed)
+        self.assertEqual(self.pool.stats()["discarded"], 1)
+
+        self.pool._idle[0].last_used -= 120
+        with self.pool.connection() as con:
+            self.assertIs(con, self.opened[2])
+        self.assertTrue(self.opened[1].closed)
+        self.assertEqual((self.pool.stats()["evicted_idle"], self.pool.stats()["open"]), (1, 1))
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "microsip": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "microsip-tests"},
+        "queue": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "queue-tests"},
+    }
+)
+class MicrosipSharedCacheTests(TestCase):
+    def setUp(self):
+        from django.core.cache import caches
+        from pagos.services import microsip_cache
+
+        caches["microsip"].clear()
+        microsip_cache._local.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return [{"CLIENTE_ID": 7, "CLIENTE": "JUAN PEREZ", "MONEDA_ID": 620, "TOTAL": Decimal(self.calls)}]
+
+    def test_un_solo_calculo_compartido_y_stale_while_revalidate(self):
+        from pagos.services import microsip_cache
+        from pagos.services.microsip_cache import _refresh, shared_cached
+
+        self.assertEqual(shared_cached("t", self.compute)[0]["TOTAL"], 1)
+        # Otro proceso (sin copia local) lee el valor compartido sin recalcular.
+        microsip_cache._local.clear()
+        self.assertEqual(shared_cached("t", self.compute)[0]["TOTAL"], 1)
+        self.assertEqual(self.calls, 1)
+
+        with patch("pagos.services.microsip_cache._start_background_refresh", side_effect=_refresh) as bg:
+            # Con el lock tomado por otro proceso, el valor viejo se sirve sin recalcular.
+            self.assertIsNotNone(microsip_cache._try_lock("t", 60))
+            self.assertEqual(shared_cached("t", self.compute, ttl=0)[0]["TOTAL"], 1)
+            bg.assert_not_called()
+            microsip_cache._cache().delete("microsip:t:lock")
+
+            self.assertEqual(shared_cached("t", self.compute, ttl=0)[0]["TOTAL"], 1)
+            bg.assert_called_once()
+        self.assertEqual(shared_cached("t", self.compute)[0]["TOTAL"], 2)
+        self.assertEqual(shared_cached("t", self.compute, force=True)[0]["TOTAL"], 3)
+
+    def test_sync_deuda_force_invalida_cache(self):
+        from pagos.services import sync_microsip_debt_for_compra
+
+        productor = Productor.objects.create(codigo="P-MS", nombre="Juan Perez", microsip_cliente_nombre="JUAN PEREZ")
+        compra = Compra.objects.create(numero_compra=900, productor=productor, compra_en_libras=Decimal("100"))
+        with patch("pagos.services.microsip_debt._fetch", side_effect=lambda sql: self.compute()):
+            self.assertEqual(sync_microsip_debt_for_compra(compra).total_usd, 1)
+            self.assertEqual(sync_microsip_debt_for_compra(compra).total_usd, 1)
+            self.assertEqual(sync_microsip_debt_for_compra(compra, force=True).total_usd, 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_indice_de_clientes_equivale_a_busqueda_lineal(self):
+        from pagos.services import microsip_debt
+        from pagos.services.microsip_debt import _aggregate_clients, _norm_name
+
+        rows = [
+            {"CLIENTE_ID": 1, "CLIENTE": "1 JUAN PÉREZ", "RFC": "PEJU800101AAA", "MONEDA_ID": 620, "TOTAL": 50},
+            {"CLIENTE_ID": 2, "CLIENTE": "2 JUAN PEREZ", "RFC": "", "MONEDA_ID": 1, "TOTAL": 900},
+            {"CLIENTE_ID": 3, "CLIENTE": "JUANITA LOPEZ", "RFC": "LOJU", "MONEDA_ID": 620, "TOTAL": 70},
+            {"CLIENTE_ID": 4, "CLIENTE": "AGRICOLA (REIMER)", "RFC": "", "MONEDA_ID": 620, "TOTAL": 10},
+        ]
+        with patch("pagos.services.microsip_debt._rows_all_cached", return_value=rows):
+            index = microsip_debt._client_index()
+            self.assertIs(microsip_debt._client_index(), index)
+            for q in ["juan", "Juan Pérez", "UAN PER", "peju80", "reimer)", "", "zzz"]:
+                token = _norm_name(q)
+                expected = [
+                    c for c in _aggregate_clients(rows)
+                    if token in _norm_name(c["cliente"]) or any(token in _norm_name(a) for a in c["aliases"]) or token in _norm_name(c.get("rfc", ""))
+                ]
+                self.assertEqual(microsip_debt.list_all_microsip_debt_clients(q), expected, q)
+            found = microsip_debt.find_microsip_candidates_for_productor("Juan Perez")
+            self.assertEqual([c["cliente"] for c in found], ["JUAN PEREZ", "JUANITA LOPEZ"])
+
+    def test_sync_deuda_mapeada_usa_consulta_por_cliente(self):
+        from pagos.services import microsip_cache, sync_microsip_debt_for_compra
+        from pagos.services.microsip_cache import shared_cached
+
+        productor = Productor.objects.create(
+            codigo="P-MS2", nombre="Juan Perez", microsip_cliente_nombre="JUAN PEREZ", microsip_cliente_id="8|7"
+        )
+        compra = Compra.objects.create(numero_compra=901, productor=productor, compra_en_libras=Decimal("100"))
+        client_rows = [{"CLIENTE_ID": 7, "CLIENTE": "1 JUAN PEREZ", "MONEDA_ID": 620, "TOTAL": Decimal("40")}]
+        with patch("pagos.services.microsip_debt._fetch", return_value=client_rows) as fetch:
+            snap = sync_microsip_debt_for_compra(compra)
+        sql, params = fetch.call_args.args
+        self.assertIn("d.CLIENTE_ID IN (?, ?)", sql)
+        self.assertEqual(params, (7, 8, 7, 8, 7, 8))
+        self.assertEqual((snap.total_usd, snap.detalle_json["match_mode"]), (40, "cliente_id"))
+
+        # Con el resumen vigente en cache no se consulta Microsip; forzar usa la consulta acotada
+        # y deja el resumen compartido marcado para recalcularse.
+        shared_cached("summary", self.compute)
+        with patch("pagos.services.microsip_debt._fetch", return_value=client_rows) as fetch:
+            self.assertEqual(sync_microsip_debt_for_compra(compra).total_usd, 1)
+            fetch.assert_not_called()
+            self.assertEqual(sync_microsip_debt_for_compra(compra, force=True).total_usd, 40)
+            fetch.assert_called_once()
+        self.assertTrue(microsip_cache._read("summary")[2])
+
+    def test_sync_deuda_en_lote_de_compras_abiertas(self):
+        from django.core.management import call_command
+        from pagos.models import DebtSnapshot
+
+        TipoCambio.objects.create(fecha=date(2026, 3, 1), tc=20)
+        mapped = Productor.objects.create(codigo="P-L1", nombre="Juan Perez", microsip_cliente_nombre="JUAN PEREZ")
+        unmapped = Productor.objects.create(codigo="P-L2", nombre="Ana Gomez")
+        abierta = Compra.objects.create(numero_compra=910, productor=mapped, fecha_liq=date(2026, 3, 1), compra_en_libras=Decimal("1000"))
+        Compra.objects.create(numero_compra=911, productor=mapped, cancelada=True)
+        pagada = Compra.objects.create(numero_compra=912, productor=mapped)
+        Compra.objects.filter(pk=pagada.pk).update(workflow_state=WorkflowStateChoices.PAID)
+        Compra.objects.create(numero_compra=913, productor=unmapped)
+        rows = [
+            {"CLIENTE": "1 JUAN PEREZ", "MONEDA_ID": 620, "TOTAL": Decimal("100")},
+            {"CLIENTE": "2 JUAN PEREZ", "MONEDA_ID": 1, "TOTAL": Decimal("400")},
+        ]
+        with patch("pagos.services.microsip_debt._rows_all_cached", return_value=rows):
+            out = StringIO()
+            call_command("sincronizar_deudas_microsip", stdout=out)
+            self.assertIn("con_cambio=1 sin_mapeo=1 delta_usd=100.00 delta_mxn=400.00", out.getvalue())
+            self.assertEqual(DebtSnapshot.objects.count(), 0)
+
+            call_command("sincronizar_deudas_microsip", "--apply", stdout=StringIO())
+        abierta.refresh_from_db()
+        self.assertEqual((abierta.retencion_deudas_usd, abierta.retencion_deudas_mxn), (100, 400))
+        self.assertEqual(abierta.total_deuda_en_dls, Decimal("120"))
+        self.assertEqual(abierta.saldo_pendiente, Decimal("880"))
+        self.assertEqual(list(DebtSnapshot.objects.values_list("compra_id", flat=True)), [abierta.id])
+
+    def test_sync_en_lote_usa_espejo_e_ids_como_por_compra(self):
+        from pagos.models import DebtSnapshot, MicrosipSaldoCliente, MicrosipWatermark
+        from pagos.services import sync_microsip_debt_for_compra, sync_microsip_debt_for_open_compras
+
+        # El nombre mapeado ya no coincide con el de Microsip: sólo los IDs lo encuentran.
+        productor = Productor.objects.create(
+            codigo="P-L3", nombre="Pedro Ruiz", microsip_cliente_nombre="PEDRO RUIZ", microsip_cliente_id="9"
+        )
+        compra = Compra.objects.create(numero_compra=915, productor=productor, compra_en_libras=Decimal("1000"))
+        MicrosipWatermark.objects.create(tabla="DOCTOS_CC", ultimo_id=1)
+        MicrosipSaldoCliente.objects.create(cliente_id=9, nombre="PEDRO RUIZ SPR", cliente_base="PEDRO RUIZ SPR", moneda_id=620, total=50)
+        MicrosipSaldoCliente.objects.create(cliente_id=10, nombre="PEDRO RUIZ", cliente_base="PEDRO RUIZ", moneda_id=620, total=70)
+
+        with patch("pagos.services.microsip_debt._fetch") as fetch:
+            sync_microsip_debt_for_open_compras(force=False)
+            single = sync_microsip_debt_for_compra(compra)
+            fetch.assert_not_called()
+        batch = DebtSnapshot.objects.exclude(pk=single.pk).get(compra=compra)
+        self.assertEqual((batch.total_usd, batch.detalle_json["match_mode"]), (50, "local_mirror"))
+        self.assertEqual((single.total_usd, single.detalle_json["match_mode"]), (50, "local_mirror"))
+
+    def test_snapshots_comparten_payload_por_contenido(self):
+        from pagos.models import DebtSnapshotPayload
+        from pagos.services import sync_microsip_debt_for_compra
+
+        productor = Productor.objects.create(codigo="P-PL", nombre="Juan Perez", microsip_cliente_nombre="JUAN PEREZ", microsip_cliente_id="7")
+        compra = Compra.objects.create(numero_compra=920, productor=productor)
+        rows = [{"CLIENTE_ID": 7, "CLIENTE": "JUAN PEREZ", "MONEDA_ID": 620, "TOTAL": Decimal("40")}]
+        with patch("pagos.services.microsip_debt._fetch", return_value=rows):
+            first = sync_microsip_debt_for_compra(compra, force=True)
+            second = sync_microsip_debt_for_compra(compra, force=True)
+        self.assertEqual(DebtSnapshotPayload.objects.count(), 1)
+        self.assertEqual(first.payload_id, second.payload_id)
+        self.assertNotIn("rows", second.detalle_json)
+        latest = compra.debt_snapshots.filter(fuente="microsip").first()
+        self.assertEqual((latest.pk, latest.rows[0]["TOTAL"]), (second.pk, 40.0))
+
+    def test_sustituto_sqlite_ejecuta_consultas_microsip(self):
+        from pagos.services import microsip_debt
+        from pagos.services.microsip_source import SQLiteSource, firebird_to_sqlite, generate_synthetic_book, use_microsip_source
+
+        self.assertEqual(
+            firebird_to_sqlite("SELECT FIRST 5 a, (SELECT FIRST 1 TRIM(b) FROM t ORDER BY c) AS x FROM u ORDER BY a"),
+            "SELECT a, (SELECT TRIM(b) FROM t ORDER BY c LIMIT 1) AS x FROM u ORDER BY a\nLIMIT 5\n",
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "microsip.sqlite"
+            info = generate_synthetic_book(path, documentos=400, clientes=30)
+            self.assertEqual(info["cargos"], 400)
+            with use_microsip_source(SQLiteSource(path)):
+                clients = microsip_debt.list_all_microsip_debt_clients(limit=1000)
+                self.assertTrue(clients)
+                top = clients[0]
+                by_rfc = microsip_debt.list_microsip_clients_by_rfc(top["rfc"])
+                self.assertEqual([c["cliente"] for c in by_rfc], [top["cliente"]])
+                # La consulta por cliente suma lo mismo que el resumen completo.
+                usd, mxn = microsip_debt._sum_by_moneda(microsip_debt._fetch_client_rows(microsip_debt._mapped_cliente_ids(top["cliente_id"])))
+                self.assertAlmostEqual(float(usd + mxn), float(top["usd"] + top["mxn"]), places=2)
+                microsip_debt.get_microsip_pool().close_all()
+
+    def test_saldos_locales_incrementales_coinciden_con_resumen(self):
+        import sqlite3
+
+        from pagos.models import MicrosipCargoAbierto, MicrosipSaldoCliente
+        from pagos.services import microsip_debt, refresh_microsip_balances
+        from pagos.services.microsip_source import SQLiteSource, generate_synthetic_book, use_microsip_source
+
+        def esperado():
+            rows = microsip_debt._fetch(microsip_debt.SUMMARY_SQL_FILTERED.replace("__CLIENT_FILTER__", "1=1"))
+            return {int(r["CLIENTE_ID"]): round(float(r["TOTAL"]), 2) for r in rows}
+
+        def locales():
+            return {s.cliente_id: round(float(s.total), 2) for s in MicrosipSaldoCliente.objects.filter(total__gt=0)}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "microsip.sqlite"
+            generate_synthetic_book(path, documentos=300, clientes=20)
+            with use_microsip_source(SQLiteSource(path)):
+                r = refresh_microsip_balances()
+                self.assertEqual(r.mode, "completo")
+                self.assertEqual(locales(), esperado())
+
+                con = sqlite3.connect(str(path))
+                doc, imp = con.execute("SELECT (SELECT MAX(DOCTO_CC_ID) FROM DOCTOS_CC), (SELECT MAX(IMPTE_DOCTO_CC_ID) FROM IMPORTES_DOCTOS_CC)").fetchone()
+                abierto = MicrosipCargoAbierto.objects.filter(cargo_neto__gt=1000).values_list("docto_cc_id", "cliente_id").first()
+                con.execute("INSERT INTO DOCTOS_CC VALUES (?, 1, 1, '2026-10-01', 'N', 'N')", (doc + 1,))
+                con.execute("INSERT INTO IMPORTES_DOCTOS_CC VALUES (?, ?, NULL, 'C', 5000, 800, 0, 0, 'N', 'N')", (imp + 1, doc + 1))
+                con.execute("INSERT INTO DOCTOS_CC VALUES (?, 3, ?, '2026-10-02', 'N', 'N')", (doc + 2, abierto[1]))
+                con.execute("INSERT INTO IMPORTES_DOCTOS_CC VALUES (?, ?, ?, 'R', 100, 0, 0, 0, 'N', 'N')", (imp + 2, doc + 2, abierto[0]))
+                con.execute("UPDATE DOCTOS_VE SET ESTATUS = 'F' WHERE DOCTO_VE_ID = (SELECT MIN(DOCTO_VE_ID) FROM DOCTOS_VE WHERE ESTATUS = 'P')")
+                con.commit()
+                con.close()
+
+                r = refresh_microsip_balances()
+                self.assertEqual((r.mode, r.importes_nuevos, r.watermark), ("incremental", 2, imp + 2))
+                self.assertGreater(r.clientes_actualizados, 0)
+                self.assertEqual(locales(), esperado())
+                microsip_debt.get_microsip_pool().close_all()
+
+    def test_espejo_local_responde_igual_que_microsip_en_linea(self):
+        from pagos.services import microsip_debt, refresh_microsip_balances, sync_microsip_debt_for_compra
+        from pagos.services.microsip_source import SQLiteSource, generate_synthetic_book, use_microsip_source
+
+        def resumen(clients):
+            return sorted((c["cliente"], c["cliente_id"], round(float(c["usd"] + c["mxn"]), 2)) for c in clients)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "microsip.sqlite"
+            generate_synthetic_book(path, documentos=300, clientes=20)
+            with use_microsip_source(SQLiteSource(path)):
+                en_linea = microsip_debt.list_all_microsip_debt_clients(limit=1000)
+                top = en_linea[0]
+                rfc_en_linea = microsip_debt.list_microsip_clients_by_rfc(top["rfc"])
+                candidatos_en_linea = microsip_debt.find_microsip_candidates_for_productor("Perez Juan", limit=50)
+
+                refresh_microsip_balances()
+                # Con el espejo construido las búsquedas no tocan Microsip.
+                with patch("pagos.services.microsip_debt._fetch", side_effect=AssertionError("consulta Microsip")):
+                    self.assertEqual(resumen(microsip_debt.list_all_microsip_debt_clients(limit=1000)), resumen(en_linea))
+                    self.assertEqual(
+                        [c["cliente"] for c in microsip_debt.list_all_microsip_debt_clients(limit=1000)][:1], [top["cliente"]]
+                    )
+                    self.assertEqual(resumen(microsip_debt.list_microsip_clients_by_rfc(top["rfc"])), resumen(rfc_en_linea))
+                    self.assertEqual(
+                        resumen(microsip_debt.find_microsip_candidates_for_productor("Perez Juan", limit=50)),
+                        resumen(candidatos_en_linea),
+                    )
+                    productor = Productor.objects.create(
+                        codigo="P-MS3", nombre=top["cliente"], microsip_cliente_nombre=top["cliente"], microsip_cliente_id=top["cliente_id"]
+                    )
+                    compra = Compra.objects.create(numero_compra=903, productor=productor, compra_en_libras=Decimal("100"))
+                    snap = sync_microsip_debt_for_compra(compra)
+                self.assertEqual(snap.detalle_json["match_mode"], "local_mirror")
+                self.assertAlmostEqual(float(snap.total_usd + snap.total_mxn), float(top["usd"] + top["mxn"]), places=2)
+                microsip_debt.get_microsip_pool().close_all()
+
+    def test_candidatos_microsip_se_precalculan_y_sirven_desde_cache(self):
+        from pagos.services import microsip_candidates, microsip_debt, microsip_candidates_for_productor
+        from pagos.services.microsip_source import SQLiteSource, generate_synthetic_book, use_microsip_source
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "microsip.sqlite"
+            generate_synthetic_book(path, documentos=300, clientes=20)
+            with use_microsip_source(SQLiteSource(path)):
+                top = microsip_debt.list_all_microsip_debt_clients(limit=1)[0]
+                productor = Productor.objects.create(codigo="P-MS4", nombre=top["cliente"], rfc=top["rfc"])
+                compra = Compra.objects.create(numero_compra=904, productor=productor, compra_en_libras=Decimal("100"))
+
+                # Llegar al paso "deudas" agenda el precálculo tras el commit.
+                with patch.object(microsip_candidates, "_start_prefetch") as start:
+                    with self.captureOnCommitCallbacks(execute=True):
+                        compra.set_workflow_state(WorkflowStateChoices.DEBT_CALCULATED)
+                start.assert_called_once_with([productor.id])
+                microsip_candidates_for_productor(productor, force=True)
+
+                # La pantalla de mapeo lee del cache sin consultar Microsip.
+                with patch("pagos.services.microsip_debt._fetch", side_effect=AssertionError("consulta Microsip")):
+                    cached = microsip_candidates_for_productor(productor)
+                self.assertEqual([c["cliente"] for c in cached["rfc"]], [top["cliente"]])
+                self.assertIn(top["cliente"], [c["cliente"] for c in cached["candidates"]])
+
+                # Un RFC distinto cambia la llave: se recalcula (con las tres búsquedas en paralelo).
+                productor.rfc = "XAXX010101000"
+                self.assertEqual(microsip_candidates_for_productor(productor)["rfc"], [])
+                microsip_debt.get_microsip_pool().close_all()
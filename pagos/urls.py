@@ -1,6 +1,6 @@
 from django.urls import path
 
-from .api_views import api_compra_detail, api_queue_summary
+from .api_views import api_compra_detail, api_import_job_status, api_microsip_pool_stats, api_queue_summary
 from .views import (
     HomeView,
     anticipos_view,
@@ -50,6 +50,8 @@ urlpatterns = [
     path("compras/<int:compra_id>/validacion-factura/", compra_validacion_factura_view, name="compra_validacion_factura"),
     path("api/queue/summary/", api_queue_summary, name="api_queue_summary"),
     path("api/compras/<int:compra_id>/", api_compra_detail, name="api_compra_detail"),
+    path("api/import-jobs/<int:job_id>/", api_import_job_status, name="api_import_job_status"),
+    path("api/microsip/pool/", api_microsip_pool_stats, name="api_microsip_pool_stats"),
     path("api/facturadores/<int:facturador_id>/contacto/", api_facturador_contacto_view, name="api_facturador_contacto"),
     path("compras/<int:compra_id>/editar/", compra_edit_view, name="compra_edit"),
     path("compras/<int:compra_id>/eliminar/", compra_delete_view, name="compra_delete"),
@@ -6,13 +6,18 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.files.base import ContentFile
 from django.core.paginator import Paginator
 from django.db.models.deletion import ProtectedError
-from django.db.models import Count, Q, Sum
+from django.db.models import Case, CharField, Count, Exists, OuterRef, Q, Sum, Value, When
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from datetime import datetime
+from django.urls import reverse
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from decimal import Decimal, InvalidOperation
+from pathlib import Path
 import hashlib
+import os
 import re
+import tempfile
 import xml.etree.ElementTree as ET
 
 from django.utils import timezone
@@ -48,26 +53,33 @@ from .forms import (
     TipoCambioForm,
     XmlValidationConfigForm,
 )
-from .models import Anticipo, AplicacionAnticipo, BeneficiaryValidationException, Compra, Contador, Deduccion, DocumentoCompra, EmailOutboxLog, EmailTemplate, FacturadorCuentaBancaria, ImportRun, PagoCompra, PersonaFactura, Productor, ProductorCuentaBancaria, TipoCambio, WorkflowStateChoices, XmlValidationConfig
+from .models import Anticipo, AplicacionAnticipo, BeneficiaryValidationException, Compra, Contador, Deduccion, DocumentoCompra, EmailOutboxLog, EmailTemplate, FacturadorCuentaBancaria, ImportJob, ImportJobStatusChoices, ImportJobTipoChoices, PagoCompra, PersonaFactura, Productor, ProductorCuentaBancaria, TipoCambio, WorkflowStateChoices, XmlValidationConfig
 from .services import (
+    beneficiary_validation,
     build_invoice_request_email,
     build_invoice_request_message,
     render_invoice_email_html,
     create_invoice_validation_for_compra,
     detect_compras_conflicts,
+    detect_compras_files_conflicts,
     gmail_ready,
     gmail_inbox_ready,
     fetch_gmail_attachments_for_compra,
     mark_gmail_message_processed,
+    ImportStats,
+    enqueue_import_job,
     import_anticipos_excel,
+    import_anticipos_files,
     import_compras_excel,
+    import_compras_files,
     send_gmail,
     payable_breakdown,
-    find_microsip_candidates_for_productor,
     list_all_microsip_debt_clients,
-    list_microsip_clients_by_rfc,
+    microsip_candidates_for_productor,
+    schedule_microsip_candidates_prefetch,
     preview_anticipos_excel,
     preview_compras_excel,
+    readiness_queue_page,
     sync_microsip_debt_for_compra,
     transition_compra,
     extract_pdf_text,
@@ -167,11 +179,6 @@ def _attach_email_proof_to_expediente(
     doc.archivo.save(filename, ContentFile(content.encode("utf-8")), save=True)
 
 
-LEGAL_TOKENS = {
-    "SA", "CV", "DE", "RL", "S", "A", "P", "I", "SC", "SPR", "SAPI", "SAB", "COOP", "AC", "THE", "DEL", "LA", "LOS", "LAS", "Y", "E",
-}
-
-
 def _get_compra_pdf_attachment(compra: Compra, *, prefer_mxn: bool = False):
     qs = compra.documentos.filter(etapa="compra_original", archivo__iendswith=".pdf").order_by("-created_at")
     docs = list(qs[:50])
@@ -234,24 +241,6 @@ def _extract_xml_basic(xml_bytes: bytes):
     }
 
 
-def _norm_name(value: str) -> str:
-    txt = (value or "").upper().strip()
-    txt = txt.replace("Á", "A").replace("É", "E").replace("Í", "I").replace("Ó", "O").replace("Ú", "U")
-    txt = re.sub(r"[^A-Z0-9 ]+", " ", txt)
-    tokens = [t for t in txt.split() if t and t not in LEGAL_TOKENS and len(t) > 1]
-    return " ".join(tokens)
-
-
-def _token_similarity(a: str, b: str) -> Decimal:
-    sa = set((a or "").split())
-    sb = set((b or "").split())
-    if not sa or not sb:
-        return Decimal("0")
-    inter = len(sa & sb)
-    union = len(sa | sb)
-    return Decimal(str(inter / union)) if union else Decimal("0")
-
-
 def _expected_total_for_invoice_validation(compra: Compra):
     expected_moneda = (compra.expected_moneda or "").strip().upper()
 
@@ -270,84 +259,41 @@ def _expected_total_for_invoice_validation(compra: Compra):
     return str(base_usd), "3"
 
 
-def _beneficiary_validation(compra: Compra):
-    latest = compra.invoice_validations.first()
-    raw = (getattr(latest, "raw_result", {}) or {}) if latest else {}
-    emisor_nombre = (raw.get("nombre_emisor") or compra.factura or "").strip()
-    emisor_rfc = (raw.get("rfc_emisor") or getattr(latest, "rfc_emisor", "") or "").strip().upper()
-    account_holder = ""
-    if (compra.cuenta_productor or "").strip():
-        acc = None
-        if compra.facturador_id:
-            acc = FacturadorCuentaBancaria.objects.filter(facturador=compra.facturador, cuenta=compra.cuenta_productor).first()
-        if not acc:
-            acc = ProductorCuentaBancaria.objects.filter(productor=compra.productor, cuenta=compra.cuenta_productor).first()
-        if acc:
-            account_holder = (acc.titular or "").strip()
-
-    emisor_norm = _norm_name(emisor_nombre)
-    holder_norm = _norm_name(account_holder)
-
-    yellow_threshold = Decimal(str(getattr(settings, "BENEFICIARY_MATCH_YELLOW_THRESHOLD", "0.45")))
-
-    if not emisor_norm or not holder_norm:
-        return {"status": "yellow", "reason": "Falta nombre de emisor o titular de cuenta", "emisor": emisor_nombre, "holder": account_holder, "score": Decimal("0")}
-
-    if emisor_norm == holder_norm:
-        return {"status": "green", "reason": "Titular coincide con emisor", "emisor": emisor_nombre, "holder": account_holder, "score": Decimal("1")}
-
-    score = _token_similarity(emisor_norm, holder_norm)
-
-    has_exception = BeneficiaryValidationException.objects.filter(
-        active=True,
-        productor=compra.productor,
-        account_holder__iexact=account_holder,
-    ).filter(Q(emisor_rfc="") | Q(emisor_rfc=emisor_rfc)).exists()
-
-    if has_exception:
-        return {"status": "yellow", "reason": "Excepción autorizada encontrada (requiere justificación)", "emisor": emisor_nombre, "holder": account_holder, "score": score}
-    if score >= Decimal("0.80"):
-        return {"status": "green", "reason": "Coincidencia alta de nombre", "emisor": emisor_nombre, "holder": account_holder, "score": score}
-    if score >= yellow_threshold:
-        return {"status": "yellow", "reason": "Coincidencia parcial de nombre (requiere justificación)", "emisor": emisor_nombre, "holder": account_holder, "score": score}
-    return {"status": "red", "reason": "Titular de cuenta no coincide con emisor XML", "emisor": emisor_nombre, "holder": account_holder, "score": score}
-
-
 class HomeView(LoginRequiredMixin, ListView):
     template_name = "pagos/home.html"
     model = Compra
     context_object_name = "compras_recientes"
     paginate_by = None
 
-    def _actionable_pending(self):
-        return [
-            c for c in Compra.objects.select_related("productor").filter(cancelada=False).exclude(workflow_state=WorkflowStateChoices.PAID)
-            if not c.base_pipeline_bloqueado_por_divisiones
-        ]
-
-    def _bucket_for_days(self, days: int):
-        if days <= 7:
-            return "0_7"
-        if days <= 15:
-            return "8_15"
-        if days <= 30:
-            return "16_30"
-        return "31_plus"
+    _AGING_BUCKETS = ("0_7", "8_15", "16_30", "31_plus")
+
+    def _actionable_pending(self, today):
+        # Bases con divisiones son solo referencia (el pipeline vive en las divisiones).
+        con_divisiones = Compra.objects.filter(parent_compra=OuterRef("pk"))
+        return (
+            Compra.objects.filter(cancelada=False)
+            .exclude(workflow_state=WorkflowStateChoices.PAID)
+            .exclude(Exists(con_divisiones))
+            .annotate(
+                aging_bucket=Case(
+                    When(fecha_liq__gte=today - timedelta(days=7), then=Value("0_7")),
+                    When(fecha_liq__gte=today - timedelta(days=15), then=Value("8_15")),
+                    When(fecha_liq__gte=today - timedelta(days=30), then=Value("16_30")),
+                    default=Value("31_plus"),
+                    output_field=CharField(),
+                )
+            )
+        )
 
     def get_queryset(self):
         bucket = (self.request.GET.get("aging") or "16_30").strip()
         today = timezone.localdate()
-        rows = []
-        for c in self._actionable_pending():
-            days = (today - c.fecha_liq).days if c.fecha_liq else 0
-            c.aging_days = days
-            c.aging_bucket = self._bucket_for_days(days)
-            if bucket in {"0_7", "8_15", "16_30", "31_plus"}:
-                if c.aging_bucket != bucket:
-                    continue
-            rows.append(c)
-
-        rows.sort(key=lambda x: ((x.fecha_liq or today), x.id))
+        qs = self._actionable_pending(today).select_related("productor")
+        if bucket in self._AGING_BUCKETS:
+            qs = qs.filter(aging_bucket=bucket)
+        rows = list(qs.order_by("fecha_liq", "id"))
+        for c in rows:
+            c.aging_days = (today - c.fecha_liq).days if c.fecha_liq else 0
         return rows
 
     def get_context_data(self, **kwargs):
@@ -362,31 +308,16 @@ class HomeView(LoginRequiredMixin, ListView):
         context["compras_count"] = compras_stats["conteo"] or 0
         context["tc_ultimo"] = TipoCambio.objects.order_by("-fecha").first()
 
-        pending_compras = self._actionable_pending()
-        pending_total = Decimal("0")
-        for c in pending_compras:
-            try:
-                saldo = Decimal(str(c.saldo_por_pagar or "0"))
-                if saldo > 0:
-                    pending_total += saldo
-            except Exception:
-                continue
-        context["pending_total_usd"] = pending_total
-        context["pending_count"] = len([c for c in pending_compras if (c.saldo_por_pagar or 0) > 0])
-
-        today = timezone.localdate()
-        pending_qs = pending_compras
-        aging = {"0_7": 0, "8_15": 0, "16_30": 0, "31_plus": 0}
-        for c in pending_qs:
-            days = (today - c.fecha_liq).days if c.fecha_liq else 0
-            if days <= 7:
-                aging["0_7"] += 1
-            elif days <= 15:
-                aging["8_15"] += 1
-            elif days <= 30:
-                aging["16_30"] += 1
-            else:
-                aging["31_plus"] += 1
+        # Pendientes y antigüedad en una sola consulta agregada (saldo_por_pagar es columna materializada).
+        con_saldo = Q(saldo_por_pagar__gt=0)
+        pending = self._actionable_pending(timezone.localdate()).aggregate(
+            pending_total=Sum("saldo_por_pagar", filter=con_saldo),
+            pending_count=Count("id", filter=con_saldo),
+            **{b: Count("id", filter=Q(aging_bucket=b)) for b in self._AGING_BUCKETS},
+        )
+        context["pending_total_usd"] = pending["pending_total"] or Decimal("0")
+        context["pending_count"] = pending["pending_count"]
+        aging = {b: pending[b] for b in self._AGING_BUCKETS}
         context["aging"] = aging
         context["sla_over_15"] = aging["16_30"] + aging["31_plus"]
         context["active_aging_bucket"] = (self.request.GET.get("aging") or "16_30").strip()
@@ -488,129 +419,78 @@ def compras_operativas_view(request):
     )
 
 
-def _queue_blockers_for_compra(c: Compra):
-    b = []
-    if c.base_pipeline_bloqueado_por_divisiones:
-        return ["Compra base contenedora (pipeline en divisiones)"]
-
-    has_compra_pdf = c.has_compra_original_pdf_for_flow
-    if not has_compra_pdf:
-        b.append("Falta compra original PDF")
-    if not (c.productor.rfc or "").strip():
-        b.append("Falta RFC productor")
-
-    has_xml = c.documentos.filter(etapa="factura", archivo__iendswith=".xml").exists()
-    has_pdf = c.documentos.filter(etapa="factura", archivo__iendswith=".pdf").exists()
-    if c.workflow_state in {WorkflowStateChoices.WAITING_INVOICE, WorkflowStateChoices.INVOICE_BLOCKED}:
-        if not has_xml:
-            b.append("Falta XML factura")
-        if not has_pdf:
-            b.append("Falta PDF factura")
-
-    if c.workflow_state in {WorkflowStateChoices.INVOICE_VALID, WorkflowStateChoices.WAITING_BANK_CONFIRMATION, WorkflowStateChoices.READY_TO_PAY} and not c.bank_account_confirmed:
-        b.append("Falta confirmación bancaria")
-
-    if c.workflow_state == WorkflowStateChoices.READY_TO_PAY:
-        ben = _beneficiary_validation(c)
-        if ben.get("status") == "red":
-            b.append("Beneficiario no coincide")
-
-    return b
-
-
 @login_required
 def readiness_queue_view(request):
     state = (request.GET.get("state") or "").strip().upper()
-
-    def _queue_state(c: Compra):
-        ws = c.workflow_state
-        if ws == WorkflowStateChoices.WAITING_INVOICE:
-            return "SOLICITUD_ENVIADA" if c.solicitud_factura_enviada else "SOLICITUD_PENDIENTE"
-        if ws in {WorkflowStateChoices.INVOICE_BLOCKED, WorkflowStateChoices.INVOICE_VALID}:
-            return "SOLICITUD_ENVIADA"
-        if ws == WorkflowStateChoices.WAITING_BANK_CONFIRMATION:
-            return "WAITING_BANK_CONFIRMATION"
-        if ws == WorkflowStateChoices.READY_TO_PAY:
-            return "READY_TO_PAY"
-        if ws == WorkflowStateChoices.PAID:
-            return "PAID"
-        return "OTHER"
-
-    base_q = Compra.objects.select_related("productor", "parent_compra").filter(cancelada=False).order_by("fecha_liq", "id")
-    visible_all = [c for c in list(base_q[:500]) if not c.base_pipeline_bloqueado_por_divisiones]
-
-    default_states = {"SOLICITUD_PENDIENTE", "SOLICITUD_ENVIADA", "WAITING_BANK_CONFIRMATION", "READY_TO_PAY", "PAID"}
-    if state:
-        queue_items = [c for c in visible_all if _queue_state(c) == state]
-    else:
-        queue_items = [c for c in visible_all if _queue_state(c) in default_states]
-
-    counts = {
-        "SOLICITUD_PENDIENTE": sum(1 for c in visible_all if _queue_state(c) == "SOLICITUD_PENDIENTE"),
-        "SOLICITUD_ENVIADA": sum(1 for c in visible_all if _queue_state(c) == "SOLICITUD_ENVIADA"),
-        "WAITING_BANK_CONFIRMATION": sum(1 for c in visible_all if _queue_state(c) == "WAITING_BANK_CONFIRMATION"),
-        "READY_TO_PAY": sum(1 for c in visible_all if _queue_state(c) == "READY_TO_PAY"),
-        "PAID": sum(1 for c in visible_all if _queue_state(c) == "PAID"),
-    }
-
-    priority_scores = {}
-    for c in queue_items:
-        score = Decimal("0")
-        qstate = _queue_state(c)
-        if qstate == "READY_TO_PAY":
-            score += Decimal("100")
-        elif qstate == "WAITING_BANK_CONFIRMATION":
-            score += Decimal("70")
-        elif qstate == "SOLICITUD_ENVIADA":
-            score += Decimal("40")
-        elif qstate == "SOLICITUD_PENDIENTE":
-            score += Decimal("20")
-
-        if c.fecha_liq:
-            days = (timezone.localdate() - c.fecha_liq).days
-            if days > 0:
-                score += Decimal(str(min(days, 30)))
-
-        try:
-            saldo = Decimal(str(c.saldo_por_pagar or "0"))
-            if saldo > 0:
-                score += min(saldo / Decimal("10000"), Decimal("20"))
-        except Exception:
-            pass
-
-        priority_scores[c.id] = score.quantize(Decimal("0.01"))
-
-    blocked = {
-        c.id: (c.invoice_validations.first().blocked_reason if c.invoice_validations.first() else "")
-        for c in queue_items
-    }
-    queue_blockers = {c.id: _queue_blockers_for_compra(c) for c in queue_items}
-
-    for c in queue_items:
-        c.queue_state = _queue_state(c)
-
-    queue_items.sort(key=lambda x: (priority_scores.get(x.id, Decimal("0")), x.fecha_liq or timezone.localdate()), reverse=True)
-
+    page = readiness_queue_page(state=state, after=(request.GET.get("after") or "").strip())
     return render(
         request,
         "pagos/readiness_queue.html",
         {
-            "compras": queue_items,
-            "counts": counts,
+            "compras": page.items,
+            "counts": page.counts,
             "active_state": state,
-            "blocked_reasons": blocked,
-            "queue_blockers": queue_blockers,
-            "priority_scores": priority_scores,
+            "blocked_reasons": {c.id: c.blocked_reason for c in page.items},
+            "queue_blockers": {c.id: c.queue_blockers for c in page.items},
+            "priority_scores": {c.id: c.priority_score for c in page.items},
+            "next_cursor": page.next_cursor,
+            "is_first_page": not request.GET.get("after"),
         },
     )
 
 
+def _unique_upload_names(files):
+    # Mismo nombre en dos archivos de una carga: la bitácora y las resoluciones de conflicto van por nombre.
+    seen = set()
+    for f in files:
+        base, name, n = Path(f.name), f.name, 2
+        while name in seen:
+            name = f"{base.stem} ({n}){base.suffix}"
+            n += 1
+        f.name = name
+        seen.add(name)
+    return files
+
+
+@contextmanager
+def _upload_tmp(files):
+    # Copia temporal por carga (vista previa) en una carpeta única; se borra al terminar.
+    with tempfile.TemporaryDirectory(prefix="import_preview_") as tmpdir:
+        paths = []
+        for f in files:
+            path = os.path.join(tmpdir, Path(f.name).name)
+            with open(path, "wb") as out:
+                for chunk in f.chunks():
+                    out.write(chunk)
+            paths.append(path)
+        yield paths
+
+
+def _import_job_context(request, tipo):
+    """Trabajo en segundo plano indicado en ?job=; si ya terminó, sus conteos se muestran como resultado."""
+    job_id = request.GET.get("job")
+    if not job_id or not str(job_id).isdigit():
+        return None, None, None
+    job = ImportJob.objects.select_related("run").filter(pk=int(job_id), tipo=tipo).first()
+    if not job or job.status != ImportJobStatusChoices.DONE:
+        return job, None, None
+    result = ImportStats(
+        created=job.created_count,
+        updated=job.updated_count,
+        duplicates=job.duplicate_count,
+        divisions_created=job.division_count,
+        error_count=job.error_count,
+        conflict_count=job.conflict_count,
+        unchanged=job.unchanged_count,
+    )
+    return job, result, job.run
+
+
 @login_required
 def import_anticipos_view(request):
     form = ImportAnticiposExcelForm()
-    result = None
     preview_rows = []
-    import_run = None
+    import_job, result, import_run = _import_job_context(request, ImportJobTipoChoices.ANTICIPOS)
 
     if request.method == "POST":
         if not _can_write(request.user):
@@ -619,25 +499,35 @@ def import_anticipos_view(request):
         form = ImportAnticiposExcelForm(request.POST, request.FILES)
         action = request.POST.get("action", "preview")
         if form.is_valid():
-            f = form.cleaned_data["archivo"]
-            tmp_path = f"/tmp/{f.name}"
-            with open(tmp_path, "wb") as out:
-                for chunk in f.chunks():
-                    out.write(chunk)
-
-            preview_rows = preview_anticipos_excel(tmp_path, limit=20)
+            files = _unique_upload_names(form.cleaned_data["archivo"])
             if action == "import":
-                stats = import_anticipos_excel(tmp_path, dry_run=False)
-                result = stats
-                import_run = ImportRun.objects.order_by("-created_at").first()
-                messages.success(request, "Importación de anticipos completada.")
-            else:
-                messages.info(request, "Vista previa de anticipos generada.")
+                job = enqueue_import_job(ImportJobTipoChoices.ANTICIPOS, files[0], extra_files=files[1:], user=request.user)
+                messages.info(request, "Importación de anticipos en cola. El avance se actualiza automáticamente.")
+                return redirect(f"{reverse('import_anticipos')}?job={job.id}")
+
+            with _upload_tmp(files) as tmp_paths:
+                for tmp_path in tmp_paths:
+                    if len(preview_rows) < 20:
+                        preview_rows += preview_anticipos_excel(tmp_path, limit=20 - len(preview_rows))
+                # Simulación sin escrituras: mismos conteos que la importación real.
+                if len(tmp_paths) > 1:
+                    result = import_anticipos_files(tmp_paths, dry_run=True, max_workers=1)
+                else:
+                    result = import_anticipos_excel(tmp_paths[0], dry_run=True)
+            messages.info(request, "Vista previa de anticipos generada.")
 
+    log_rows = import_run.rows.all()[:30] if import_run else (result.rows[:30] if result else [])
     return render(
         request,
         "pagos/import_anticipos.html",
-        {"form": form, "result": result, "preview_rows": preview_rows, "import_run": import_run},
+        {
+            "form": form,
+            "result": result,
+            "preview_rows": preview_rows,
+            "import_run": import_run,
+            "import_job": import_job,
+            "log_rows": log_rows,
+        },
     )
 
 
@@ -650,10 +540,8 @@ def compras_archivadas_view(request):
 @login_required
 def import_compras_view(request):
     form = ImportComprasExcelForm()
-    result = None
     preview_rows = []
     conflict_rows = []
-    import_run = None
     conflict_policy = "ask"
 
     # Solo Admin (grupo) o superuser pueden importar compras.
@@ -663,53 +551,68 @@ def import_compras_view(request):
         messages.error(request, "Solo Admin puede importar compras.")
         return redirect("compras_operativas")
 
+    import_job, result, import_run = _import_job_context(request, ImportJobTipoChoices.COMPRAS)
+
     if request.method == "POST":
         form = ImportComprasExcelForm(request.POST, request.FILES)
         action = request.POST.get("action", "preview")
         if form.is_valid():
-            f = form.cleaned_data["archivo"]
+            files = _unique_upload_names(form.cleaned_data["archivo"])
             conflict_policy = form.cleaned_data.get("conflict_policy", "ask")
-            tmp_path = f"/tmp/{f.name}"
-            with open(tmp_path, "wb") as out:
-                for chunk in f.chunks():
-                    out.write(chunk)
-
-            preview_rows = preview_compras_excel(tmp_path, limit=20)
-            conflict_rows = detect_compras_conflicts(tmp_path)
 
             if action == "import":
+                # Las resoluciones vienen de la vista previa (conflict_row_<fila>); solo aplican a filas en conflicto.
                 resolutions = {}
                 if conflict_policy == "ask":
-                    for c in conflict_rows:
-                        rn = str(c["row_number"])
-                        resolutions[rn] = request.POST.get(f"conflict_row_{rn}", conflict_policy)
-
-                stats = import_compras_excel(
-                    tmp_path,
-                    dry_run=False,
+                    for k, v in request.POST.items():
+                        if k.startswith("conflict_row_"):
+                            resolutions[k[len("conflict_row_"):]] = v
+                job = enqueue_import_job(
+                    ImportJobTipoChoices.COMPRAS,
+                    files[0],
+                    extra_files=files[1:],
+                    user=request.user,
                     conflict_policy=conflict_policy,
                     conflict_resolutions=resolutions,
                 )
-                result = stats
-                import_run = ImportRun.objects.order_by("-created_at").first()
-                messages.success(request, "Importacion de compras completada.")
-            else:
-                if conflict_rows and conflict_policy == "ask":
-                    messages.info(request, "Vista previa generada. Revisa conflictos y luego confirma importación.")
-                elif conflict_rows:
-                    messages.info(request, "Vista previa generada. Los conflictos se resolverán automáticamente según la política seleccionada.")
+                messages.info(request, "Importación de compras en cola. El avance se actualiza automáticamente.")
+                return redirect(f"{reverse('import_compras')}?job={job.id}")
+
+            with _upload_tmp(files) as tmp_paths:
+                multi = len(tmp_paths) > 1
+                for tmp_path in tmp_paths:
+                    if len(preview_rows) < 20:
+                        preview_rows += preview_compras_excel(tmp_path, limit=20 - len(preview_rows))
+                # Mismas etiquetas y orden que el trabajo de importación: las resoluciones se indexan por ellas.
+                if multi:
+                    conflict_rows = detect_compras_files_conflicts(tmp_paths)
+                else:
+                    conflict_rows = detect_compras_conflicts(tmp_paths[0])
+                # Simulación sin escrituras: mismos conteos que la importación real. En la petición no se
+                # levanta pool de procesos; el paralelo queda para el worker de importaciones.
+                if multi:
+                    result = import_compras_files(tmp_paths, dry_run=True, conflict_policy=conflict_policy, max_workers=1)
                 else:
-                    messages.info(request, "Vista previa generada.")
+                    result = import_compras_excel(tmp_paths[0], dry_run=True, conflict_policy=conflict_policy)
+            if conflict_rows and conflict_policy == "ask":
+                messages.info(request, "Vista previa generada. Revisa conflictos y luego confirma importación.")
+            elif conflict_rows:
+                messages.info(request, "Vista previa generada. Los conflictos se resolverán automáticamente según la política seleccionada.")
+            else:
+                messages.info(request, "Vista previa generada.")
 
+    log_rows = import_run.rows.all()[:30] if import_run else (result.rows[:30] if result else [])
     return render(
         request,
         "pagos/import_compras.html",
         {
             "form": form,
             "result": result,
+            "log_rows": log_rows,
             "preview_rows": preview_rows,
             "conflict_rows": conflict_rows,
             "import_run": import_run,
+            "import_job": import_job,
             "conflict_policy": conflict_policy,
         },
     )
@@ -755,10 +658,15 @@ def compra_mapear_microsip_view(request, compra_id):
             messages.success(request, "Vinculación Microsip guardada. Ahora sincroniza deudas.")
             return redirect(f"/compras/{compra.id}/flujo/?step=deudas")
 
-    candidates = find_microsip_candidates_for_productor(compra.productor.nombre, limit=20)
+    # Precalculados al llegar la compra al paso "deudas"; si no están, se calculan aquí (en paralelo).
+    cached = microsip_candidates_for_productor(compra.productor)
+    candidates = cached["candidates"]
     search = (request.GET.get("search") or "").strip()
-    manual_candidates = list_all_microsip_debt_clients(search=search, limit=80) if (search or not candidates) else []
-    rfc_candidates = list_microsip_clients_by_rfc(compra.productor.rfc, limit=30) if (compra.productor.rfc or "").strip() else []
+    if search:
+        manual_candidates = list_all_microsip_debt_clients(search=search, limit=80)
+    else:
+        manual_candidates = cached["manual"] if not candidates else []
+    rfc_candidates = cached["rfc"]
 
     # Unificar candidatos: primero coincidencias por RFC, luego deuda activa; sin duplicados por cliente_id.
     unified_candidates = []
@@ -1635,7 +1543,7 @@ def compra_flujo_view(request, compra_id):
                     return redirect(f"/productores/{compra.productor.id}/editar/?next=/compras/{compra.id}/flujo/%3Fstep%3Ddeudas")
 
                 if not (compra.productor.microsip_cliente_nombre or "").strip():
-                    cands = find_microsip_candidates_for_productor(compra.productor.nombre)
+                    cands = microsip_candidates_for_productor(compra.productor)["candidates"]
                     if len(cands) != 1:
                         messages.info(request, "Selecciona el cliente Microsip para vincular este productor.")
                         return redirect(f"/compras/{compra.id}/mapear-microsip/")
@@ -1643,7 +1551,7 @@ def compra_flujo_view(request, compra_id):
                     compra.productor.microsip_cliente_id = str(cands[0].get("cliente_id") or "")
                     compra.productor.save(update_fields=["microsip_cliente_nombre", "microsip_cliente_id", "updated_at"])
 
-                snap = sync_microsip_debt_for_compra(compra)
+                snap = sync_microsip_debt_for_compra(compra, force=request.POST.get("microsip_force") == "1")
                 messages.success(
                     request,
                     f"Deuda Microsip sincronizada. USD: {snap.total_usd:,.2f} | MXN: {snap.total_mxn:,.2f}",
@@ -1808,7 +1716,7 @@ def compra_flujo_view(request, compra_id):
                     messages.error(request, "No se puede registrar pago: la factura no está validada.")
                     return redirect(f"/compras/{compra.id}/flujo/?step=pago")
 
-                beneficiary = _beneficiary_validation(compra)
+                beneficiary = beneficiary_validation(compra)
                 if beneficiary["status"] == "red":
                     messages.error(request, f"No se puede registrar pago: {beneficiary['reason']}")
                     return redirect(f"/compras/{compra.id}/flujo/?step=pago")
@@ -2134,7 +2042,7 @@ def compra_flujo_view(request, compra_id):
         if not confirmed_account:
             confirmed_account = compra.productor.cuentas_bancarias.filter(cuenta=compra.cuenta_productor).first()
 
-    beneficiary_validation = _beneficiary_validation(compra)
+    beneficiary = beneficiary_validation(compra)
     solicitud_configurada = bool(
         (compra.expected_moneda or "").strip()
         and (compra.expected_forma_pago or "").strip()
@@ -2248,7 +2156,7 @@ def compra_flujo_view(request, compra_id):
             "cuentas_productor": cuentas_productor,
             "cuentas_facturador": cuentas_facturador,
             "confirmed_account": confirmed_account,
-            "beneficiary_validation": beneficiary_validation,
+            "beneficiary_validation": beneficiary,
             "solicitud_configurada": solicitud_configurada,
             "pago_pdf_preview": pago_pdf_preview,
             "edit_bank": edit_bank,
@@ -2479,6 +2387,8 @@ def productor_edit_view(request, productor_id):
         form = ProductorForm(request.POST, instance=productor, prefix="prod")
         if form.is_valid():
             form.save()
+            if "rfc" in form.changed_data or "nombre" in form.changed_data:
+                schedule_microsip_candidates_prefetch([productor.id])
             messages.success(request, "Productor actualizado correctamente.")
             return redirect("productores_catalogo")
         messages.error(request, "Revisa los datos del productor.")